@@ -0,0 +1,74 @@
+"""Write-behind buffer for users.last_active_at heartbeats
+
+Reads such as ``GET /users/{tg_id}`` used to issue an ``UPDATE users`` on
+every call. ``ActivityTracker`` records the latest heartbeat per user in
+memory and writes the whole batch with one ``touch_last_active`` RPC every
+``ACTIVITY_FLUSH_INTERVAL_SECONDS``. ``last_active_at`` therefore lags by at
+most that interval (plus one flush round trip); ``analytics_dau`` and the
+bot's daily reminder filter work on day/week granularity and are unaffected.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from db import run_query
+
+ACTIVITY_FLUSH_INTERVAL_SECONDS = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL_SECONDS', '30'))
+
+logger = logging.getLogger("lifequest")
+
+
+class ActivityTracker:
+    def __init__(self, supabase, flush_interval: float = ACTIVITY_FLUSH_INTERVAL_SECONDS):
+        self._supabase = supabase
+        self._flush_interval = flush_interval
+        self._pending: Dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, tg_id: int) -> None:
+        """Record a heartbeat; repeated touches before a flush collapse into one"""
+        self._pending[tg_id] = datetime.utcnow().isoformat()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Write all buffered heartbeats in one statement"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        try:
+            await run_query(self._supabase.rpc('touch_last_active', {
+                'p_tg_ids': list(batch.keys()),
+                'p_seen_at': list(batch.values())
+            }))
+        except Exception as e:
+            # Put the batch back without overwriting newer heartbeats
+            for tg_id, seen_at in batch.items():
+                self._pending.setdefault(tg_id, seen_at)
+            logger.error(f"Error flushing activity heartbeats: {e}")
+            return 0
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,272 @@
+"""Background image pipeline for generated avatars
+
+n8n hands back one full-size 9:16 PNG/JPEG per avatar, which the Mini App
+used to download as-is for the home screen background and the profile
+thumbnail. After ``ingest_avatar`` records a new avatar, an
+``avatar_variants`` job fetches the image, renders AVIF and WebP copies at
+``AVATAR_VARIANT_WIDTHS`` plus a blurhash placeholder, uploads them to the
+``AVATAR_BUCKET`` Storage bucket and stores the manifest on the user row.
+Variant paths contain a hash of the source, so they are cached as immutable.
+The row is only updated while ``avatar_url`` is still the source that was
+rendered, so a slow job cannot overwrite a newer avatar's variants.
+
+Sources are only downloaded from ``AVATAR_SOURCE_HOSTS`` (by default the
+Supabase and n8n hosts), without following redirects, and the download is
+aborted as soon as it exceeds ``AVATAR_MAX_SOURCE_BYTES``.
+
+Pillow does the decoding and encoding in a small thread pool of its own
+(``AVATAR_IMAGE_WORKERS``), off the event loop and away from the Supabase
+query pool. AVIF is skipped when the installed Pillow lacks an encoder.
+"""
+import io
+import os
+import math
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Collection, FrozenSet, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # rendering unavailable; ingestion still works
+    Image = None
+
+from db import run_blocking, run_query
+
+AVATAR_BUCKET = os.environ.get('AVATAR_BUCKET', 'avatars')
+AVATAR_VARIANT_WIDTHS = tuple(int(width) for width in os.environ.get('AVATAR_VARIANT_WIDTHS', '360,720,1080').split(','))
+AVATAR_WEBP_QUALITY = int(os.environ.get('AVATAR_WEBP_QUALITY', '80'))
+AVATAR_AVIF_QUALITY = int(os.environ.get('AVATAR_AVIF_QUALITY', '55'))
+AVATAR_IMAGE_WORKERS = int(os.environ.get('AVATAR_IMAGE_WORKERS', '2'))
+AVATAR_MAX_SOURCE_BYTES = int(os.environ.get('AVATAR_MAX_SOURCE_BYTES', str(20 * 1024 * 1024)))
+
+
+def default_source_hosts() -> FrozenSet[str]:
+    """``AVATAR_SOURCE_HOSTS`` (comma-separated), else the hosts of SUPABASE_URL and N8N_WEBHOOK_URL"""
+    configured = os.environ.get('AVATAR_SOURCE_HOSTS')
+    if configured:
+        return frozenset(host.strip().lower() for host in configured.split(',') if host.strip())
+    urls = (os.environ.get('SUPABASE_URL'), os.environ.get('N8N_WEBHOOK_URL'))
+    return frozenset(urlsplit(url).hostname for url in urls if url and urlsplit(url).hostname)
+
+
+AVATAR_SOURCE_HOSTS = default_source_hosts()
+# Portrait avatars: fewer horizontal than vertical components
+BLURHASH_COMPONENTS = (3, 5)
+BLURHASH_SAMPLE_WIDTH = 32
+CACHE_CONTROL_SECONDS = '31536000'
+
+CONTENT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+logger = logging.getLogger("lifequest")
+
+
+def _base83(value: int, length: int) -> str:
+    return ''.join(BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exponent: float) -> float:
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash_encode(pixels: Sequence[Tuple[int, int, int]], width: int, height: int, components: Tuple[int, int] = BLURHASH_COMPONENTS) -> str:
+    """Blurhash of row-major RGB ``pixels`` (see blurha.sh); sample a small thumbnail, not the full image"""
+    x_components, y_components = components
+    linear = [tuple(_srgb_to_linear(channel) for channel in pixel[:3]) for pixel in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                basis_y = normalisation * cos_y[j][y]
+                for x in range(width):
+                    basis = basis_y * cos_x[i][x]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(channel) for factor in ac for channel in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        max_value = 1.0
+        result += _base83(0, 1)
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    def quantise(value: float) -> int:
+        return max(0, min(18, int(math.floor(_sign_pow(value / max_value, 0.5) * 9 + 9.5))))
+
+    for r, g, b in ac:
+        result += _base83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+
+def available_formats() -> Tuple[str, ...]:
+    """Variant formats the installed Pillow can encode, best first"""
+    if Image is None:
+        return ()
+    return tuple(fmt for fmt in ('avif', 'webp') if features.check(fmt))
+
+
+def render_variants(
+    data: bytes,
+    widths: Sequence[int] = AVATAR_VARIANT_WIDTHS,
+    formats: Optional[Sequence[str]] = None
+) -> Tuple[List[dict], str]:
+    """Encoded variants (``format``, ``width``, ``height``, ``data``) and the blurhash of an image"""
+    if Image is None:
+        raise RuntimeError("Pillow is required to render avatar variants")
+    formats = available_formats() if formats is None else formats
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+
+    # Never upscale: widths beyond the source collapse into one full-width variant
+    targets = sorted({min(width, image.width) for width in widths})
+    variants = []
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for fmt in formats:
+            buffer = io.BytesIO()
+            if fmt == 'avif':
+                resized.save(buffer, format='AVIF', quality=AVATAR_AVIF_QUALITY)
+            else:
+                resized.save(buffer, format='WEBP', quality=AVATAR_WEBP_QUALITY, method=4)
+            variants.append({'format': fmt, 'width': width, 'height': height, 'data': buffer.getvalue()})
+
+    sample = image.copy()
+    sample.thumbnail((BLURHASH_SAMPLE_WIDTH, BLURHASH_SAMPLE_WIDTH * 4))
+    raw = sample.tobytes()
+    pixels = [tuple(raw[i:i + 3]) for i in range(0, len(raw), 3)]
+    blurhash = blurhash_encode(pixels, sample.width, sample.height)
+    return variants, blurhash
+
+
+def is_allowed_source(url: str, hosts: Collection[str] = AVATAR_SOURCE_HOSTS) -> bool:
+    """Whether an avatar URL points at one of the trusted hosts over HTTP(S)"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    return parts.scheme in ('https', 'http') and (parts.hostname or '') in hosts
+
+
+def variant_path(user_id: str, level: int, digest: str, width: int, fmt: str) -> str:
+    return f"{user_id}/{level}-{digest[:16]}-{width}.{fmt}"
+
+
+class AvatarImagePipeline:
+    def __init__(
+        self,
+        supabase,
+        http: Callable,
+        bucket: str = AVATAR_BUCKET,
+        widths: Sequence[int] = AVATAR_VARIANT_WIDTHS,
+        formats: Optional[Sequence[str]] = None,
+        workers: int = AVATAR_IMAGE_WORKERS,
+        max_source_bytes: int = AVATAR_MAX_SOURCE_BYTES,
+        source_hosts: Collection[str] = AVATAR_SOURCE_HOSTS
+    ):
+        self._supabase = supabase
+        # Returns the httpx client to download with (resolved per call: it is created on startup)
+        self._http = http
+        self._bucket = bucket
+        self._widths = tuple(widths)
+        self._formats = formats
+        self._max_source_bytes = max_source_bytes
+        self._source_hosts = frozenset(source_hosts)
+        self._workers = workers
+        # Created on first use and dropped by shutdown(), so a later lifespan gets a new pool
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def fetch(self, url: str) -> bytes:
+        """Download a source image from a trusted host, at most ``max_source_bytes`` of it"""
+        if not is_allowed_source(url, self._source_hosts):
+            raise ValueError(f"Avatar source host is not allowed: {urlsplit(url).hostname}")
+        async with self._http().stream('GET', url, follow_redirects=False) as response:
+            if response.is_redirect:
+                raise ValueError(f"Avatar source redirects ({response.status_code}); redirects are not followed")
+            response.raise_for_status()
+            declared = response.headers.get('content-length')
+            if declared and declared.isdigit() and int(declared) > self._max_source_bytes:
+                raise ValueError(f"Avatar source is {declared} bytes, over {self._max_source_bytes}")
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > self._max_source_bytes:
+                    raise ValueError(f"Avatar source exceeds {self._max_source_bytes} bytes")
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def _upload(self, path: str, fmt: str, data: bytes) -> str:
+        storage = self._supabase.storage.from_(self._bucket)
+        await run_blocking(storage.upload, path, data, {
+            'content-type': CONTENT_TYPES[fmt],
+            'cache-control': CACHE_CONTROL_SECONDS,
+            'upsert': 'true'
+        })
+        return storage.get_public_url(path)
+
+    async def process(self, payload: dict) -> List[dict]:
+        """Render, upload and attach the variants of ``payload['source_url']``; returns the updated user rows"""
+        source_url = payload['source_url']
+        data = await self.fetch(source_url)
+        digest = hashlib.sha256(data).hexdigest()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='avatar-images')
+        loop = asyncio.get_running_loop()
+        variants, blurhash = await loop.run_in_executor(self._executor, render_variants, data, self._widths, self._formats)
+
+        urls = await asyncio.gather(*(
+            self._upload(
+                variant_path(payload['user_id'], payload['level'], digest, variant['width'], variant['format']),
+                variant['format'],
+                variant['data']
+            )
+            for variant in variants
+        ))
+        manifest = [
+            {'format': variant['format'], 'width': variant['width'], 'height': variant['height'], 'url': url}
+            for variant, url in zip(variants, urls)
+        ]
+        result = await run_query(self._supabase.table('users').update({
+            'avatar_variants': manifest,
+            'avatar_blurhash': blurhash,
+            'updated_at': datetime.utcnow().isoformat()
+        }).eq('id', payload['user_id']).eq('avatar_url', source_url))
+        if not result.data:
+            logger.info(f"Avatar of user {payload['user_id']} changed while rendering; variants discarded")
+        return result.data or []
+
+    def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,250 @@
+"""
+Offline API benchmark against an in-memory Supabase
+
+Imports the real FastAPI app with ``FakeSupabase`` in place of the Supabase
+client and drives it in-process through httpx's ASGI transport, so the
+middleware, validation, caches and handlers all run but no network or
+database is needed. Each PostgREST round trip costs ``--latency-ms``.
+
+Scenarios run in order, each at ``--concurrency`` concurrent requests:
+register_user, complete_onboarding, get_quests and ``--completions``
+complete_quest calls per user. For every scenario the throughput,
+p50/p95/p99 latency and Supabase round trips per request (from the
+``X-Query-Count`` header) are reported.
+
+``--save-baseline`` stores the results in ``benchmarks/baseline.json``;
+``--check`` compares a run against it and exits with status 1 when a p95
+regresses by more than ``--tolerance`` or a scenario needs more round trips,
+so the run can gate CI. Baselines are only comparable for the same
+latency/concurrency settings, which are stored alongside them.
+
+The committed baseline was recorded with the default settings. Round trips
+per request are deterministic, but latencies depend on the machine: after a
+change that legitimately moves the numbers, or to gate on a different (e.g.
+CI) machine, rerun ``--save-baseline`` there with the default settings and
+commit the new ``baseline.json``. On small or shared runners a larger
+``--tolerance`` (0.5) keeps scheduler noise from failing the check.
+
+Usage:
+    python benchmarks/bench_api.py --users 200 --concurrency 20 --latency-ms 15
+    python benchmarks/bench_api.py --save-baseline
+    python benchmarks/bench_api.py --check --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+TG_ID_OFFSET = 900_000_000
+
+
+def percentile(samples, fraction: float) -> float:
+    """Nearest-rank percentile of ``samples``"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered), math.ceil(fraction * len(ordered))) - 1)
+    return ordered[index]
+
+
+def load_app(fake: FakeSupabase, mode: str):
+    """Import ``server`` with the fake standing in for ``supabase_client``"""
+    module = types.ModuleType('supabase_client')
+    module.supabase = fake
+    module.get_supabase = lambda: fake
+    sys.modules['supabase_client'] = module
+    os.environ['QUEST_COMPLETION_MODE'] = mode
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Avatar jobs are queued into outbound_jobs but no worker runs them
+    os.environ.setdefault('N8N_WEBHOOK_URL', 'http://n8n.invalid/webhook/avatar')
+    import server
+    return server
+
+
+class Scenario:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.query_counts = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def summary(self) -> dict:
+        count = len(self.latencies)
+        return {
+            'requests': count,
+            'errors': self.errors,
+            'throughput': round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': round(percentile(self.latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(self.latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(self.latencies, 0.99) * 1000, 2),
+            'queries_per_request': round(sum(self.query_counts) / count, 2) if count else 0.0
+        }
+
+
+async def run_scenario(name: str, calls, concurrency: int) -> Scenario:
+    """Run ``calls`` (zero-argument coroutine factories returning responses) at ``concurrency``"""
+    scenario = Scenario(name)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(call):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await call()
+            scenario.latencies.append(time.perf_counter() - start)
+            scenario.query_counts.append(int(response.headers.get('x-query-count', 0)))
+            if response.status_code >= 400:
+                scenario.errors += 1
+            return response
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(timed(call) for call in calls))
+    scenario.elapsed = time.perf_counter() - start
+    scenario.responses = responses
+    return scenario
+
+
+async def run_benchmark(args) -> dict:
+    import httpx
+
+    fake = FakeSupabase(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000)
+    server = load_app(fake, args.mode)
+    transport = httpx.ASGITransport(app=server.app)
+    tg_ids = [TG_ID_OFFSET + index for index in range(args.users)]
+    results = {}
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        def register(tg_id):
+            return lambda: client.post('/api/users/register', json={
+                'tg_id': tg_id, 'username': f"bench_{tg_id}", 'first_name': 'Bench', 'language_code': 'ru'
+            })
+
+        def onboard(tg_id):
+            return lambda: client.post(f'/api/users/{tg_id}/onboarding', json={
+                'age': 30, 'gender': 'male', 'branch': 'power', 'goal_text': 'Bench goal', 'goal_level': 3
+            })
+
+        def quests(tg_id):
+            return lambda: client.get(f'/api/users/{tg_id}/quests')
+
+        def complete(tg_id, quest_id):
+            return lambda: client.post(f'/api/users/{tg_id}/quests/complete', json={'quest_id': quest_id})
+
+        phases = [
+            ('register_user', [register(tg_id) for tg_id in tg_ids]),
+            ('complete_onboarding', [onboard(tg_id) for tg_id in tg_ids]),
+            ('get_quests', [quests(tg_id) for tg_id in tg_ids]),
+        ]
+        quests_by_user = {}
+        for name, calls in phases:
+            scenario = await run_scenario(name, calls, args.concurrency)
+            results[name] = scenario.summary()
+            if name == 'get_quests':
+                for tg_id, response in zip(tg_ids, scenario.responses):
+                    quests_by_user[tg_id] = [quest['id'] for quest in response.json()] if response.status_code == 200 else []
+
+        completions = [
+            complete(tg_id, quest_id)
+            for step in range(args.completions)
+            for tg_id in tg_ids
+            for quest_id in quests_by_user.get(tg_id, [])[step:step + 1]
+        ]
+        scenario = await run_scenario('complete_quest', completions, args.concurrency)
+        results['complete_quest'] = scenario.summary()
+
+    server.shutdown_executor()
+    return results
+
+
+def config_of(args) -> dict:
+    return {
+        'mode': args.mode,
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'completions': args.completions
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of ``results`` against ``baseline`` as human-readable strings"""
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if current['errors']:
+            regressions.append(f"{name}: {current['errors']} failed requests")
+        if reference is None:
+            continue
+        if current['p95_ms'] > reference['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms > baseline {reference['p95_ms']}ms +{tolerance:.0%}")
+        if current['queries_per_request'] > reference['queries_per_request'] + 0.01:
+            regressions.append(
+                f"{name}: {current['queries_per_request']} round trips/request > baseline {reference['queries_per_request']}"
+            )
+    return regressions
+
+
+def print_report(results: dict) -> None:
+    print(f"{'scenario':<22}{'reqs':>6}{'errs':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    for name, row in results.items():
+        print(
+            f"{name:<22}{row['requests']:>6}{row['errors']:>6}{row['throughput']:>9}"
+            f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['queries_per_request']:>9}"
+        )
+
+
+def main(args) -> int:
+    results = asyncio.run(run_benchmark(args))
+    print_report(results)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({'config': config_of(args), 'scenarios': results}, indent=2) + '\n')
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if args.check:
+        if not args.baseline.exists():
+            print(f"no baseline at {args.baseline}; create one with --save-baseline")
+            return 1
+        stored = json.loads(args.baseline.read_text())
+        if stored.get('config') != config_of(args):
+            print(f"baseline was recorded with {stored.get('config')}, rerun with the same settings")
+            return 1
+        regressions = compare(results, stored['scenarios'], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("no regressions against baseline")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=15.0, help='fake PostgREST round trip')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='random extra latency per round trip')
+    parser.add_argument('--completions', type=int, default=3, help='complete_quest calls per user')
+    parser.add_argument('--mode', choices=('rpc', 'legacy'), default='rpc', help='QUEST_COMPLETION_MODE')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='fail on regressions against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown')
+    return parser
+
+
+if __name__ == '__main__':
+    sys.exit(main(build_parser().parse_args()))
@@ -0,0 +1,97 @@
+"""
+Daily reminder broadcast benchmark
+
+Drives the old sequential reminder loop and ``BroadcastEngine`` against a fake
+Bot API that adds network latency and answers ``429 retry_after`` once more
+than ``--api-limit`` messages are sent within a second, like Telegram does.
+
+Usage:
+    python benchmarks/bench_broadcast.py --users 600 --latency-ms 60
+"""
+import argparse
+import asyncio
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from broadcast import BroadcastEngine, MemoryCheckpointStore  # noqa: E402
+
+
+class FakeRetryAfter(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class FakeBotApi:
+    def __init__(self, latency: float, limit: int):
+        self.latency = latency
+        self.limit = limit
+        self.window = deque()
+        self.delivered = 0
+        self.rejected = 0
+
+    async def send_message(self, chat_id: int) -> None:
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        while self.window and now - self.window[0] > 1.0:
+            self.window.popleft()
+        if len(self.window) >= self.limit:
+            self.rejected += 1
+            raise FakeRetryAfter(1)
+        self.window.append(now)
+        self.delivered += 1
+
+
+def memory_pages(total: int):
+    async def fetch_page(after_tg_id, limit):
+        start = 0 if after_tg_id is None else after_tg_id + 1
+        return [{'tg_id': tg_id} for tg_id in range(start, min(total, start + limit))]
+    return fetch_page
+
+
+async def legacy_loop(bot: FakeBotApi, users: int) -> None:
+    for tg_id in range(users):
+        try:
+            await bot.send_message(tg_id)
+            await asyncio.sleep(0.1)
+        except Exception:
+            pass
+
+
+async def main(args):
+    latency = args.latency_ms / 1000
+
+    bot = FakeBotApi(latency, args.api_limit)
+    start = time.perf_counter()
+    await legacy_loop(bot, args.users)
+    elapsed = time.perf_counter() - start
+    print(f"legacy loop      {bot.delivered}/{args.users} delivered in {elapsed:.1f}s -> {bot.delivered / elapsed:.1f} msgs/s")
+
+    bot = FakeBotApi(latency, args.api_limit)
+    engine = BroadcastEngine(
+        send=bot.send_message,
+        fetch_page=memory_pages(args.users),
+        checkpoints=MemoryCheckpointStore(),
+        rate=args.rate,
+        concurrency=args.concurrency,
+        page_size=args.page_size
+    )
+    report = await engine.run('bench')
+    print(f"broadcast engine {report} (api rejected {bot.rejected})")
+    hours = 100_000 / max(report.messages_per_second, 1e-9) / 3600
+    print(f"projected time for 100k users: {hours:.2f} h")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=600)
+    parser.add_argument('--latency-ms', type=float, default=60.0, help='fake Bot API latency')
+    parser.add_argument('--api-limit', type=int, default=30, help='messages per second before 429')
+    parser.add_argument('--rate', type=float, default=25.0, help='engine token bucket rate')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--page-size', type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""
+Event loop blocking benchmark
+
+Simulates concurrent API requests that each issue a few PostgREST round trips
+and compares calling the synchronous ``.execute()`` inline (the old handler
+behaviour) against ``db.run_query``. No network access is needed: the fake
+query sleeps on the calling thread for the configured latency, exactly like a
+blocking httpx request would.
+
+Usage:
+    python benchmarks/bench_event_loop.py --requests 200 --queries 3 --latency-ms 40
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import run_query, shutdown_executor  # noqa: E402
+
+
+class FakeQuery:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def execute(self):
+        time.sleep(self.latency)
+        return {'data': []}
+
+
+async def blocking_request(queries: int, latency: float):
+    for _ in range(queries):
+        FakeQuery(latency).execute()
+
+
+async def offloaded_request(queries: int, latency: float):
+    for _ in range(queries):
+        await run_query(FakeQuery(latency))
+
+
+async def drive(handler, requests: int, queries: int, latency: float):
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(queries, latency) for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    latency = args.latency_ms / 1000
+    for name, handler in (('inline execute()', blocking_request), ('run_query', offloaded_request)):
+        elapsed = await drive(handler, args.requests, args.queries, latency)
+        print(f"{name:<18} {args.requests} requests in {elapsed:.2f}s -> {args.requests / elapsed:.1f} req/s")
+    shutdown_executor()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=3, help='round trips per request')
+    parser.add_argument('--latency-ms', type=float, default=40.0, help='simulated PostgREST latency')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,95 @@
+"""
+Outbound HTTP client microbenchmark
+
+Starts a local keep-alive stub server that answers like Telegram's sendMessage
+and compares per-call latency of opening an ``httpx.AsyncClient`` per request
+(the old behaviour) against the shared pooled client from ``http_client``.
+The stub speaks plain HTTP on localhost, so the numbers only show the TCP
+setup saved; against api.telegram.org the TLS handshake widens the gap.
+
+Usage:
+    python benchmarks/bench_http_client.py --calls 300 --concurrency 10
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from http_client import OutboundHttp  # noqa: E402
+
+STUB_RESPONSE = b'{"ok":true,"result":{"message_id":1}}'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(STUB_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(STUB_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def per_call_client(url: str, payload: dict) -> None:
+    async with httpx.AsyncClient() as client:
+        await client.post(url, json=payload, timeout=10.0)
+
+
+async def run(name: str, send, calls: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await send({'chat_id': i, 'text': 'ping'})
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<20} mean {statistics.mean(latencies) * 1000:6.2f} ms  "
+        f"p95 {p95 * 1000:6.2f} ms  {calls / elapsed:7.1f} calls/s"
+    )
+
+
+async def main(args):
+    server = start_stub_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/botTOKEN/sendMessage"
+    shared = OutboundHttp()
+    shared.start()
+    try:
+        await run('client per call', lambda payload: per_call_client(url, payload), args.calls, args.concurrency)
+        await run('shared pooled client', lambda payload: shared.n8n.post(url, json=payload), args.calls, args.concurrency)
+    finally:
+        await shared.aclose()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,102 @@
+"""
+Response serialization and compression benchmark
+
+Measures the CPU per response and the bytes on the wire for the quests and
+goals payloads under three serialization paths:
+
+- ``validate+json``: FastAPI's default, response_model validation and
+  re-serialization, then ``json.dumps`` (JSONResponse)
+- ``validate+orjson``: the same validation, rendered by ORJSONResponse
+- ``trusted+orjson``: ``server.trusted_response``, projection onto the model
+  without validation, rendered by orjson
+
+Each body is also compressed with gzip and, when the ``brotli`` package is
+installed, brotli at the levels the middleware uses.
+
+Usage:
+    python benchmarks/bench_serialization.py --goals 100 --iterations 2000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from compression import brotli, compress  # noqa: E402
+from fake_supabase import FakeSupabase, seed_quests  # noqa: E402
+from bench_api import load_app  # noqa: E402
+
+
+def goal_rows(count: int) -> List[dict]:
+    """Goal rows shaped like a ``select('*')`` from the goals table"""
+    return [
+        {
+            'id': f'00000000-0000-4000-8000-{index:012d}', 'user_id': '11111111-1111-4111-8111-111111111111',
+            'goal_text': f'Пробежать полумарафон #{index}', 'goal_level': 10 + index % 20,
+            'is_completed': index % 3 == 0, 'completed_at': None, 'notified_at': None, 'archived_at': None,
+            'notes': 'Тренировки три раза в неделю', 'image_url': None,
+            'created_at': f'2026-01-{1 + index % 28:02d}T10:00:00.000000+00:00',
+            'updated_at': f'2026-01-{1 + index % 28:02d}T10:00:00.000000+00:00'
+        }
+        for index in range(count)
+    ]
+
+
+def serializers(server, model, exclude_unset: bool):
+    from fastapi.responses import ORJSONResponse
+    from pydantic import TypeAdapter
+    from starlette.responses import JSONResponse, Response
+
+    adapter = TypeAdapter(List[model])
+
+    def validated(rows):
+        return adapter.dump_python(adapter.validate_python(rows), mode='json', exclude_unset=exclude_unset)
+
+    def trusted(rows):
+        # FastAPI injects a header-only Response without content-length
+        response = Response()
+        del response.headers['content-length']
+        return server.trusted_response(rows, model, response, exclude_unset=exclude_unset).body
+
+    return {
+        'validate+json': lambda rows: JSONResponse(validated(rows)).body,
+        'validate+orjson': lambda rows: ORJSONResponse(validated(rows)).body,
+        'trusted+orjson': trusted
+    }
+
+
+def cpu_per_call(render, rows, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        render(rows)
+    return (time.process_time() - start) / iterations
+
+
+def main(args):
+    server = load_app(FakeSupabase(), 'rpc')
+    server.SKIP_RESPONSE_VALIDATION = True
+    quests = [dict(quest, is_completed=index % 2 == 0) for index, quest in enumerate(seed_quests())]
+    payloads = (
+        ('quests', quests, server.Quest, False),
+        ('goals', goal_rows(args.goals), server.Goal, True)
+    )
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+
+    print(f"{'payload':<8}{'path':<18}{'us/resp':>9}{'bytes':>8}" + ''.join(f"{encoding:>8}" for encoding in encodings))
+    for name, rows, model, exclude_unset in payloads:
+        for path, render in serializers(server, model, exclude_unset).items():
+            micros = cpu_per_call(render, rows, args.iterations) * 1e6
+            body = render(rows)
+            sizes = ''.join(f"{len(compress(body, encoding)):>8}" for encoding in encodings)
+            print(f"{name:<8}{path:<18}{micros:>9.1f}{len(body):>8}{sizes}")
+    server.shutdown_executor()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--goals', type=int, default=100, help='goals in the goals payload')
+    parser.add_argument('--iterations', type=int, default=2000)
+    main(parser.parse_args())
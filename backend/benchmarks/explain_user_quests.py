@@ -0,0 +1,183 @@
+"""
+EXPLAIN benchmark for the today-lookup on a partitioned user_quests
+
+Builds a scratch schema in a real Postgres (``--dsn`` or ``DATABASE_URL``,
+e.g. the Supabase direct connection string) with the same layout as
+supabase_schema.sql, fills it with ``--rows`` synthetic completions spread
+over ``--days`` days and ``--users`` users, vacuums it, then runs
+
+    SELECT quest_id FROM user_quests WHERE user_id = ? AND completion_date = CURRENT_DATE
+
+under ``EXPLAIN (ANALYZE, BUFFERS)`` for a sample of users. For every run it
+reports the scan node, the partitions touched, heap fetches, buffers and
+execution time, and exits with status 1 unless each lookup is an Index Only
+Scan on today's partition alone. ``--legacy`` also loads an unpartitioned
+copy with the old single-column indexes for comparison.
+
+Talks to the database through ``psql`` so no driver has to be installed.
+Loading 100M rows takes a while and several GB; ``--keep`` leaves the schema
+in place so reruns can pass ``--skip-load``.
+
+Usage:
+    python benchmarks/explain_user_quests.py --dsn postgresql://... --rows 100000000
+    python benchmarks/explain_user_quests.py --rows 1000000 --users 10000 --legacy
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+SCHEMA = 'bench_user_quests'
+
+
+def psql(dsn: str, sql: str) -> str:
+    completed = subprocess.run(
+        ['psql', dsn, '-X', '-q', '-A', '-t', '-v', 'ON_ERROR_STOP=1', '-c', sql],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise SystemExit(completed.stderr.strip())
+    return completed.stdout.strip()
+
+
+def month_starts(first: date, last: date):
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+def create_layout(dsn: str, days: int, legacy: bool) -> None:
+    today = date.today()
+    statements = [
+        f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+        f"CREATE SCHEMA {SCHEMA}",
+        f"""CREATE TABLE {SCHEMA}.user_quests (
+            id UUID DEFAULT gen_random_uuid(),
+            user_id UUID,
+            quest_id UUID,
+            completed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            completion_date DATE NOT NULL DEFAULT CURRENT_DATE,
+            is_today BOOLEAN DEFAULT TRUE,
+            PRIMARY KEY (id, completion_date),
+            UNIQUE (user_id, quest_id, completion_date)
+        ) PARTITION BY RANGE (completion_date)""",
+        f"CREATE TABLE {SCHEMA}.user_quests_default PARTITION OF {SCHEMA}.user_quests DEFAULT",
+        f"CREATE INDEX idx_user_quests_user_date ON {SCHEMA}.user_quests(user_id, completion_date) INCLUDE (quest_id)",
+    ]
+    for month in month_starts(today - timedelta(days=days - 1), today + timedelta(days=31)):
+        name = f"user_quests_{month:%Y_%m}"
+        upper = (month + timedelta(days=32)).replace(day=1)
+        statements.append(
+            f"CREATE TABLE {SCHEMA}.{name} PARTITION OF {SCHEMA}.user_quests FOR VALUES FROM ('{month}') TO ('{upper}')"
+            " WITH (autovacuum_vacuum_insert_scale_factor = 0.01, autovacuum_vacuum_insert_threshold = 10000)"
+        )
+    if legacy:
+        statements += [
+            f"""CREATE TABLE {SCHEMA}.user_quests_legacy (
+                id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                user_id UUID,
+                quest_id UUID,
+                completed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                completion_date DATE DEFAULT CURRENT_DATE,
+                is_today BOOLEAN DEFAULT TRUE,
+                UNIQUE (user_id, quest_id, completion_date)
+            )""",
+            f"CREATE INDEX idx_legacy_user_id ON {SCHEMA}.user_quests_legacy(user_id)",
+            f"CREATE INDEX idx_legacy_date ON {SCHEMA}.user_quests_legacy(completion_date)",
+        ]
+    for statement in statements:
+        psql(dsn, statement)
+
+
+def load(dsn: str, table: str, rows: int, users: int, days: int, batch: int) -> None:
+    """Row g is day g % days of user (g / days) % users doing quest g / (days * users): all unique"""
+    for start in range(0, rows, batch):
+        end = min(start + batch, rows) - 1
+        began = time.perf_counter()
+        psql(dsn, f"""
+            INSERT INTO {SCHEMA}.{table} (user_id, quest_id, completion_date)
+            SELECT
+                md5('user' || ((g / {days}) % {users}))::uuid,
+                md5('quest' || (g / ({days}::bigint * {users})))::uuid,
+                CURRENT_DATE - (g % {days})::int
+            FROM generate_series({start}::bigint, {end}::bigint) AS g
+        """)
+        print(f"  {table}: {end + 1:>12,} / {rows:,} rows ({time.perf_counter() - began:.1f}s)", flush=True)
+    psql(dsn, f"VACUUM (ANALYZE) {SCHEMA}.{table}")
+
+
+def plan_nodes(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(dsn: str, table: str, user_index: int) -> dict:
+    output = psql(dsn, f"""
+        EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+        SELECT quest_id FROM {SCHEMA}.{table}
+        WHERE user_id = md5('user' || {user_index})::uuid AND completion_date = CURRENT_DATE
+    """)
+    plan = json.loads(output)[0]
+    scans = [node for node in plan_nodes(plan['Plan']) if 'Relation Name' in node]
+    return {
+        'scans': [(node['Node Type'], node['Relation Name'], node.get('Index Name')) for node in scans],
+        'heap_fetches': sum(node.get('Heap Fetches', 0) for node in scans),
+        'buffers': plan['Plan'].get('Shared Hit Blocks', 0) + plan['Plan'].get('Shared Read Blocks', 0),
+        'execution_ms': plan['Execution Time'],
+    }
+
+
+def report(dsn: str, table: str, samples: int, users: int) -> bool:
+    today_partition = f"user_quests_{date.today():%Y_%m}"
+    index_only = True
+    print(f"\n{table}")
+    for sample in range(samples):
+        result = explain(dsn, table, (sample * 7919) % users)
+        nodes = ', '.join(f"{node_type} on {relation}" + (f" using {index}" if index else '') for node_type, relation, index in result['scans'])
+        print(f"  {nodes}; heap fetches {result['heap_fetches']}, buffers {result['buffers']}, {result['execution_ms']:.3f} ms")
+        if table == 'user_quests':
+            index_only &= all(
+                node_type == 'Index Only Scan' and relation == today_partition
+                for node_type, relation, _ in result['scans']
+            )
+    return index_only
+
+
+def main(args) -> int:
+    if not args.dsn:
+        print("pass --dsn or set DATABASE_URL")
+        return 1
+    if not args.skip_load:
+        create_layout(args.dsn, args.days, args.legacy)
+        load(args.dsn, 'user_quests', args.rows, args.users, args.days, args.batch)
+        if args.legacy:
+            load(args.dsn, 'user_quests_legacy', args.rows, args.users, args.days, args.batch)
+    print(psql(args.dsn, f"SELECT 'partitioned size ' || pg_size_pretty(SUM(pg_total_relation_size(inhrelid))) FROM pg_inherits WHERE inhparent = '{SCHEMA}.user_quests'::regclass"))
+
+    index_only = report(args.dsn, 'user_quests', args.samples, args.users)
+    if args.legacy:
+        report(args.dsn, 'user_quests_legacy', args.samples, args.users)
+    if not args.keep:
+        psql(args.dsn, f"DROP SCHEMA {SCHEMA} CASCADE")
+
+    print("\ntoday-lookup is an index-only scan of today's partition" if index_only else "\nREGRESSION: today-lookup is not index-only on one partition")
+    return 0 if index_only else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--rows', type=int, default=100_000_000)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=365, help='history spread over this many days up to today')
+    parser.add_argument('--batch', type=int, default=5_000_000, help='rows per INSERT')
+    parser.add_argument('--samples', type=int, default=5, help='users to EXPLAIN')
+    parser.add_argument('--legacy', action='store_true', help='also load the unpartitioned layout')
+    parser.add_argument('--skip-load', action='store_true', help='reuse a schema left by --keep')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch schema')
+    sys.exit(main(parser.parse_args()))
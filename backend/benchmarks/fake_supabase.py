@@ -0,0 +1,497 @@
+"""
+In-memory stand-in for the Supabase client used by the offline benchmarks
+
+Implements the slice of the supabase-py / PostgREST builder API the backend
+calls (select/insert/upsert/update/delete, eq/neq/gt/gte/lt/lte/in_/is_,
+order/limit/range) plus Python ports of the Postgres functions in
+``supabase_schema.sql``. Every ``execute()`` sleeps for the configured
+latency first, standing in for the HTTP round trip to PostgREST, so the
+number of round trips a handler makes shows up in its latency just as it
+does in production. Builders expose ``path``/``http_method``/``headers``
+like the real ones, so metrics and query tracing label them correctly.
+"""
+import re
+import time
+import uuid
+import random
+import threading
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from leveling import level_for_total_xp
+from streaks import Streak, advance, current_streak
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / 'supabase_schema.sql'
+
+TABLE_DEFAULTS = {
+    'users': lambda: {
+        'language_code': 'en', 'age': None, 'gender': None, 'avatar_url': None, 'selfie_url': None,
+        'active_branches': ['power'], 'is_pro': False, 'pro_expires_at': None,
+        'strength': 1, 'health': 1, 'intellect': 1, 'agility': 1, 'confidence': 1, 'stability': 1,
+        'last_active_at': datetime.utcnow().isoformat(), 'revision': 0,
+        'avatar_variants': None, 'avatar_blurhash': None
+    },
+    'progress': lambda: {
+        'current_level': 1, 'current_xp': 0, 'next_level_xp': 100, 'total_xp': 0,
+        'goal_text': None, 'goal_level': 10, 'goal_progress': 0
+    },
+    'goals': lambda: {
+        'goal_level': 10, 'is_completed': False, 'completed_at': None, 'notified_at': None, 'notify_claimed_at': None,
+        'notes': None, 'image_url': None
+    },
+    'user_quests': lambda: {'is_today': True},
+    'avatar_generations': lambda: {'level': None, 'avatar_url': None, 'generation_status': 'pending'},
+    'outbound_jobs': lambda: {'status': 'pending', 'attempts': 0, 'last_error': None},
+}
+
+UNIQUE_KEYS = {
+    'users': ('tg_id',),
+    'progress': ('user_id',),
+    'user_quests': ('user_id', 'quest_id', 'completion_date'),
+    'outbound_jobs': ('dedupe_key',),
+    'user_daily_stats': ('user_id', 'stat_date'),
+    'user_streaks': ('user_id',),
+}
+
+BRANCH_BONUSES = {
+    'power': {'strength': 2, 'confidence': 1},
+    'stability': {'stability': 2, 'intellect': 1},
+    'longevity': {'health': 2, 'agility': 1},
+}
+
+
+class FakeAPIError(Exception):
+    """Raised where PostgREST would answer with an error status"""
+
+
+class FakeResult:
+    def __init__(self, data, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def seed_quests(schema_path: Path = SCHEMA_PATH) -> List[dict]:
+    """Quest catalog parsed from the ``INSERT INTO quests`` seed in the schema"""
+    rows = re.findall(
+        r"\('([^']*)', '([^']*)', '(\w+)', (\d+), '(\w+)', (true|false), (\d+)\)",
+        schema_path.read_text(encoding='utf-8')
+    )
+    return [
+        {
+            'id': str(uuid.uuid4()), 'title': title, 'description': description, 'branch': branch,
+            'xp_reward': int(xp), 'category': category, 'is_daily': is_daily == 'true',
+            'sort_order': int(sort_order)
+        }
+        for title, description, branch, xp, category, is_daily, sort_order in rows
+    ]
+
+
+def _project(row: dict, columns: str) -> dict:
+    if columns.strip() in ('*', ''):
+        return dict(row)
+    return {column.strip(): row.get(column.strip()) for column in columns.split(',')}
+
+
+class FakeQuery:
+    def __init__(self, db: 'FakeSupabase', table: str):
+        self._db = db
+        self.table = table
+        self.path = f"/{table}"
+        self.http_method = 'GET'
+        self.headers: Dict[str, str] = {}
+        self._operation = 'select'
+        self._columns = '*'
+        self._count = None
+        self._values = None
+        self._on_conflict: tuple = ()
+        self._ignore_duplicates = False
+        self._filters: List[Callable[[dict], bool]] = []
+        self._order: List[tuple] = []
+        self._offset = 0
+        self._limit: Optional[int] = None
+
+    # Operations
+    def select(self, columns: str = '*', count: Optional[str] = None):
+        self._columns = columns
+        self._count = count
+        return self
+
+    def insert(self, values):
+        self._operation, self.http_method, self._values = 'insert', 'POST', values
+        return self
+
+    def upsert(self, values, on_conflict: str = '', ignore_duplicates: bool = False):
+        self._operation, self.http_method, self._values = 'upsert', 'POST', values
+        self._on_conflict = tuple(column.strip() for column in on_conflict.split(',') if column.strip())
+        self._ignore_duplicates = ignore_duplicates
+        resolution = 'ignore-duplicates' if ignore_duplicates else 'merge-duplicates'
+        self.headers['prefer'] = f"resolution={resolution}"
+        return self
+
+    def update(self, values):
+        self._operation, self.http_method, self._values = 'update', 'PATCH', values
+        return self
+
+    def delete(self):
+        self._operation, self.http_method = 'delete', 'DELETE'
+        return self
+
+    # Filters and modifiers
+    def _filter(self, predicate):
+        self._filters.append(predicate)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(lambda row: row.get(column) == value)
+
+    def neq(self, column, value):
+        return self._filter(lambda row: row.get(column) != value)
+
+    def gt(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] > value)
+
+    def gte(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] >= value)
+
+    def lt(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] < value)
+
+    def lte(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] <= value)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._filter(lambda row: row.get(column) in values)
+
+    def is_(self, column, value):
+        expected = None if value in (None, 'null') else value
+        return self._filter(lambda row: row.get(column) is expected or row.get(column) == expected)
+
+    def order(self, column, desc: bool = False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def execute(self) -> FakeResult:
+        self._db.round_trip()
+        with self._db.lock:
+            return getattr(self, f"_execute_{self._operation}")()
+
+    # Execution
+    def _matching(self) -> List[dict]:
+        return [row for row in self._db.tables.setdefault(self.table, []) if all(f(row) for f in self._filters)]
+
+    def _execute_select(self) -> FakeResult:
+        rows = self._matching()
+        for column, desc in reversed(self._order):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        total = len(rows)
+        end = None if self._limit is None else self._offset + self._limit
+        rows = rows[self._offset:end]
+        return FakeResult([_project(row, self._columns) for row in rows], total if self._count else None)
+
+    def _existing(self, row: dict, keys: tuple) -> Optional[dict]:
+        if not keys or any(row.get(key) is None for key in keys):
+            return None
+        for existing in self._db.tables.setdefault(self.table, []):
+            if all(existing.get(key) == row.get(key) for key in keys):
+                return existing
+        return None
+
+    def _execute_insert(self) -> FakeResult:
+        values = self._values if isinstance(self._values, list) else [self._values]
+        inserted = []
+        for values_row in values:
+            if self._existing(values_row, UNIQUE_KEYS.get(self.table, ())):
+                raise FakeAPIError(f"duplicate key value violates unique constraint on {self.table}")
+            inserted.append(self._db.insert_row(self.table, values_row))
+        return FakeResult([dict(row) for row in inserted])
+
+    def _execute_upsert(self) -> FakeResult:
+        values = self._values if isinstance(self._values, list) else [self._values]
+        keys = self._on_conflict or ('id',)
+        written = []
+        for values_row in values:
+            existing = self._existing(values_row, keys)
+            if existing is None:
+                written.append(self._db.insert_row(self.table, values_row))
+            elif not self._ignore_duplicates:
+                existing.update(values_row)
+                written.append(existing)
+        return FakeResult([dict(row) for row in written])
+
+    def _execute_update(self) -> FakeResult:
+        rows = self._matching()
+        for row in rows:
+            row.update(self._values)
+        return FakeResult([dict(row) for row in rows])
+
+    def _execute_delete(self) -> FakeResult:
+        rows = self._matching()
+        table = self._db.tables.setdefault(self.table, [])
+        self._db.tables[self.table] = [row for row in table if row not in rows]
+        return FakeResult([dict(row) for row in rows])
+
+
+class FakeRpc:
+    def __init__(self, db: 'FakeSupabase', name: str, params: dict):
+        self._db = db
+        self._name = name
+        self._params = params or {}
+        self.path = f"/rpc/{name}"
+        self.http_method = 'POST'
+        self.headers: Dict[str, str] = {}
+
+    def execute(self) -> FakeResult:
+        self._db.round_trip()
+        function = getattr(self._db, f"rpc_{self._name}", None)
+        if function is None:
+            raise FakeAPIError(f"Could not find the function public.{self._name}")
+        with self._db.lock:
+            return FakeResult(function(**self._params))
+
+
+class FakeSupabase:
+    """Drop-in for ``supabase.Client`` holding every table in memory
+
+    ``latency`` seconds (plus up to ``jitter`` seconds) are slept per round
+    trip on the calling worker thread.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, quests: Optional[List[dict]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.lock = threading.RLock()
+        self.round_trips = 0
+        self.tables: Dict[str, List[dict]] = {'quests': quests if quests is not None else seed_quests()}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[dict] = None) -> FakeRpc:
+        return FakeRpc(self, name, params)
+
+    def round_trip(self) -> None:
+        with self.lock:
+            self.round_trips += 1
+        delay = self.latency + (random.random() * self.jitter if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def insert_row(self, table: str, values: dict) -> dict:
+        now = datetime.utcnow().isoformat()
+        row = {'id': str(uuid.uuid4()), 'created_at': now, 'updated_at': now}
+        row.update(TABLE_DEFAULTS.get(table, dict)())
+        row.update(values)
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def _first(self, table: str, **where) -> Optional[dict]:
+        for row in self.tables.setdefault(table, []):
+            if all(row.get(column) == value for column, value in where.items()):
+                return row
+        return None
+
+    # Ports of the functions in supabase_schema.sql
+    def rpc_add_xp_and_check_level(self, p_user_id: str, p_xp_amount: int) -> List[dict]:
+        progress = self._first('progress', user_id=p_user_id)
+        total_xp = progress['total_xp'] + p_xp_amount
+        state = level_for_total_xp(total_xp)
+        levels_gained = max(state.level - progress['current_level'], 0)
+        progress.update({
+            'current_xp': state.current_xp, 'current_level': state.level,
+            'next_level_xp': state.next_level_xp, 'total_xp': total_xp
+        })
+        return [{
+            'leveled_up': levels_gained > 0, 'new_level': state.level,
+            'new_xp': state.current_xp, 'levels_gained': levels_gained
+        }]
+
+    def rpc_update_stats_on_levelup(self, p_user_id: str, p_branches: List[str], p_levels: int = 1) -> None:
+        user = self._first('users', id=p_user_id)
+        deltas = dict.fromkeys(('strength', 'health', 'intellect', 'agility', 'confidence', 'stability'), 1)
+        for branch in set(p_branches or []):
+            for stat, bonus in BRANCH_BONUSES.get(branch, {}).items():
+                deltas[stat] += bonus
+        for stat, delta in deltas.items():
+            user[stat] += p_levels * delta
+        return None
+
+    def rpc_record_daily_completion(self, p_user_id: str, p_date: str, p_quests: int, p_xp: int) -> None:
+        rollup = self._first('user_daily_stats', user_id=p_user_id, stat_date=p_date)
+        if rollup is None:
+            self.insert_row('user_daily_stats', {'user_id': p_user_id, 'stat_date': p_date, 'quest_count': p_quests, 'xp': p_xp})
+        else:
+            rollup['quest_count'] += p_quests
+            rollup['xp'] += p_xp
+
+        row = self._first('user_streaks', user_id=p_user_id)
+        if row is None:
+            row = self.insert_row('user_streaks', {'user_id': p_user_id})
+            streak = Streak()
+        else:
+            last = row['last_completion_date']
+            streak = Streak(row['current_streak'], row['best_streak'], date.fromisoformat(last) if last else None)
+        streak = advance(streak, date.fromisoformat(p_date))
+        row.update({
+            'current_streak': streak.current, 'best_streak': streak.best,
+            'last_completion_date': streak.last_date.isoformat()
+        })
+        return None
+
+    def rpc_maintain_user_quests(
+        self, p_keep_months: int = 3, p_months_ahead: int = 2, p_bonus_title: str = '⭐ Выполни все daily квесты'
+    ) -> dict:
+        # No partitions here: expired rows are folded into the rollups and removed
+        today = date.today()
+        months = today.year * 12 + today.month - 1 - p_keep_months
+        cutoff = date(months // 12, months % 12 + 1, 1).isoformat()
+        rows = self.tables.setdefault('user_quests', [])
+        expired = [row for row in rows if row['completion_date'] < cutoff]
+        rollups: Dict[tuple, dict] = {}
+        for row in expired:
+            quest = self._first('quests', id=row['quest_id']) or {}
+            rollup = rollups.setdefault((row['user_id'], row['completion_date']), {'quest_count': 0, 'xp': 0})
+            rollup['quest_count'] += quest.get('title') != p_bonus_title
+            rollup['xp'] += quest.get('xp_reward') or 0
+        for (user_id, stat_date), rollup in rollups.items():
+            if not self._first('user_daily_stats', user_id=user_id, stat_date=stat_date):
+                self.insert_row('user_daily_stats', dict(rollup, user_id=user_id, stat_date=stat_date))
+        self.tables['user_quests'] = [row for row in rows if row['completion_date'] >= cutoff]
+        archived = sorted({f"user_quests_{row['completion_date'][:7].replace('-', '_')}" for row in expired})
+        return {'created': [], 'archived': archived, 'cutoff': cutoff}
+
+    def rpc_get_user_stats(self, p_tg_id: int) -> Optional[dict]:
+        user = self._first('users', tg_id=p_tg_id)
+        if user is None:
+            return None
+        progress = self._first('progress', user_id=user['id']) or {}
+        row = self._first('user_streaks', user_id=user['id']) or {}
+        last = row.get('last_completion_date')
+        streak = Streak(row.get('current_streak', 0), row.get('best_streak', 0), date.fromisoformat(last) if last else None)
+        stats = {key: user.get(key) for key in ('first_name', 'strength', 'health', 'intellect', 'agility', 'confidence', 'stability')}
+        stats.update({
+            'active_branches': user.get('active_branches') or ['power'],
+            'is_pro': bool(user.get('is_pro')),
+            'current_level': progress.get('current_level', 1),
+            'current_xp': progress.get('current_xp', 0),
+            'next_level_xp': progress.get('next_level_xp', 100),
+            'total_xp': progress.get('total_xp', 0),
+            'goal_text': progress.get('goal_text'),
+            'current_streak': current_streak(streak, date.today()),
+            'best_streak': streak.best
+        })
+        return stats
+
+    def rpc_ingest_avatar(
+        self, p_user_id: str, p_avatar_url: str, p_level: Optional[int] = None, p_generation_id: Optional[str] = None
+    ) -> dict:
+        generations = self.tables.setdefault('avatar_generations', [])
+        echoed = self._first('avatar_generations', id=p_generation_id, user_id=p_user_id) if p_generation_id else None
+        level = (echoed or {}).get('level') or p_level or 1
+        done = self._first('avatar_generations', user_id=p_user_id, level=level, generation_status='completed')
+        if done is not None:
+            return {'status': 'duplicate', 'generation_id': done['id'], 'level': level}
+        user = self._first('users', id=p_user_id)
+        if user is None:
+            return {'status': 'user_not_found'}
+        user.update(avatar_url=p_avatar_url, avatar_variants=None, avatar_blurhash=None, updated_at=datetime.utcnow().isoformat())
+        if echoed is None:
+            open_rows = [
+                row for row in generations
+                if row['user_id'] == p_user_id and row['level'] == level
+                and row['generation_status'] in ('pending', 'processing', 'failed')
+            ]
+            echoed = max(open_rows, key=lambda row: row['created_at']) if open_rows else None
+        if echoed is None:
+            echoed = self.insert_row('avatar_generations', {'user_id': p_user_id, 'level': level})
+        echoed.update(avatar_url=p_avatar_url, generation_status='completed')
+        return {'status': 'accepted', 'generation_id': echoed['id'], 'level': level, 'tg_id': user['tg_id']}
+
+    def rpc_touch_last_active(self, p_tg_ids: List[int], p_seen_at: str) -> None:
+        for user in self.tables.setdefault('users', []):
+            if user['tg_id'] in p_tg_ids:
+                user['last_active_at'] = p_seen_at
+        return None
+
+    def rpc_claim_outbound_jobs(self, **params) -> List[dict]:
+        # Benchmarks measure request handling; queued jobs are never run
+        return []
+
+    def rpc_complete_quest(self, p_tg_id: int, p_quest_id: str, p_completion_date: str, p_bonus_title: str) -> dict:
+        user = self._first('users', tg_id=p_tg_id)
+        if user is None:
+            return {'status': 'user_not_found'}
+        branches = user.get('active_branches') or ['power']
+        quest = self._first('quests', id=p_quest_id)
+        if quest is None:
+            return {'status': 'quest_not_found'}
+        if self._first('user_quests', user_id=user['id'], quest_id=p_quest_id, completion_date=p_completion_date):
+            return {'status': 'already_completed'}
+        self.insert_row('user_quests', {'user_id': user['id'], 'quest_id': p_quest_id, 'completion_date': p_completion_date})
+
+        level_up = self.rpc_add_xp_and_check_level(user['id'], quest['xp_reward'])[0]
+        if level_up['leveled_up']:
+            self.rpc_update_stats_on_levelup(user['id'], branches, level_up['levels_gained'])
+
+        visible = set(branches) | {'global'}
+        daily = [q for q in self.tables['quests'] if q['is_daily'] and q['branch'] in visible]
+        bonus = next((q for q in daily if q['title'] == p_bonus_title), None)
+        bonus_awarded, bonus_xp, bonus_leveled_up, bonus_new_level = False, 0, False, None
+        if bonus is not None:
+            others = [q for q in daily if q['title'] != p_bonus_title]
+            remaining = [
+                q for q in others
+                if not self._first('user_quests', user_id=user['id'], quest_id=q['id'], completion_date=p_completion_date)
+            ]
+            if others and not remaining:
+                bonus_xp = bonus['xp_reward'] or 0
+                if not self._first('user_quests', user_id=user['id'], quest_id=bonus['id'], completion_date=p_completion_date):
+                    self.insert_row('user_quests', {'user_id': user['id'], 'quest_id': bonus['id'], 'completion_date': p_completion_date})
+                    bonus_awarded = True
+                    bonus_level_up = self.rpc_add_xp_and_check_level(user['id'], bonus_xp)[0]
+                    bonus_leveled_up, bonus_new_level = bonus_level_up['leveled_up'], bonus_level_up['new_level']
+                    if bonus_leveled_up:
+                        self.rpc_update_stats_on_levelup(user['id'], branches, bonus_level_up['levels_gained'])
+
+        self.rpc_record_daily_completion(
+            user['id'], p_completion_date, 1, quest['xp_reward'] + (bonus_xp if bonus_awarded else 0)
+        )
+
+        effective_level = max(level_up['new_level'], bonus_new_level or level_up['new_level'])
+        achieved_goals = sorted(
+            (
+                dict(goal) for goal in self.tables.setdefault('goals', [])
+                if goal['user_id'] == user['id'] and not goal['is_completed'] and goal['notified_at'] is None
+                and goal['notify_claimed_at'] is None
+                and (goal.get('goal_level') or 1) <= effective_level
+            ),
+            key=lambda goal: goal['created_at']
+        )
+        return {
+            'status': 'completed',
+            'user_id': user['id'],
+            'xp_gained': quest['xp_reward'],
+            'leveled_up': level_up['leveled_up'],
+            'previous_level': level_up['new_level'] - level_up['levels_gained'],
+            'new_level': level_up['new_level'],
+            'bonus_awarded': bonus_awarded,
+            'bonus_xp': bonus_xp,
+            'bonus_leveled_up': bonus_leveled_up,
+            'bonus_new_level': bonus_new_level,
+            'achieved_goals': achieved_goals,
+            'avatar': {
+                'selfie_url': user.get('selfie_url'),
+                'gender': user.get('gender'),
+                'age': user.get('age'),
+                'active_branches': branches
+            }
+        }
@@ -1,16 +1,23 @@
 """
 LifeQuest Hero Telegram Bot
 Handles Mini App launch and daily reminders
+
+With BOT_MODE=webhook the API receives updates (see telegram_webhook.py) and
+this process only runs the scheduled reminders.
 """
 import os
 import asyncio
 import logging
-from datetime import time
+from datetime import datetime, time, timedelta
 from telegram import Update, WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup, MenuButtonWebApp
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import Application, CommandHandler, ContextTypes
 from dotenv import load_dotenv
 from pathlib import Path
 from supabase_client import get_supabase
+from broadcast import BROADCAST_CONCURRENCY, BroadcastAborted, BroadcastEngine, SupabaseCheckpointStore, active_user_pages
+from bot_stats import UserStatsReader, format_stats
+from telegram_webhook import ALLOWED_UPDATES, BOT_MODE
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -18,8 +25,16 @@ load_dotenv(ROOT_DIR / '.env')
 # Configuration
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 WEB_APP_URL = os.environ.get('WEB_APP_URL')
+# Updates handled at once; /stats and /start during the reminder spike no longer queue
+BOT_CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', '32'))
 
 supabase = get_supabase()
+user_stats = UserStatsReader(supabase)
+reminder_checkpoints = SupabaseCheckpointStore(supabase)
+
+# BadRequest descriptions that mean the recipient is gone; any other BadRequest
+# (bad markup, message too long) would fail for every recipient
+GONE_CHAT_ERRORS = ('chat not found', 'user is deactivated', 'peer_id_invalid')
 
 # Configure logging
 logging.basicConfig(
@@ -83,39 +98,16 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user = update.effective_user
     
     try:
-        # Get user from database
-        result = supabase.table('users').select('*').eq('tg_id', user.id).execute()
+        # One RPC off the event loop, cached briefly per user
+        stats = await user_stats.get(user.id)
         
-        if not result.data:
+        if stats is None:
             await update.message.reply_text(
                 "❌ Ты ещё не зарегистрирован! Нажми /start чтобы начать."
             )
             return
         
-        user_data = result.data[0]
-        
-        # Get progress
-        progress_result = supabase.table('progress').select('*').eq('user_id', user_data['id']).execute()
-        progress = progress_result.data[0] if progress_result.data else {}
-        
-        stats_text = (
-            f"📊 *Статистика {user_data.get('first_name', 'Героя')}*\n\n"
-            f"⭐ Уровень: {progress.get('current_level', 1)}\n"
-            f"✨ XP: {progress.get('current_xp', 0)}/{progress.get('next_level_xp', 100)}\n"
-            f"💎 Всего XP: {progress.get('total_xp', 0)}\n\n"
-            "💪 *Характеристики:*\n"
-            f"Сила: {user_data.get('strength', 1)}\n"
-            f"Здоровье: {user_data.get('health', 1)}\n"
-            f"Интеллект: {user_data.get('intellect', 1)}\n"
-            f"Ловкость: {user_data.get('agility', 1)}\n"
-            f"Уверенность: {user_data.get('confidence', 1)}\n"
-            f"Стабильность: {user_data.get('stability', 1)}\n\n"
-            f"🌳 Активные ветки: {', '.join(user_data.get('active_branches', ['power']))}\n"
-            f"{'🌟 PRO активен!' if user_data.get('is_pro') else ''}\n\n"
-            f"🎯 Цель: {progress.get('goal_text', 'Не установлена')}"
-        )
-        
-        await update.message.reply_text(stats_text, parse_mode='Markdown')
+        await update.message.reply_text(format_stats(stats), parse_mode='Markdown')
         
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
@@ -123,19 +115,26 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "❌ Ошибка при получении статистики. Попробуй позже."
         )
 
+def is_gone_recipient(error: Exception) -> bool:
+    """Blocked bot, deleted chat or deactivated user: retrying will not help"""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and any(text in error.message.lower() for text in GONE_CHAT_ERRORS)
+
+def is_broken_message(error: Exception) -> bool:
+    """A BadRequest about the message itself: stop the broadcast instead of failing every recipient"""
+    return isinstance(error, BadRequest) and not is_gone_recipient(error)
+
+def daily_reminders_id() -> str:
+    return f"daily_reminders:{datetime.utcnow().date().isoformat()}"
+
 async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send daily quest reminders to all active users"""
     try:
-        # Get all users active in last 7 days
-        from datetime import datetime, timedelta
+        # Users active in last 7 days
+        # (last_active_at is flushed by the backend every ACTIVITY_FLUSH_INTERVAL_SECONDS)
         week_ago = (datetime.utcnow() - timedelta(days=7)).isoformat()
         
-        result = supabase.table('users').select('tg_id, first_name').gte('last_active_at', week_ago).execute()
-        
-        if not result.data:
-            logger.info("No active users found")
-            return
-        
         reminder_text = (
             "🌅 *Доброе утро, Герой!*\n\n"
             "💪 Новые квесты уже ждут тебя!\n"
@@ -143,46 +142,92 @@ async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
             "Открой приложение и начни свой путь к цели! 🚀"
         )
         
-        sent_count = 0
-        for user in result.data:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['tg_id'],
-                    text=reminder_text,
-                    parse_mode='Markdown'
-                )
-                sent_count += 1
-                await asyncio.sleep(0.1)  # Rate limiting
-            except Exception as e:
-                logger.error(f"Error sending reminder to {user['tg_id']}: {e}")
+        engine = BroadcastEngine(
+            send=lambda chat_id: context.bot.send_message(
+                chat_id=chat_id,
+                text=reminder_text,
+                parse_mode='Markdown'
+            ),
+            fetch_page=active_user_pages(supabase, week_ago),
+            checkpoints=reminder_checkpoints,
+            is_permanent=is_gone_recipient,
+            is_fatal=is_broken_message
+        )
+        report = await engine.run(daily_reminders_id())
         
-        logger.info(f"Daily reminders sent to {sent_count} users")
+        logger.info(f"Daily reminders delivered: {report}")
         
+    except BroadcastAborted as e:
+        logger.error(f"Daily reminders aborted, fix the message and restart the bot to resume: {e}")
     except Exception as e:
         logger.error(f"Error sending daily reminders: {e}")
 
-def main() -> None:
-    """Start the bot"""
-    # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def resume_daily_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """On startup, finish today's reminders if a restart interrupted them"""
+    try:
+        checkpoint = await reminder_checkpoints.load(daily_reminders_id())
+    except Exception as e:
+        logger.error(f"Error checking for an unfinished reminder run: {e}")
+        return
+    if checkpoint and checkpoint.get('status') != 'completed':
+        logger.info(f"Resuming unfinished daily reminders {checkpoint.get('id')}")
+        await send_daily_reminders(context)
+
+def build_application(handle_updates: bool = True, schedule_jobs: bool = True) -> Application:
+    """The bot's PTB application; without updates it has no updater and no command handlers"""
+    # The broadcast engine and concurrent update handlers both send at once,
+    # so give PTB a connection pool that fits them together
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .connection_pool_size(BROADCAST_CONCURRENCY + BOT_CONCURRENT_UPDATES + 4)
+    )
+    if BOT_MODE == 'webhook':
+        # Updates arrive through the API's webhook route, never by polling
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Register handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("stats", stats_command))
+    if handle_updates:
+        application.add_handler(CommandHandler("start", start))
+        application.add_handler(CommandHandler("help", help_command))
+        application.add_handler(CommandHandler("stats", stats_command))
     
     # Schedule daily reminders (9 AM UTC)
-    job_queue = application.job_queue
-    job_queue.run_daily(
-        send_daily_reminders,
-        time=time(hour=9, minute=0),  # 9 AM UTC
-        name="daily_reminders"
-    )
+    if schedule_jobs:
+        application.job_queue.run_daily(
+            send_daily_reminders,
+            time=time(hour=9, minute=0),  # 9 AM UTC
+            name="daily_reminders"
+        )
+        application.job_queue.run_once(resume_daily_reminders, when=0, name="resume_daily_reminders")
+    
+    return application
+
+async def run_jobs_only(application: Application) -> None:
+    """Run the job queue until interrupted (webhook mode: the API handles updates)"""
+    async with application:
+        await application.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await application.stop()
+
+def main() -> None:
+    """Start the bot"""
+    if BOT_MODE == 'webhook':
+        logger.info("Bot started in webhook mode: reminders only, updates go to the API")
+        try:
+            asyncio.run(run_jobs_only(build_application(handle_updates=False)))
+        except KeyboardInterrupt:
+            pass
+        return
     
     logger.info("Bot started...")
     
     # Start the bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    build_application().run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,62 @@
+"""Data path of the bot's /stats command
+
+``stats_command`` used to run two blocking PostgREST queries (``users``, then
+``progress``) on the bot's event loop, stalling every other update while they
+ran. ``UserStatsReader`` reads the whole payload with the ``get_user_stats``
+RPC (one joined statement) through ``db.run_query``, so the loop keeps
+serving other updates. Results are cached per user for
+``BOT_STATS_CACHE_TTL_SECONDS``, and concurrent /stats from the same user
+share one round trip. Unregistered users are not cached, so /stats works
+right after registering.
+"""
+import os
+from typing import Optional
+
+from cache import TTLCache
+from db import run_query
+from idempotency import SingleFlight
+
+BOT_STATS_CACHE_TTL_SECONDS = float(os.environ.get('BOT_STATS_CACHE_TTL_SECONDS', '30'))
+BOT_STATS_CACHE_SIZE = int(os.environ.get('BOT_STATS_CACHE_SIZE', '10000'))
+
+
+class UserStatsReader:
+    def __init__(self, supabase, ttl: float = BOT_STATS_CACHE_TTL_SECONDS, maxsize: int = BOT_STATS_CACHE_SIZE):
+        self._supabase = supabase
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+
+    async def get(self, tg_id: int) -> Optional[dict]:
+        """Stats of a user, or None if they have not registered"""
+        stats = self._cache.get(tg_id)
+        if stats is not None:
+            return stats
+        return await self._flight.do(tg_id, lambda: self._load(tg_id))
+
+    async def _load(self, tg_id: int) -> Optional[dict]:
+        result = await run_query(self._supabase.rpc('get_user_stats', {'p_tg_id': tg_id}))
+        stats = result.data or None
+        if stats is not None:
+            self._cache.set(tg_id, stats)
+        return stats
+
+
+def format_stats(stats: dict) -> str:
+    branches = ', '.join(stats.get('active_branches') or ['power'])
+    return (
+        f"📊 *Статистика {stats.get('first_name') or 'Героя'}*\n\n"
+        f"⭐ Уровень: {stats.get('current_level', 1)}\n"
+        f"✨ XP: {stats.get('current_xp', 0)}/{stats.get('next_level_xp', 100)}\n"
+        f"💎 Всего XP: {stats.get('total_xp', 0)}\n"
+        f"🔥 Серия: {stats.get('current_streak', 0)} дн. (рекорд {stats.get('best_streak', 0)})\n\n"
+        "💪 *Характеристики:*\n"
+        f"Сила: {stats.get('strength', 1)}\n"
+        f"Здоровье: {stats.get('health', 1)}\n"
+        f"Интеллект: {stats.get('intellect', 1)}\n"
+        f"Ловкость: {stats.get('agility', 1)}\n"
+        f"Уверенность: {stats.get('confidence', 1)}\n"
+        f"Стабильность: {stats.get('stability', 1)}\n\n"
+        f"🌳 Активные ветки: {branches}\n"
+        f"{'🌟 PRO активен!' if stats.get('is_pro') else ''}\n\n"
+        f"🎯 Цель: {stats.get('goal_text') or 'Не установлена'}"
+    )
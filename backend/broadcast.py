@@ -0,0 +1,258 @@
+"""Broadcast engine for bot-wide messages such as the daily reminders
+
+The old reminder job loaded every active user in one query and sent one
+message every 100 ms, capping delivery at ~10 msgs/s. ``BroadcastEngine``
+instead:
+
+* streams recipients page by page with keyset pagination on ``tg_id``;
+* sends with bounded concurrency behind a token bucket tuned to the Bot API
+  limits (about 30 msgs/s globally, one message per second per chat);
+* honours ``429 retry_after`` by pausing the whole bucket, retries transient
+  errors and gives up immediately on permanent ones (bot blocked, chat gone);
+* aborts the whole run on fatal errors (e.g. a malformed message that every
+  recipient would reject) instead of counting each recipient as failed;
+* checkpoints the cursor and counters after every page in ``broadcast_runs``
+  so a restarted run resumes where it stopped (the bot resumes an unfinished
+  run of the day on startup). A crash mid-page can resend at most one page;
+* returns a ``DeliveryReport`` at the end.
+"""
+import os
+import asyncio
+import logging
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from db import run_query
+
+BROADCAST_RATE_PER_SECOND = float(os.environ.get('BROADCAST_RATE_PER_SECOND', '25'))
+BROADCAST_PER_CHAT_INTERVAL_SECONDS = float(os.environ.get('BROADCAST_PER_CHAT_INTERVAL_SECONDS', '1'))
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '16'))
+BROADCAST_PAGE_SIZE = int(os.environ.get('BROADCAST_PAGE_SIZE', '500'))
+BROADCAST_MAX_RETRIES = int(os.environ.get('BROADCAST_MAX_RETRIES', '3'))
+
+logger = logging.getLogger(__name__)
+
+SendMessage = Callable[[int], Awaitable[object]]
+FetchPage = Callable[[Optional[int], int], Awaitable[List[dict]]]
+
+
+class TokenBucket:
+    """Async token bucket; ``pause`` empties it for a server-imposed cool-down"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+
+@dataclass
+class DeliveryReport:
+    broadcast_id: str
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    rate_limited: int = 0
+    pages: int = 0
+    last_tg_id: Optional[int] = None
+    status: str = 'running'
+    duration_seconds: float = 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        total = self.sent + self.blocked + self.failed
+        return total / self.duration_seconds if self.duration_seconds else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.broadcast_id}: sent={self.sent} blocked={self.blocked} failed={self.failed} "
+            f"429s={self.rate_limited} pages={self.pages} in {self.duration_seconds:.1f}s "
+            f"({self.messages_per_second:.1f} msgs/s)"
+        )
+
+
+class BroadcastAborted(Exception):
+    """A fatal send error stopped the broadcast; the checkpoint keeps the last completed page"""
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Seconds requested by a 429 error (PTB's RetryAfter), if any"""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return None
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class SupabaseCheckpointStore:
+    def __init__(self, supabase):
+        self._supabase = supabase
+
+    async def load(self, broadcast_id: str) -> Optional[dict]:
+        result = await run_query(self._supabase.table('broadcast_runs').select('*').eq('id', broadcast_id))
+        return result.data[0] if result.data else None
+
+    async def save(self, report: DeliveryReport) -> None:
+        row = asdict(report)
+        row.pop('duration_seconds')
+        row['id'] = row.pop('broadcast_id')
+        row['updated_at'] = datetime.utcnow().isoformat()
+        await run_query(self._supabase.table('broadcast_runs').upsert(row, on_conflict='id'))
+
+
+class MemoryCheckpointStore:
+    def __init__(self):
+        self.runs: Dict[str, dict] = {}
+
+    async def load(self, broadcast_id: str) -> Optional[dict]:
+        return self.runs.get(broadcast_id)
+
+    async def save(self, report: DeliveryReport) -> None:
+        self.runs[report.broadcast_id] = asdict(report)
+
+
+def active_user_pages(supabase, since: str) -> FetchPage:
+    """Keyset pages of users active since ``since``, ordered by tg_id"""
+    async def fetch_page(after_tg_id: Optional[int], limit: int) -> List[dict]:
+        query = supabase.table('users').select('tg_id').gte('last_active_at', since)
+        if after_tg_id is not None:
+            query = query.gt('tg_id', after_tg_id)
+        result = await run_query(query.order('tg_id').limit(limit))
+        return result.data or []
+    return fetch_page
+
+
+class BroadcastEngine:
+    def __init__(
+        self,
+        send: SendMessage,
+        fetch_page: FetchPage,
+        checkpoints,
+        is_permanent: Callable[[Exception], bool] = lambda error: False,
+        is_fatal: Callable[[Exception], bool] = lambda error: False,
+        rate: float = BROADCAST_RATE_PER_SECOND,
+        per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL_SECONDS,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        page_size: int = BROADCAST_PAGE_SIZE,
+        max_retries: int = BROADCAST_MAX_RETRIES
+    ):
+        self._send = send
+        self._fetch_page = fetch_page
+        self._checkpoints = checkpoints
+        self._is_permanent = is_permanent
+        self._is_fatal = is_fatal
+        # Small burst so the first second does not overshoot the API's per-second window
+        self._bucket = TokenBucket(rate, capacity=max(1.0, rate / 10))
+        self._per_chat_interval = per_chat_interval
+        self._chat_ready_at: Dict[int, float] = {}
+        self._concurrency = concurrency
+        self._page_size = page_size
+        self._max_retries = max_retries
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        ready_at = self._chat_ready_at.get(chat_id, 0.0)
+        now = monotonic()
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        self._chat_ready_at[chat_id] = max(now, ready_at) + self._per_chat_interval
+
+    async def _deliver(self, chat_id: int, report: DeliveryReport) -> str:
+        for attempt in range(self._max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self._bucket.acquire()
+            try:
+                await self._send(chat_id)
+                return 'sent'
+            except Exception as e:
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    report.rate_limited += 1
+                    self._bucket.pause(retry_after)
+                    continue
+                if self._is_permanent(e):
+                    return 'blocked'
+                if self._is_fatal(e):
+                    raise BroadcastAborted(f"Broadcast {report.broadcast_id} aborted at chat {chat_id}: {e}") from e
+                if attempt < self._max_retries:
+                    await asyncio.sleep(0.5 * (2 ** attempt))
+                    continue
+                logger.error(f"Broadcast to {chat_id} failed: {e}")
+                return 'failed'
+        return 'failed'
+
+    async def run(self, broadcast_id: str) -> DeliveryReport:
+        """Deliver to every recipient, resuming from the last checkpoint of this broadcast"""
+        start = monotonic()
+        report = DeliveryReport(broadcast_id=broadcast_id)
+        checkpoint = await self._checkpoints.load(broadcast_id)
+        if checkpoint:
+            for field in ('sent', 'blocked', 'failed', 'rate_limited', 'pages'):
+                setattr(report, field, checkpoint.get(field) or 0)
+            report.last_tg_id = checkpoint.get('last_tg_id')
+            report.status = checkpoint.get('status') or 'running'
+            if report.status == 'completed':
+                logger.info(f"Broadcast {broadcast_id} already completed, skipping")
+                return report
+            logger.info(f"Resuming broadcast {broadcast_id} after tg_id {report.last_tg_id}")
+            report.status = 'running'
+
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def deliver(chat_id: int) -> str:
+            async with semaphore:
+                return await self._deliver(chat_id, report)
+
+        while True:
+            page = await self._fetch_page(report.last_tg_id, self._page_size)
+            if not page:
+                break
+            tasks = [asyncio.ensure_future(deliver(user['tg_id'])) for user in page]
+            try:
+                outcomes = await asyncio.gather(*tasks)
+            except BroadcastAborted:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                report.status = 'aborted'
+                report.duration_seconds = monotonic() - start
+                await self._checkpoints.save(report)
+                raise
+            report.sent += outcomes.count('sent')
+            report.blocked += outcomes.count('blocked')
+            report.failed += outcomes.count('failed')
+            report.pages += 1
+            report.last_tg_id = page[-1]['tg_id']
+            report.duration_seconds = monotonic() - start
+            await self._checkpoints.save(report)
+            self._chat_ready_at.clear()
+            if len(page) < self._page_size:
+                break
+
+        report.status = 'completed'
+        report.duration_seconds = monotonic() - start
+        await self._checkpoints.save(report)
+        return report
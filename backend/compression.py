@@ -0,0 +1,186 @@
+"""Brotli/gzip response compression middleware
+
+A plain ASGI middleware so it also wraps responses that handlers return
+directly. Bodies under ``minimum_size`` bytes (most single-object responses
+and every 304) are sent as they are, since the framing costs more than it
+saves. Brotli is preferred when the client accepts it and the ``brotli``
+package is installed; otherwise gzip. Streaming responses are compressed
+chunk by chunk with a flush after each one. Every response of a compressible
+type carries ``Vary: Accept-Encoding``, compressed or not, so shared caches
+never hand a gzip body to a client that did not ask for one (or the reverse).
+"""
+import os
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+# Brotli 4 / gzip 6 compress JSON well at a fraction of the CPU of the maximum levels
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+def choose_encoding(accept_encoding: str, brotli_available: bool = brotli is not None) -> Optional[str]:
+    """'br', 'gzip' or None for an Accept-Encoding header, honouring q=0"""
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip()] = quality
+    wildcard = accepted.get('*', 0.0)
+    if brotli_available and accepted.get('br', wildcard) > 0:
+        return 'br'
+    if accepted.get('gzip', wildcard) > 0:
+        return 'gzip'
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            # wbits 31: gzip container
+            self._gzip = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._gzip.compress(data) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b'') -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._gzip.compress(data) + self._gzip.flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return _Compressor(encoding).finish(data)
+
+
+def vary_on_encoding(headers: list) -> list:
+    """``headers`` with Accept-Encoding added to Vary, merged into any Vary already set"""
+    values = [value for name, value in headers if name.lower() == b'vary']
+    tokens = {token.strip().lower() for value in values for token in value.split(b',')}
+    if b'accept-encoding' in tokens or b'*' in tokens:
+        return headers
+    merged = b', '.join(values + [b'Accept-Encoding'])
+    return [(name, value) for name, value in headers if name.lower() != b'vary'] + [(b'vary', merged)]
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get('headers') or [])
+        encoding = choose_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        # Wrapped even without an encoding: the response still has to vary on Accept-Encoding
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+
+
+class _CompressingSend:
+    """Holds back ``http.response.start`` and the body until ``minimum_size`` bytes or the end of the body
+
+    Apps behind a ``BaseHTTPMiddleware`` stream every body in several
+    ``more_body`` chunks, so one chunk alone cannot tell a small response from
+    a large one.
+    """
+
+    def __init__(self, send, encoding: Optional[str], minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+        self.buffer = []
+        self.buffered = 0
+
+    def _varies(self) -> bool:
+        """Whether the body would be compressed for a client accepting gzip (304s stand in for their 200s)"""
+        headers = dict(self.start.get('headers') or [])
+        if b'content-encoding' in headers:
+            return False
+        content_type = headers.get(b'content-type', b'').decode('latin-1')
+        return self.start.get('status') == 304 or content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _compressible(self) -> bool:
+        return self.encoding is not None and self._varies() and self.start.get('status') != 304
+
+    def _start_uncompressed(self):
+        if not self._varies():
+            return self.start
+        return dict(self.start, headers=vary_on_encoding(list(self.start.get('headers') or [])))
+
+    def _start_compressed(self, content_length: Optional[int]):
+        headers = [
+            (name, value) for name, value in self.start.get('headers') or []
+            if name.lower() not in (b'content-length', b'content-encoding')
+        ]
+        headers.append((b'content-encoding', self.encoding.encode()))
+        headers = vary_on_encoding(headers)
+        if content_length is not None:
+            headers.append((b'content-length', str(content_length).encode()))
+        return dict(self.start, headers=headers)
+
+    async def __call__(self, message):
+        if message['type'] == 'http.response.start':
+            self.start = message
+            return
+        if message['type'] != 'http.response.body' or self.passthrough:
+            await self.send(message)
+            return
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is not None:
+            data = self.compressor.chunk(body) if more_body else self.compressor.finish(body)
+            await self.send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+            return
+
+        if not self._compressible():
+            self.passthrough = True
+            await self.send(self._start_uncompressed())
+            await self.send(message)
+            return
+
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if more_body and self.buffered < self.minimum_size:
+            return
+        body = b''.join(self.buffer)
+        self.buffer = []
+
+        if not more_body and len(body) < self.minimum_size:
+            self.passthrough = True
+            await self.send(self._start_uncompressed())
+            await self.send({'type': 'http.response.body', 'body': body})
+            return
+
+        self.compressor = _Compressor(self.encoding)
+        if more_body:
+            await self.send(self._start_compressed(None))
+            await self.send({'type': 'http.response.body', 'body': self.compressor.chunk(body), 'more_body': True})
+            return
+        data = self.compressor.finish(body)
+        await self.send(self._start_compressed(len(data)))
+        await self.send({'type': 'http.response.body', 'body': data})
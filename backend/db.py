@@ -0,0 +1,98 @@
+"""Non-blocking data access for the Supabase client
+
+The app uses supabase-py's synchronous client, whose query builders perform a
+full HTTP round trip to PostgREST on the calling thread in ``.execute()``.
+Calling it from an ``async def`` handler freezes the uvicorn event loop for
+every other request until the response arrives. ``run_query`` hands the
+execution to a bounded thread pool instead, so the loop keeps serving while
+PostgREST answers. The underlying httpx client of supabase-py is shared by all
+workers, which keeps its HTTP/2 connection pool warm across requests.
+
+supabase-py 2.x also ships an async client (``acreate_client``). The thread
+pool was chosen over it because the same synchronous client and builders are
+used by the bot, the background services and the benchmarks' fake, and the
+pool changes only how queries are executed rather than every call site at
+once. ``SUPABASE_MAX_WORKERS`` also caps how many PostgREST calls one process
+has in flight.
+
+The pool is created on first use and ``shutdown_executor()`` drops it, so a
+later lifespan in the same process (test clients, reloads) gets a new one.
+
+Every execution is timed into ``DEPENDENCY_DURATION`` labelled with the
+PostgREST operation and the table or RPC it targets, and recorded in the
+request's ``QueryTrace`` when one is open.
+"""
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Optional, Tuple
+
+from metrics import DEPENDENCY_DURATION, DEPENDENCY_ERRORS
+from tracing import record_query
+
+SUPABASE_MAX_WORKERS = int(os.environ.get('SUPABASE_MAX_WORKERS', '32'))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SUPABASE_MAX_WORKERS, thread_name_prefix='supabase')
+    return _executor
+
+
+def describe_query(query) -> Tuple[str, str]:
+    """(operation, target) of a PostgREST builder, e.g. ('select', 'users') or ('rpc', 'complete_quest')"""
+    path = str(getattr(query, 'path', '') or '').strip('/')
+    method = str(getattr(query, 'http_method', '') or '').upper()
+    if path.startswith('rpc/'):
+        return 'rpc', path[len('rpc/'):]
+    if method == 'POST':
+        headers = getattr(query, 'headers', None) or {}
+        prefer = headers.get('prefer', '') or headers.get('Prefer', '')
+        return ('upsert' if 'resolution=' in prefer else 'insert'), path or 'unknown'
+    operation = {'GET': 'select', 'HEAD': 'count', 'PATCH': 'update', 'DELETE': 'delete'}.get(method, 'unknown')
+    return operation, path or 'unknown'
+
+
+def _timed_execute(query, operation: str, target: str):
+    start = perf_counter()
+    try:
+        return query.execute()
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dependency='supabase', operation=operation, target=target)
+        raise
+    finally:
+        DEPENDENCY_DURATION.observe(perf_counter() - start, dependency='supabase', operation=operation, target=target)
+
+
+async def run_query(query):
+    """Execute a PostgREST query or RPC builder off the event loop"""
+    operation, target = describe_query(query)
+    loop = asyncio.get_running_loop()
+    start = perf_counter()
+    try:
+        return await loop.run_in_executor(_get_executor(), _timed_execute, query, operation, target)
+    finally:
+        record_query(operation, target, perf_counter() - start)
+
+
+async def run_queries(*queries):
+    """Execute independent queries concurrently and return their results in order"""
+    return await asyncio.gather(*(run_query(query) for query in queries))
+
+
+async def run_blocking(function, *args):
+    """Run any other blocking supabase-py call (e.g. a Storage upload) on the same pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), function, *args)
+
+
+def shutdown_executor() -> None:
+    """Wait for in-flight queries and release the worker threads; the next query starts a new pool"""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -0,0 +1,32 @@
+"""Version-based ETags for per-user resources
+
+Every user row carries a ``revision`` that database triggers bump whenever
+the user, their progress, quest completions or goals change. An ETag is
+derived from that revision plus whatever else shapes the representation
+(resource name, date, query string), so a conditional GET can be answered
+with ``304 Not Modified`` after reading a single integer, or from the
+in-process revision cache without touching the database at all.
+"""
+import hashlib
+from typing import Optional
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against ``etag``"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(_opaque(candidate) == _opaque(etag) for candidate in if_none_match.split(','))
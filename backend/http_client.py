@@ -0,0 +1,113 @@
+"""Shared outbound HTTP clients for n8n, the Telegram Bot API and media
+
+Opening an ``httpx.AsyncClient`` per call pays a fresh TCP+TLS handshake for
+every message. ``OutboundHttp`` keeps one pooled, keep-alive client per
+destination for the lifetime of the app, each with its own connection limits
+and timeouts. Telegram is spoken to over HTTP/2; n8n instances are commonly
+behind plain HTTP/1.1 proxies, so that is configurable. The media client
+downloads generated avatars for the image pipeline.
+
+Both clients time their requests into ``DEPENDENCY_DURATION`` through httpx
+event hooks.
+"""
+import os
+from time import perf_counter
+from typing import Optional
+
+import httpx
+
+from metrics import DEPENDENCY_DURATION, DEPENDENCY_ERRORS
+
+TELEGRAM_API_URL = 'https://api.telegram.org'
+TELEGRAM_MAX_CONNECTIONS = int(os.environ.get('TELEGRAM_MAX_CONNECTIONS', '20'))
+TELEGRAM_TIMEOUT_SECONDS = float(os.environ.get('TELEGRAM_TIMEOUT_SECONDS', '10'))
+N8N_MAX_CONNECTIONS = int(os.environ.get('N8N_MAX_CONNECTIONS', '10'))
+N8N_TIMEOUT_SECONDS = float(os.environ.get('N8N_TIMEOUT_SECONDS', '20'))
+N8N_HTTP2 = os.environ.get('N8N_HTTP2', 'false').lower() == 'true'
+MEDIA_MAX_CONNECTIONS = int(os.environ.get('MEDIA_MAX_CONNECTIONS', '4'))
+MEDIA_TIMEOUT_SECONDS = float(os.environ.get('MEDIA_TIMEOUT_SECONDS', '30'))
+KEEPALIVE_EXPIRY_SECONDS = 60.0
+
+
+def _operation(dependency: str, request: httpx.Request) -> str:
+    if dependency == 'telegram':
+        # /bot<token>/sendMessage -> sendMessage; never label with the token
+        return request.url.path.rsplit('/', 1)[-1] or 'unknown'
+    return request.method.lower()
+
+
+def _timing_hooks(dependency: str) -> dict:
+    async def on_request(request: httpx.Request) -> None:
+        request.extensions['metrics_start'] = perf_counter()
+
+    async def on_response(response: httpx.Response) -> None:
+        request = response.request
+        start = request.extensions.get('metrics_start')
+        if start is None:
+            return
+        operation = _operation(dependency, request)
+        target = request.url.host or 'unknown'
+        DEPENDENCY_DURATION.observe(perf_counter() - start, dependency=dependency, operation=operation, target=target)
+        if response.status_code >= 400:
+            DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation, target=target)
+
+    return {'request': [on_request], 'response': [on_response]}
+
+
+def _build_client(dependency: str, max_connections: int, timeout: float, http2: bool, base_url: str = '') -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=http2,
+        event_hooks=_timing_hooks(dependency),
+        timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+        )
+    )
+
+
+class OutboundHttp:
+    def __init__(self):
+        self._telegram: Optional[httpx.AsyncClient] = None
+        self._n8n: Optional[httpx.AsyncClient] = None
+        self._media: Optional[httpx.AsyncClient] = None
+
+    def start(self) -> None:
+        if self._telegram is None:
+            self._telegram = _build_client('telegram', TELEGRAM_MAX_CONNECTIONS, TELEGRAM_TIMEOUT_SECONDS, True, TELEGRAM_API_URL)
+        if self._n8n is None:
+            self._n8n = _build_client('n8n', N8N_MAX_CONNECTIONS, N8N_TIMEOUT_SECONDS, N8N_HTTP2)
+        if self._media is None:
+            self._media = _build_client('media', MEDIA_MAX_CONNECTIONS, MEDIA_TIMEOUT_SECONDS, False)
+
+    @property
+    def telegram(self) -> httpx.AsyncClient:
+        """Client rooted at the Bot API; post to ``/bot<token>/<method>``"""
+        if self._telegram is None:
+            self.start()
+        return self._telegram
+
+    @property
+    def n8n(self) -> httpx.AsyncClient:
+        if self._n8n is None:
+            self.start()
+        return self._n8n
+
+    @property
+    def media(self) -> httpx.AsyncClient:
+        if self._media is None:
+            self.start()
+        return self._media
+
+    async def aclose(self) -> None:
+        for client in (self._telegram, self._n8n, self._media):
+            if client is not None:
+                await client.aclose()
+        self._telegram = None
+        self._n8n = None
+        self._media = None
+
+
+outbound_http = OutboundHttp()
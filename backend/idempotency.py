@@ -0,0 +1,80 @@
+"""Duplicate request suppression for quest completion
+
+Double taps and Telegram WebView retries resend the same completion. Two
+layers keep those off the database:
+
+* ``SingleFlight`` coalesces identical requests that are in flight at the
+  same time: the first caller runs the work, later callers await its result.
+* ``IdempotencyStore`` remembers the outcome of a request sent with an
+  ``Idempotency-Key`` header for a short while, so a retry arriving after the
+  original finished replays the original response.
+
+Both are per-process, like the other in-memory caches.
+"""
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from cache import TTLCache
+
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '600'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+
+
+class SingleFlight:
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``work`` once for concurrent callers sharing ``key``
+
+        The work runs as its own task, so a caller that disconnects does not
+        cancel it for the others.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(work())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a different request"""
+
+
+class IdempotencyStore:
+    """Recorded outcomes of requests by (scope, Idempotency-Key)
+
+    An outcome is the status code and body of the original response. The
+    request fingerprint is stored with it, so reusing a key for a different
+    request is rejected rather than answered with an unrelated response.
+    """
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, scope: Hashable, key: str, fingerprint: Hashable) -> Optional[dict]:
+        record = self._cache.get((scope, key))
+        if record is None:
+            return None
+        if record['fingerprint'] != fingerprint:
+            raise IdempotencyKeyReused(key)
+        return record
+
+    def save(self, scope: Hashable, key: str, fingerprint: Hashable, status_code: int, body: Any) -> None:
+        self._cache.set((scope, key), {'fingerprint': fingerprint, 'status_code': status_code, 'body': body})
+
+    def stats(self) -> dict:
+        return self._cache.stats()
@@ -0,0 +1,241 @@
+"""Durable outbound job queue
+
+Calls to n8n and the Telegram Bot API used to run inline in request handlers
+or as fire-and-forget tasks that were lost on restart. Handlers now only
+``enqueue`` a job; worker coroutines claim due jobs, run the registered
+handler and retry failures with exponential backoff until ``max_attempts``,
+after which the job is dead-lettered.
+
+Jobs live in the ``outbound_jobs`` table (``SupabaseJobStore``). Claiming goes
+through ``claim_outbound_jobs``, which uses ``FOR UPDATE SKIP LOCKED`` so
+several API workers can drain the same queue, and re-claims jobs whose lease
+expired because a worker died mid-run. ``MemoryJobStore`` implements the same
+interface for tests and local runs.
+"""
+import os
+import uuid
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from db import run_query
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', '10'))
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get('JOB_POLL_INTERVAL_SECONDS', '2'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '6'))
+JOB_BASE_BACKOFF_SECONDS = float(os.environ.get('JOB_BASE_BACKOFF_SECONDS', '5'))
+JOB_MAX_BACKOFF_SECONDS = float(os.environ.get('JOB_MAX_BACKOFF_SECONDS', '900'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '300'))
+
+logger = logging.getLogger("lifequest")
+
+JobHandler = Callable[[dict], Awaitable[None]]
+DeadLetterHandler = Callable[[dict, str], Awaitable[None]]
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SupabaseJobStore:
+    def __init__(self, supabase):
+        self._supabase = supabase
+
+    async def add(self, job: dict) -> None:
+        row = dict(job, run_at=job['run_at'].isoformat())
+        query = self._supabase.table('outbound_jobs')
+        if job.get('dedupe_key'):
+            await run_query(query.upsert(row, on_conflict='dedupe_key', ignore_duplicates=True))
+        else:
+            await run_query(query.insert(row))
+
+    async def claim(self, limit: int, lease_seconds: int) -> List[dict]:
+        result = await run_query(self._supabase.rpc('claim_outbound_jobs', {
+            'p_limit': limit,
+            'p_lease_seconds': lease_seconds
+        }))
+        return result.data or []
+
+    async def complete(self, job_id: str) -> None:
+        await run_query(self._supabase.table('outbound_jobs').update({
+            'status': 'completed',
+            'last_error': None,
+            'updated_at': utcnow().isoformat()
+        }).eq('id', job_id))
+
+    async def retry(self, job_id: str, run_at: datetime, error: str) -> None:
+        await run_query(self._supabase.table('outbound_jobs').update({
+            'status': 'pending',
+            'run_at': run_at.isoformat(),
+            'last_error': error,
+            'updated_at': utcnow().isoformat()
+        }).eq('id', job_id))
+
+    async def dead(self, job_id: str, error: str) -> None:
+        await run_query(self._supabase.table('outbound_jobs').update({
+            'status': 'dead',
+            'last_error': error,
+            'updated_at': utcnow().isoformat()
+        }).eq('id', job_id))
+
+
+class MemoryJobStore:
+    """In-process stand-in for ``outbound_jobs`` (tests, local development)"""
+
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {}
+
+    async def add(self, job: dict) -> None:
+        dedupe_key = job.get('dedupe_key')
+        if dedupe_key and any(existing.get('dedupe_key') == dedupe_key for existing in self.jobs.values()):
+            return
+        self.jobs[job['id']] = dict(job, status='pending', attempts=0, locked_at=None, last_error=None)
+
+    async def claim(self, limit: int, lease_seconds: int) -> List[dict]:
+        now = utcnow()
+        lease_expired = now - timedelta(seconds=lease_seconds)
+        due = [
+            job for job in self.jobs.values()
+            if (job['status'] == 'pending' and job['run_at'] <= now)
+            or (job['status'] == 'running' and job['locked_at'] <= lease_expired)
+        ]
+        due.sort(key=lambda job: job['run_at'])
+        claimed = []
+        for job in due[:limit]:
+            job.update(status='running', attempts=job['attempts'] + 1, locked_at=now)
+            claimed.append(dict(job))
+        return claimed
+
+    async def complete(self, job_id: str) -> None:
+        self.jobs[job_id].update(status='completed', last_error=None)
+
+    async def retry(self, job_id: str, run_at: datetime, error: str) -> None:
+        self.jobs[job_id].update(status='pending', run_at=run_at, last_error=error)
+
+    async def dead(self, job_id: str, error: str) -> None:
+        self.jobs[job_id].update(status='dead', last_error=error)
+
+
+class JobQueue:
+    def __init__(
+        self,
+        store,
+        workers: int = JOB_WORKERS,
+        batch_size: int = JOB_BATCH_SIZE,
+        poll_interval: float = JOB_POLL_INTERVAL_SECONDS,
+        base_backoff: float = JOB_BASE_BACKOFF_SECONDS,
+        max_backoff: float = JOB_MAX_BACKOFF_SECONDS,
+        lease_seconds: int = JOB_LEASE_SECONDS
+    ):
+        self.store = store
+        self._workers = workers
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._base_backoff = base_backoff
+        self._max_backoff = max_backoff
+        self._lease_seconds = lease_seconds
+        self._handlers: Dict[str, JobHandler] = {}
+        self._dead_letter_handlers: Dict[str, DeadLetterHandler] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, kind: str, handler: JobHandler, on_dead: Optional[DeadLetterHandler] = None) -> None:
+        self._handlers[kind] = handler
+        if on_dead is not None:
+            self._dead_letter_handlers[kind] = on_dead
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        dedupe_key: Optional[str] = None,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        delay: float = 0
+    ) -> str:
+        """Persist a job; jobs sharing a dedupe_key are only stored once"""
+        job_id = str(uuid.uuid4())
+        await self.store.add({
+            'id': job_id,
+            'kind': kind,
+            'payload': payload,
+            'dedupe_key': dedupe_key,
+            'max_attempts': max_attempts,
+            'run_at': utcnow() + timedelta(seconds=delay)
+        })
+        self._wakeup.set()
+        return job_id
+
+    def backoff(self, attempts: int) -> float:
+        """Exponential backoff with jitter for the given attempt number"""
+        delay = min(self._max_backoff, self._base_backoff * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _process(self, job: dict) -> None:
+        handler = self._handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind {job['kind']}")
+            await handler(job['payload'])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] >= job['max_attempts'] or handler is None:
+                logger.error(f"Job {job['id']} ({job['kind']}) dead-lettered after {job['attempts']} attempts: {error}")
+                await self.store.dead(job['id'], error)
+                on_dead = self._dead_letter_handlers.get(job['kind'])
+                if on_dead is not None:
+                    try:
+                        await on_dead(job['payload'], error)
+                    except Exception as hook_error:
+                        logger.error(f"Dead-letter hook for job {job['id']} failed: {hook_error}")
+            else:
+                delay = self.backoff(job['attempts'])
+                logger.warning(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed, retry in {delay:.1f}s: {error}")
+                await self.store.retry(job['id'], utcnow() + timedelta(seconds=delay), error)
+            return
+        await self.store.complete(job['id'])
+
+    async def run_once(self) -> int:
+        """Claim and process one batch of due jobs; returns how many ran"""
+        jobs = await self.store.claim(self._batch_size, self._lease_seconds)
+        for job in jobs:
+            await self._process(job)
+        return len(jobs)
+
+    async def _idle(self) -> None:
+        """Wait for an enqueue, stop() or the poll interval, whichever comes first"""
+        # Not wait_for: on Python 3.11 it drops a cancel() that lands as the event fires
+        waiters = {asyncio.create_task(self._wakeup.wait()), asyncio.create_task(self._stopping.wait())}
+        try:
+            await asyncio.wait(waiters, timeout=self._poll_interval, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _worker(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Job worker error: {e}")
+                processed = 0
+            if processed or self._stopping.is_set():
+                continue
+            self._wakeup.clear()
+            await self._idle()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._stopping.clear()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers; claimed jobs that were interrupted are re-claimed after their lease"""
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
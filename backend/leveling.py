@@ -0,0 +1,71 @@
+"""Level curve shared by the API and the ``level_thresholds`` table
+
+Leveling from level L to L + 1 costs ``floor(100 * 1.05 ** (L - 1))`` XP, the
+curve ``add_xp_and_check_level`` used to walk with a WHILE loop. Here the
+curve is precomputed once as a cumulative table: ``CUMULATIVE_XP[L]`` is the
+total XP needed to reach level L, so the level for any ``total_xp`` is a
+binary search. The same table is seeded into Postgres as
+``level_thresholds``. Powers are computed with exact fractions so the floors
+match Postgres' NUMERIC arithmetic instead of drifting with float rounding.
+"""
+from bisect import bisect_right
+from fractions import Fraction
+from typing import List, NamedTuple
+
+BASE_LEVEL_XP = 100
+LEVEL_XP_GROWTH = Fraction(105, 100)
+# Cumulative XP at this level is ~2.1e9, the INTEGER limit of progress.total_xp
+MAX_LEVEL = 300
+
+
+def _build_tables(max_level: int):
+    xp_required: List[int] = [0]
+    cumulative: List[int] = [0, 0]
+    for level in range(1, max_level + 1):
+        xp_required.append(int(BASE_LEVEL_XP * LEVEL_XP_GROWTH ** (level - 1)))
+        if level < max_level:
+            cumulative.append(cumulative[-1] + xp_required[-1])
+    return xp_required, cumulative
+
+
+# XP_REQUIRED[L]: XP to go from level L to L + 1; CUMULATIVE_XP[L]: total XP to reach level L.
+# Index 0 is padding so both are indexed by level.
+XP_REQUIRED, CUMULATIVE_XP = _build_tables(MAX_LEVEL)
+
+
+class LevelState(NamedTuple):
+    level: int
+    current_xp: int
+    next_level_xp: int
+
+
+class LevelUp(NamedTuple):
+    leveled_up: bool
+    levels_gained: int
+    new_level: int
+    current_xp: int
+    next_level_xp: int
+
+
+def level_for_total_xp(total_xp: int) -> LevelState:
+    """Level, XP into that level and XP needed for the next one, from lifetime XP"""
+    level = max(1, bisect_right(CUMULATIVE_XP, max(0, total_xp), lo=1) - 1)
+    return LevelState(level, total_xp - CUMULATIVE_XP[level], XP_REQUIRED[level])
+
+
+def project_level_up(total_xp: int, xp_amount: int) -> LevelUp:
+    """What adding ``xp_amount`` to ``total_xp`` does, without touching the database"""
+    before = level_for_total_xp(total_xp)
+    after = level_for_total_xp(total_xp + xp_amount)
+    return LevelUp(
+        leveled_up=after.level > before.level,
+        levels_gained=after.level - before.level,
+        new_level=after.level,
+        current_xp=after.current_xp,
+        next_level_xp=after.next_level_xp
+    )
+
+
+def goal_progress(current_level: int, goal_level: int) -> int:
+    """Current level as a percentage of the goal level"""
+    return int((current_level / (goal_level or 10)) * 100)
@@ -0,0 +1,147 @@
+"""Background dispatcher for goal-achieved notifications
+
+Quest completion only emits an event for each newly achieved goal and
+returns. The dispatcher wakes up every ``GOAL_NOTIFY_FLUSH_SECONDS`` (or as
+soon as ``GOAL_NOTIFY_BATCH_SIZE`` events are waiting), sends the Telegram
+messages concurrently and stamps ``notified_at`` for the whole batch with a
+single UPDATE. Sends that fail are handed to ``on_failure`` (the durable job
+queue) for retries, and those goals are claimed with ``notify_claimed_at`` so
+later quest completions do not report and send them again while the retry
+is pending. Events that are still buffered when the process dies are
+not lost for good: their goals keep ``notified_at IS NULL`` and are picked
+up again by the user's next quest completion.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from db import run_queries
+
+GOAL_NOTIFY_FLUSH_SECONDS = float(os.environ.get('GOAL_NOTIFY_FLUSH_SECONDS', '1'))
+GOAL_NOTIFY_BATCH_SIZE = int(os.environ.get('GOAL_NOTIFY_BATCH_SIZE', '100'))
+GOAL_NOTIFY_CONCURRENCY = int(os.environ.get('GOAL_NOTIFY_CONCURRENCY', '10'))
+
+logger = logging.getLogger("lifequest")
+
+SendNotification = Callable[[dict], Awaitable[None]]
+FailureHandler = Callable[[dict], Awaitable[None]]
+WriteHandler = Callable[[int], None]
+
+
+class GoalNotificationDispatcher:
+    def __init__(
+        self,
+        supabase,
+        send: SendNotification,
+        on_failure: Optional[FailureHandler] = None,
+        on_written: Optional[WriteHandler] = None,
+        flush_interval: float = GOAL_NOTIFY_FLUSH_SECONDS,
+        batch_size: int = GOAL_NOTIFY_BATCH_SIZE,
+        concurrency: int = GOAL_NOTIFY_CONCURRENCY
+    ):
+        self._supabase = supabase
+        self._send = send
+        self._on_failure = on_failure
+        # Called with the tg_id of every user whose goals a flush stamped (cache invalidation)
+        self._on_written = on_written
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        # goal_id -> event; a goal is queued at most once until its batch is written
+        self._pending: Dict[str, dict] = {}
+        self._inflight: set = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def emit(self, tg_id: int, goals: List[dict], level: int) -> None:
+        """Queue notifications for achieved goals without waiting for Telegram"""
+        for goal in goals:
+            goal_id = goal['id']
+            if goal_id in self._pending or goal_id in self._inflight:
+                continue
+            self._pending[goal_id] = {
+                'tg_id': tg_id,
+                'goal_id': goal_id,
+                'goal_text': goal.get('goal_text') or 'Цель',
+                'level': level
+            }
+        if len(self._pending) >= self._batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Send one batch and mark the delivered goals notified in one write"""
+        if not self._pending:
+            return 0
+        goal_ids = list(self._pending)[:self._batch_size]
+        events = [self._pending.pop(goal_id) for goal_id in goal_ids]
+        self._inflight.update(goal_ids)
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def deliver(event: dict) -> str:
+            """'delivered', 'claimed' (a retry job owns it now) or 'failed'"""
+            async with semaphore:
+                try:
+                    await self._send(event)
+                    return 'delivered'
+                except Exception as e:
+                    logger.warning(f"Goal notification for {event['goal_id']} failed, handing to retry queue: {e}")
+                    if self._on_failure is not None:
+                        try:
+                            await self._on_failure(event)
+                            return 'claimed'
+                        except Exception as hook_error:
+                            logger.error(f"Error queueing goal notification retry: {hook_error}")
+                    return 'failed'
+
+        try:
+            results = await asyncio.gather(*(deliver(event) for event in events))
+            now = datetime.utcnow().isoformat()
+            delivered = [event['goal_id'] for event, result in zip(events, results) if result == 'delivered']
+            claimed = [event['goal_id'] for event, result in zip(events, results) if result == 'claimed']
+            writes = []
+            if delivered:
+                writes.append(self._supabase.table('goals').update({'notified_at': now}).in_('id', delivered))
+            if claimed:
+                writes.append(self._supabase.table('goals').update({'notify_claimed_at': now}).in_('id', claimed))
+            await run_queries(*writes)
+            if self._on_written is not None:
+                for tg_id in {event['tg_id'] for event, result in zip(events, results) if result != 'failed'}:
+                    self._on_written(tg_id)
+            return len(delivered)
+        except Exception as e:
+            logger.error(f"Error marking goals notified: {e}")
+            return 0
+        finally:
+            self._inflight.difference_update(goal_ids)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the loop and deliver whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            await self.flush()
@@ -0,0 +1,70 @@
+"""Keyset pagination helpers for PostgREST queries
+
+Pages are ordered newest first on ``(created_at, id)``. The cursor is the
+opaque, URL-safe encoding of the last row's sort key, and the next page is
+the rows strictly after it, so each page is one index range scan however deep
+the client scrolls (no OFFSET). Cursors come back from clients, so both
+values are validated (an ISO timestamp and a UUID) before they are spliced
+into the PostgREST filter.
+"""
+import json
+import uuid
+import base64
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def encode_cursor(row: dict) -> str:
+    payload = json.dumps([row['created_at'], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """(created_at, id) of a cursor; InvalidCursor (a 400) unless they are a timestamp and a UUID"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(row_id))
+    except Exception:
+        raise InvalidCursor(cursor)
+
+
+def keyset_page(query, cursor: Optional[str], limit: int):
+    """Apply newest-first keyset ordering and the cursor to a select builder
+
+    Fetches one extra row so ``split_page`` can tell whether another page exists.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{row_id}")')
+    return query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1)
+
+
+def split_page(rows: List[dict], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Rows of the page and the cursor of the next one (None on the last page)"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def select_fields(fields: Optional[str], allowed: Iterable[str], required: Iterable[str] = ('id', 'created_at')) -> str:
+    """PostgREST select list for a sparse fieldset such as ``fields=goal_text,goal_level``"""
+    if not fields:
+        return '*'
+    allowed_set: Set[str] = set(allowed)
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in allowed_set]
+    if unknown:
+        raise InvalidFields(', '.join(unknown))
+    columns = list(dict.fromkeys(list(required) + requested))
+    return ', '.join(columns)
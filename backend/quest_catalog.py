@@ -0,0 +1,124 @@
+"""In-process cache of the daily quest catalog
+
+The quests table is a small seed catalog that practically never changes, yet
+every quest screen used to re-query it. ``QuestCatalog`` loads all daily quests
+in one query, indexes them by branch, keeps the daily bonus quest apart and
+precomputes daily XP totals for every branch combination. A snapshot lives for
+``QUEST_CATALOG_TTL_SECONDS``; ``invalidate()`` bumps the version so the next
+read reloads immediately. ``digest()`` is a hash of the loaded rows, the same
+in every worker that loaded the same catalog, for use in ETags.
+"""
+import os
+import json
+import asyncio
+import hashlib
+from itertools import combinations
+from time import monotonic
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from db import run_query
+
+QUEST_CATALOG_TTL_SECONDS = float(os.environ.get('QUEST_CATALOG_TTL_SECONDS', '300'))
+
+
+class QuestCatalog:
+    def __init__(self, supabase, bonus_title: str, ttl: float = QUEST_CATALOG_TTL_SECONDS):
+        self._supabase = supabase
+        self._bonus_title = bonus_title
+        self._ttl = ttl
+        self._lock = asyncio.Lock()
+        self.version = 0
+        self._loaded_version: Optional[int] = None
+        self._loaded_at = 0.0
+        self._by_id: Dict[str, dict] = {}
+        self._by_branch: Dict[str, List[dict]] = {}
+        self._bonus_by_branch: Dict[str, dict] = {}
+        self._daily_xp: Dict[FrozenSet[str], dict] = {}
+        self._digest = ''
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_version == self.version and monotonic() - self._loaded_at < self._ttl
+
+    async def _ensure_loaded(self) -> None:
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            version = self.version
+            result = await run_query(self._supabase.table('quests').select('*').eq('is_daily', True).order('sort_order'))
+            self._build(result.data or [])
+            self._loaded_version = version
+            self._loaded_at = monotonic()
+
+    def _build(self, quests: List[dict]) -> None:
+        by_branch: Dict[str, List[dict]] = {}
+        bonus_by_branch: Dict[str, dict] = {}
+        for quest in quests:
+            if quest.get('title') == self._bonus_title:
+                bonus_by_branch.setdefault(quest['branch'], quest)
+            else:
+                by_branch.setdefault(quest['branch'], []).append(quest)
+
+        self._by_id = {quest['id']: quest for quest in quests}
+        self._digest = hashlib.sha256(
+            json.dumps(sorted(quests, key=lambda quest: str(quest.get('id'))), sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+        self._by_branch = by_branch
+        self._bonus_by_branch = bonus_by_branch
+
+        branches = sorted(set(by_branch) | set(bonus_by_branch))
+        self._daily_xp = {}
+        for size in range(1, len(branches) + 1):
+            for combo in combinations(branches, size):
+                key = frozenset(combo)
+                self._daily_xp[key] = self._compute_daily_xp(key)
+
+    def _select(self, branches: Iterable[str]) -> Tuple[List[dict], Optional[dict]]:
+        quest_branches = list(dict.fromkeys(list(branches) + ['global']))
+        daily_quests = [quest for branch in quest_branches for quest in self._by_branch.get(branch, [])]
+        bonus_quest = next(
+            (self._bonus_by_branch[branch] for branch in quest_branches if branch in self._bonus_by_branch),
+            None
+        )
+        return daily_quests, bonus_quest
+
+    def _compute_daily_xp(self, branches: FrozenSet[str]) -> dict:
+        daily_quests, bonus_quest = self._select(sorted(branches))
+        daily_xp = sum(quest.get('xp_reward', 0) for quest in daily_quests)
+        bonus_xp = bonus_quest.get('xp_reward', 0) if bonus_quest else 0
+        return {
+            "daily_xp": daily_xp + bonus_xp,
+            "daily_quest_count": len(daily_quests),
+            "bonus_xp": bonus_xp
+        }
+
+    async def quests_for(self, branches: Iterable[str]) -> Tuple[List[dict], Optional[dict]]:
+        """Daily quests of the branches plus global ones (copies), and the bonus quest"""
+        await self._ensure_loaded()
+        daily_quests, bonus_quest = self._select(branches)
+        return [dict(quest) for quest in daily_quests], bonus_quest
+
+    async def get(self, quest_id: str) -> Optional[dict]:
+        """Quest by id if it is part of the daily catalog"""
+        await self._ensure_loaded()
+        return self._by_id.get(quest_id)
+
+    async def daily_xp(self, branches: Iterable[str]) -> dict:
+        """Precomputed daily XP totals for the user's branch combination"""
+        await self._ensure_loaded()
+        key = frozenset(branches) | {'global'}
+        totals = self._daily_xp.get(key)
+        if totals is None:
+            totals = self._compute_daily_xp(key)
+        return dict(totals)
+
+    async def digest(self) -> str:
+        """Content hash of the current catalog snapshot"""
+        await self._ensure_loaded()
+        return self._digest
+
+    def invalidate(self) -> int:
+        """Drop the snapshot; the next read reloads the catalog"""
+        self.version += 1
+        return self.version
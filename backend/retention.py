@@ -0,0 +1,74 @@
+"""Periodic maintenance of the partitioned user_quests table
+
+``user_quests`` grows by one row per quest per user per day. It is
+range-partitioned by month, and ``maintain_user_quests`` (see
+supabase_schema.sql) keeps it bounded: it creates the upcoming monthly
+partitions before any insert needs them and folds months older than
+``USER_QUESTS_RETENTION_MONTHS`` into ``user_daily_stats`` before dropping
+them. History and streaks read the rollups, so nothing in the app needs the
+dropped raw rows. This runs the RPC every
+``USER_QUESTS_MAINTENANCE_INTERVAL_SECONDS``; an advisory lock in the function
+makes concurrent API workers skip instead of racing.
+"""
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from db import run_query
+
+USER_QUESTS_RETENTION_MONTHS = int(os.environ.get('USER_QUESTS_RETENTION_MONTHS', '3'))
+USER_QUESTS_MAINTENANCE_INTERVAL_SECONDS = float(os.environ.get('USER_QUESTS_MAINTENANCE_INTERVAL_SECONDS', '21600'))
+PARTITION_MONTHS_AHEAD = 2
+
+logger = logging.getLogger("lifequest")
+
+
+class UserQuestsRetention:
+    def __init__(
+        self,
+        supabase,
+        keep_months: int = USER_QUESTS_RETENTION_MONTHS,
+        interval: float = USER_QUESTS_MAINTENANCE_INTERVAL_SECONDS
+    ):
+        self._supabase = supabase
+        self._keep_months = keep_months
+        self._interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_result: Optional[dict] = None
+
+    async def run_once(self) -> Optional[dict]:
+        """Create upcoming partitions and archive expired ones; None if the call failed"""
+        try:
+            result = await run_query(self._supabase.rpc('maintain_user_quests', {
+                'p_keep_months': self._keep_months,
+                'p_months_ahead': PARTITION_MONTHS_AHEAD
+            }))
+        except Exception as e:
+            logger.error(f"Error maintaining user_quests partitions: {e}")
+            return None
+        self.last_result = result.data or {}
+        if self.last_result.get('created') or self.last_result.get('archived'):
+            logger.info(
+                f"user_quests partitions created={self.last_result.get('created')} "
+                f"archived={self.last_result.get('archived')}"
+            )
+        return self.last_result
+
+    async def _run(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self._interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,17 +1,40 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Header, Query, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
+from fastapi.responses import ORJSONResponse
+from starlette.responses import PlainTextResponse
+from starlette.routing import Match
 import os
+import hmac
+import uuid
 import asyncio
 import logging
 from pathlib import Path
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from time import perf_counter
-import httpx
 from supabase_client import get_supabase
+from db import run_query, run_queries, shutdown_executor
+from quest_catalog import QuestCatalog
+from cache import TTLCache
+from activity import ActivityTracker
+from retention import UserQuestsRetention
+from telegram_webhook import TelegramWebhook
+from avatar_images import AvatarImagePipeline, is_allowed_source
+from http_client import outbound_http
+from jobs import JobQueue, SupabaseJobStore
+from notifications import GoalNotificationDispatcher
+from metrics import registry, HTTP_REQUESTS, HTTP_REQUEST_DURATION, HTTP_IN_FLIGHT
+from tracing import trace_queries, report as report_queries
+from idempotency import SingleFlight, IdempotencyStore, IdempotencyKeyReused
+from leveling import goal_progress, project_level_up
+from pagination import InvalidCursor, InvalidFields, keyset_page, select_fields, split_page
+from etag import CACHE_CONTROL, etag_matches, make_etag
+from compression import CompressionMiddleware
+from streaks import Streak, current_streak, daily_history
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -23,9 +46,43 @@ logging.basicConfig(
 )
 
 supabase = get_supabase()
+activity_tracker = ActivityTracker(supabase)
+user_quests_retention = UserQuestsRetention(supabase)
+
+def build_bot_application():
+    # Imported lazily: PTB and the bot's handlers are only needed in webhook mode
+    from bot import build_application
+    return build_application(schedule_jobs=False)
+
+telegram_webhook = TelegramWebhook(build_bot_application)
+job_queue = JobQueue(SupabaseJobStore(supabase))
+avatar_pipeline = AvatarImagePipeline(supabase, lambda: outbound_http.media)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not AVATAR_WEBHOOK_SECRET:
+        logging.getLogger("lifequest").error(
+            "AVATAR_WEBHOOK_SECRET is not set: /api/webhooks/avatar-generated rejects every n8n callback with 403. "
+            "Set it and send the same value from n8n in the X-Webhook-Secret header."
+        )
+    outbound_http.start()
+    activity_tracker.start()
+    job_queue.start()
+    goal_dispatcher.start()
+    user_quests_retention.start()
+    await telegram_webhook.start()
+    yield
+    await telegram_webhook.stop()
+    await user_quests_retention.stop()
+    await goal_dispatcher.stop()
+    await job_queue.stop()
+    avatar_pipeline.shutdown()
+    await activity_tracker.stop()
+    await outbound_http.aclose()
+    shutdown_executor()
 
 # Create the main app without a prefix
-app = FastAPI(title="LifeQuest Hero API")
+app = FastAPI(title="LifeQuest Hero API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -34,16 +91,63 @@ REQUEST_COUNT = 0
 ERROR_COUNT = 0
 START_TIME = datetime.utcnow()
 BONUS_DAILY_TITLE = "⭐ Выполни все daily квесты"
+# 'rpc' completes a quest with the complete_quest Postgres function in one round trip,
+# 'legacy' keeps the step-by-step PostgREST flow for databases without it
+QUEST_COMPLETION_MODE = os.environ.get('QUEST_COMPLETION_MODE', 'rpc').lower()
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Shared with the n8n workflow, sent as X-Webhook-Secret on avatar callbacks
+AVATAR_WEBHOOK_SECRET = os.environ.get('AVATAR_WEBHOOK_SECRET')
+
+# Lists built from our own tables (quests, goals) skip response_model re-validation
+SKIP_RESPONSE_VALIDATION = os.environ.get('SKIP_RESPONSE_VALIDATION', 'true').lower() in ('1', 'true', 'yes')
+
+GOALS_PAGE_SIZE = int(os.environ.get('GOALS_PAGE_SIZE', '20'))
+GOALS_MAX_PAGE_SIZE = 100
+HISTORY_MAX_DAYS = 365
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '300'))
+REVISION_CACHE_TTL_SECONDS = float(os.environ.get('REVISION_CACHE_TTL_SECONDS', '30'))
+
+quest_catalog = QuestCatalog(supabase, BONUS_DAILY_TITLE)
+# tg_id -> {id, active_branches, is_pro}
+user_identity_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+# tg_id -> users.revision, dropped by every mutating handler and background job of this process;
+# writes by other workers are not seen here, so conditional requests always read the database
+revision_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=REVISION_CACHE_TTL_SECONDS)
+quest_completion_flight = SingleFlight()
+idempotency_store = IdempotencyStore()
+
+def route_template(request: Request) -> str:
+    """Path template of the matching route, so metrics are not labelled per tg_id"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, 'path', request.url.path)
+    return 'unmatched'
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     global REQUEST_COUNT, ERROR_COUNT
+    route = route_template(request)
+    HTTP_IN_FLIGHT.inc(method=request.method, route=route)
     start_time = perf_counter()
-    response = await call_next(request)
-    duration = perf_counter() - start_time
-    REQUEST_COUNT += 1
-    if response.status_code >= 500:
-        ERROR_COUNT += 1
+    status_code = 500
+    try:
+        with trace_queries() as trace:
+            response = await call_next(request)
+        status_code = response.status_code
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Query-Count'] = str(trace.count)
+        report_queries(trace, request.method, route, status_code)
+    finally:
+        duration = perf_counter() - start_time
+        HTTP_IN_FLIGHT.dec(method=request.method, route=route)
+        HTTP_REQUEST_DURATION.observe(duration, method=request.method, route=route)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=status_code)
+        REQUEST_COUNT += 1
+        if status_code >= 500:
+            ERROR_COUNT += 1
     logging.getLogger("lifequest").info(f"{request.method} {request.url.path} {response.status_code} {duration:.3f}")
     return response
 
@@ -80,6 +184,8 @@ class User(BaseModel):
     confidence: int = 1
     stability: int = 1
     avatar_url: Optional[str] = None
+    avatar_variants: Optional[List[dict]] = None
+    avatar_blurhash: Optional[str] = None
 
 class Progress(BaseModel):
     current_level: int = 1
@@ -97,6 +203,7 @@ class Goal(BaseModel):
     is_completed: bool = False
     completed_at: Optional[str] = None
     notified_at: Optional[str] = None
+    archived_at: Optional[str] = None
     notes: Optional[str] = None
     image_url: Optional[str] = None
     created_at: Optional[str] = None
@@ -110,10 +217,15 @@ class Quest(BaseModel):
     category: str
     is_daily: bool = True
     is_completed: bool = False
+    # Completing this quest would level the user up (projected from total_xp, bootstrap only)
+    levels_up: bool = False
 
 class CompleteQuestRequest(BaseModel):
     quest_id: str
 
+class CompleteQuestsBatchRequest(BaseModel):
+    quest_ids: List[str] = Field(..., min_length=1, max_length=50)
+
 class GoalUpdate(BaseModel):
     goal_text: Optional[str] = None
     goal_level: int = 10
@@ -122,6 +234,7 @@ class GoalUpdate(BaseModel):
     image_url: Optional[str] = None
     completed_at: Optional[str] = None
     notified_at: Optional[str] = None
+    archived_at: Optional[str] = None
 
 class GoalCreate(BaseModel):
     goal_text: Optional[str] = None
@@ -129,6 +242,35 @@ class GoalCreate(BaseModel):
     notes: Optional[str] = None
     image_url: Optional[str] = None
 
+class DailyXp(BaseModel):
+    daily_xp: int = 0
+    daily_quest_count: int = 0
+    bonus_xp: int = 0
+
+class Bootstrap(BaseModel):
+    user: User
+    progress: Optional[Progress] = None
+    quests: List[Quest] = []
+    # Active goals plus the first pages of completed and archived ones
+    goals: List[Goal] = []
+    completed_goals_cursor: Optional[str] = None
+    archived_goals_cursor: Optional[str] = None
+    daily_xp: DailyXp
+
+class DailyStat(BaseModel):
+    date: str
+    quest_count: int = 0
+    xp: int = 0
+
+class StatsHistory(BaseModel):
+    days: List[DailyStat] = []
+    current_streak: int = 0
+    best_streak: int = 0
+    active_days: int = 0
+    total_quests: int = 0
+    total_xp: int = 0
+    average_quests_per_day: float = 0.0
+
 class AvatarGenerationRequest(BaseModel):
     user_id: str
     level: int
@@ -148,7 +290,7 @@ async def health():
 @api_router.get("/ready")
 async def ready():
     try:
-        supabase.table('users').select('id').limit(1).execute()
+        await run_query(supabase.table('users').select('id').limit(1))
         return {"status": "ok"}
     except Exception:
         raise HTTPException(status_code=503, detail="not ready")
@@ -158,25 +300,141 @@ async def metrics():
     return {
         "requests_total": REQUEST_COUNT,
         "errors_total": ERROR_COUNT,
+        "user_cache": user_identity_cache.stats(),
+        "idempotency_cache": idempotency_store.stats(),
+        "coalesced_completions": quest_completion_flight.coalesced,
+        "pending_heartbeats": activity_tracker.pending,
+        "pending_goal_notifications": goal_dispatcher.pending,
+        "pending_bot_updates": telegram_webhook.pending,
         "uptime_seconds": int((datetime.utcnow() - START_TIME).total_seconds())
     }
 
+@api_router.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Route latency histograms, in-flight gauges and Supabase/n8n/Telegram timings"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def cache_user_identity(user: dict) -> dict:
+    identity = {
+        'id': user['id'],
+        'active_branches': user.get('active_branches') or ['power'],
+        'is_pro': bool(user.get('is_pro'))
+    }
+    user_identity_cache.set(user['tg_id'], identity)
+    return identity
+
+async def resolve_user(tg_id: int) -> dict:
+    """Resolve a Telegram id to the user's id, branches and PRO flag (cached)"""
+    identity = user_identity_cache.get(tg_id)
+    if identity is not None:
+        return identity
+    result = await run_query(supabase.table('users').select('id, tg_id, active_branches, is_pro').eq('tg_id', tg_id))
+    if not result.data:
+        raise HTTPException(status_code=404, detail="User not found")
+    return cache_user_identity(result.data[0])
+
+async def current_revision(tg_id: int, fresh: bool = False) -> int:
+    """The user's revision counter, bumped by database triggers on every change (cached briefly)
+
+    ``fresh`` skips the cache; If-None-Match requests use it because another
+    worker may have changed the user since this process cached the revision.
+    """
+    revision = None if fresh else revision_cache.get(tg_id)
+    if revision is not None:
+        return revision
+    result = await run_query(supabase.table('users').select('revision').eq('tg_id', tg_id))
+    if not result.data:
+        raise HTTPException(status_code=404, detail="User not found")
+    revision = result.data[0].get('revision') or 0
+    revision_cache.set(tg_id, revision)
+    return revision
+
+def bump_revision(tg_id: int):
+    """Forget the cached revision after a write so the next conditional GET sees the new one"""
+    revision_cache.pop(tg_id)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': CACHE_CONTROL})
+
+def set_etag(response: Response, etag: str):
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = CACHE_CONTROL
+
+def add_goal_progress(progress: dict) -> dict:
+    """Fill goal_progress: current level as a percentage of the goal level"""
+    progress['goal_progress'] = goal_progress(progress['current_level'], progress.get('goal_level'))
+    return progress
+
+def mark_completed_quests(quests: List[dict], completed_rows: Optional[List[dict]]) -> List[dict]:
+    completed_quest_ids = {row['quest_id'] for row in completed_rows or []}
+    for quest in quests:
+        quest['is_completed'] = quest['id'] in completed_quest_ids
+    return quests
+
+def trusted_response(rows: List[dict], model, response: Response, exclude_unset: bool = False):
+    """Serialize rows read from our own tables straight to JSON, projected onto ``model``
+
+    Skips the per-item validation FastAPI runs for ``response_model``; the
+    route keeps its response_model for the OpenAPI schema. Returns the rows
+    unchanged (validated as usual) when SKIP_RESPONSE_VALIDATION is off.
+    """
+    if not SKIP_RESPONSE_VALIDATION:
+        return rows
+    fields = model.model_fields
+    if exclude_unset:
+        content = [{name: row[name] for name in fields if name in row} for row in rows]
+    else:
+        content = [
+            {name: row[name] if field.is_required() else row.get(name, field.default) for name, field in fields.items()}
+            for row in rows
+        ]
+    # A returned Response bypasses the injected one, so carry its headers over
+    return ORJSONResponse(content, headers=dict(response.headers))
+
+def require_admin(x_admin_token: Optional[str]):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@api_router.post("/admin/quest-catalog/invalidate")
+async def invalidate_quest_catalog(x_admin_token: Optional[str] = Header(None)):
+    """Drop the cached quest catalog after editing the quests table"""
+    require_admin(x_admin_token)
+    version = quest_catalog.invalidate()
+    return {"success": True, "version": version}
+
+@api_router.post("/admin/user-quests/maintain")
+async def maintain_user_quests(x_admin_token: Optional[str] = Header(None)):
+    """Create upcoming user_quests partitions and archive expired ones now"""
+    require_admin(x_admin_token)
+    result = await user_quests_retention.run_once()
+    if result is None:
+        raise HTTPException(status_code=500, detail="user_quests maintenance failed")
+    return {"success": True, **result}
+
+async def drop_foreign_avatar(user: dict) -> dict:
+    """Clear an avatar that is not stored in Supabase (e.g. a Telegram photo URL) so a new one is generated"""
+    avatar_url = user.get('avatar_url')
+    if avatar_url and "supabase" not in avatar_url:
+        await run_query(supabase.table('users').update({
+            'avatar_url': None,
+            'avatar_variants': None,
+            'avatar_blurhash': None,
+            'updated_at': datetime.utcnow().isoformat()
+        }).eq('id', user['id']))
+        user.update(avatar_url=None, avatar_variants=None, avatar_blurhash=None)
+        bump_revision(user['tg_id'])
+    return user
+
 @api_router.post("/users/register", response_model=User)
 async def register_user(user_data: UserCreate):
     """Register or get existing user"""
     try:
         # Check if user exists
-        result = supabase.table('users').select('*').eq('tg_id', user_data.tg_id).execute()
+        result = await run_query(supabase.table('users').select('*').eq('tg_id', user_data.tg_id))
         
         if result.data and len(result.data) > 0:
-            existing_user = result.data[0]
-            avatar_url = existing_user.get('avatar_url')
-            if avatar_url and "supabase" not in avatar_url:
-                supabase.table('users').update({
-                    'avatar_url': None,
-                    'updated_at': datetime.utcnow().isoformat()
-                }).eq('id', existing_user['id']).execute()
-                existing_user['avatar_url'] = None
+            existing_user = await drop_foreign_avatar(result.data[0])
+            cache_user_identity(existing_user)
             return existing_user
         
         incoming_avatar_url = user_data.avatar_url
@@ -200,7 +458,7 @@ async def register_user(user_data: UserCreate):
             'stability': 1
         }
         
-        user_result = supabase.table('users').insert(new_user).execute()
+        user_result = await run_query(supabase.table('users').insert(new_user))
         created_user = user_result.data[0]
         
         # Create progress record
@@ -211,7 +469,8 @@ async def register_user(user_data: UserCreate):
             'next_level_xp': 100,
             'total_xp': 0
         }
-        supabase.table('progress').insert(progress).execute()
+        await run_query(supabase.table('progress').insert(progress))
+        cache_user_identity(created_user)
         
         return created_user
         
@@ -219,26 +478,59 @@ async def register_user(user_data: UserCreate):
         logging.error(f"Error registering user: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def trigger_n8n_webhook(n8n_webhook: str, payload: dict, user_id: str, tg_id: int):
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(n8n_webhook, json=payload, timeout=20.0)
-            logging.getLogger("lifequest").info(
-                f"n8n webhook {response.status_code} user_id={user_id} tg_id={tg_id}"
-            )
-    except Exception as e:
-        logging.error(f"Error calling n8n webhook: {e}")
+async def enqueue_avatar_generation(user_id: str, tg_id: int, profile: dict, branch: str, level: int):
+    """Record a pending avatar generation and queue the n8n call for the job workers"""
+    if not os.environ.get('N8N_WEBHOOK_URL'):
+        logging.getLogger("lifequest").warning("N8N_WEBHOOK_URL is not set")
+        return
+    generation_id = str(uuid.uuid4())
+    await run_query(supabase.table('avatar_generations').insert({
+        'id': generation_id,
+        'user_id': user_id,
+        'level': level,
+        'generation_status': 'pending'
+    }))
+    await job_queue.enqueue('avatar_generation', {
+        'generation_id': generation_id,
+        'user_id': user_id,
+        'tg_id': tg_id,
+        'selfie_url': profile.get('selfie_url'),
+        'branch': branch,
+        'gender': profile.get('gender'),
+        'age': profile.get('age'),
+        'level': level
+    })
+
+async def run_avatar_generation_job(payload: dict):
+    n8n_webhook = os.environ.get('N8N_WEBHOOK_URL')
+    if not n8n_webhook:
+        raise RuntimeError("N8N_WEBHOOK_URL is not set")
+    response = await outbound_http.n8n.post(n8n_webhook, json=payload)
+    logging.getLogger("lifequest").info(
+        f"n8n webhook {response.status_code} user_id={payload['user_id']} tg_id={payload['tg_id']}"
+    )
+    response.raise_for_status()
+    # n8n may have called back already; never move a completed generation back to processing
+    await run_query(supabase.table('avatar_generations').update({
+        'generation_status': 'processing'
+    }).eq('id', payload['generation_id']).eq('generation_status', 'pending'))
+
+async def fail_avatar_generation(payload: dict, error: str):
+    await run_query(supabase.table('avatar_generations').update({
+        'generation_status': 'failed'
+    }).eq('id', payload['generation_id']).in_('generation_status', ['pending', 'processing']))
+
+async def run_avatar_variants_job(payload: dict):
+    for row in await avatar_pipeline.process(payload):
+        bump_revision(row['tg_id'])
 
 @api_router.post("/users/{tg_id}/onboarding")
 async def complete_onboarding(tg_id: int, onboarding: OnboardingData):
     """Complete onboarding process"""
     try:
         # Get user
-        result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = result.data[0]['id']
+        user = await resolve_user(tg_id)
+        user_id = user['id']
         
         # Update user data
         user_update = {
@@ -248,7 +540,6 @@ async def complete_onboarding(tg_id: int, onboarding: OnboardingData):
             'selfie_url': onboarding.selfie_url,
             'updated_at': datetime.utcnow().isoformat()
         }
-        supabase.table('users').update(user_update).eq('tg_id', tg_id).execute()
         
         # Update progress with goal
         progress_update = {
@@ -256,30 +547,22 @@ async def complete_onboarding(tg_id: int, onboarding: OnboardingData):
             'goal_level': onboarding.goal_level,
             'updated_at': datetime.utcnow().isoformat()
         }
-        supabase.table('progress').update(progress_update).eq('user_id', user_id).execute()
+        await run_queries(
+            supabase.table('users').update(user_update).eq('tg_id', tg_id),
+            supabase.table('progress').update(progress_update).eq('user_id', user_id)
+        )
+        user_identity_cache.pop(tg_id)
 
         if onboarding.goal_text:
-            supabase.table('goals').insert({
+            await run_query(supabase.table('goals').insert({
                 'user_id': user_id,
                 'goal_text': onboarding.goal_text,
                 'goal_level': onboarding.goal_level
-            }).execute()
+            }))
+        bump_revision(tg_id)
         
-        # Trigger avatar generation via n8n webhook
-        n8n_webhook = os.environ.get('N8N_WEBHOOK_URL')
-        if n8n_webhook:
-            payload = {
-                'user_id': user_id,
-                'tg_id': tg_id,
-                'selfie_url': onboarding.selfie_url,
-                'branch': onboarding.branch,
-                'gender': onboarding.gender,
-                'age': onboarding.age,
-                'level': 1
-            }
-            asyncio.create_task(trigger_n8n_webhook(n8n_webhook, payload, user_id, tg_id))
-        else:
-            logging.getLogger("lifequest").warning("N8N_WEBHOOK_URL is not set")
+        # Queue avatar generation via n8n webhook
+        await enqueue_avatar_generation(user_id, tg_id, onboarding.model_dump(), onboarding.branch, 1)
         
         return {"success": True, "message": "Onboarding completed"}
         
@@ -290,16 +573,21 @@ async def complete_onboarding(tg_id: int, onboarding: OnboardingData):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/users/{tg_id}", response_model=User)
-async def get_user(tg_id: int):
+async def get_user(tg_id: int, response: Response, if_none_match: Optional[str] = Header(None)):
     """Get user by Telegram ID"""
     try:
-        result = supabase.table('users').select('*').eq('tg_id', tg_id).execute()
+        etag = make_etag(tg_id, 'user', await current_revision(tg_id, fresh=bool(if_none_match)))
+        # Update last active (buffered, flushed in bulk)
+        activity_tracker.touch(tg_id)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        result = await run_query(supabase.table('users').select('*').eq('tg_id', tg_id))
         if not result.data:
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Update last active
-        supabase.table('users').update({'last_active_at': datetime.utcnow().isoformat()}).eq('tg_id', tg_id).execute()
-        
+        cache_user_identity(result.data[0])
+        set_etag(response, etag)
         return result.data[0]
     except HTTPException:
         raise
@@ -312,7 +600,7 @@ async def delete_user_by_username(username: str):
     """Delete user by username (for testing purposes)"""
     try:
         # Find user by username
-        result = supabase.table('users').select('id, tg_id').eq('username', username).execute()
+        result = await run_query(supabase.table('users').select('id, tg_id').eq('username', username))
         if not result.data:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -320,13 +608,15 @@ async def delete_user_by_username(username: str):
         tg_id = result.data[0]['tg_id']
         
         # Delete user_quests
-        supabase.table('user_quests').delete().eq('user_id', user_id).execute()
+        await run_query(supabase.table('user_quests').delete().eq('user_id', user_id))
         
         # Delete progress
-        supabase.table('progress').delete().eq('user_id', user_id).execute()
+        await run_query(supabase.table('progress').delete().eq('user_id', user_id))
         
         # Delete user
-        supabase.table('users').delete().eq('id', user_id).execute()
+        await run_query(supabase.table('users').delete().eq('id', user_id))
+        user_identity_cache.pop(tg_id)
+        bump_revision(tg_id)
         
         return {"success": True, "message": f"User @{username} (tg_id: {tg_id}) deleted successfully"}
         
@@ -337,42 +627,69 @@ async def delete_user_by_username(username: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/users/{tg_id}/progress", response_model=Progress)
-async def get_progress(tg_id: int):
+async def get_progress(tg_id: int, response: Response, if_none_match: Optional[str] = Header(None)):
     """Get user progress"""
     try:
-        # Get user ID
-        user_result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
+        etag = make_etag(tg_id, 'progress', await current_revision(tg_id, fresh=bool(if_none_match)))
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         
-        user_id = user_result.data[0]['id']
+        # Get user ID
+        user = await resolve_user(tg_id)
+        user_id = user['id']
         
         # Get progress
-        result = supabase.table('progress').select('*').eq('user_id', user_id).execute()
+        result = await run_query(supabase.table('progress').select('*').eq('user_id', user_id))
         if not result.data:
             raise HTTPException(status_code=404, detail="Progress not found")
         
-        progress = result.data[0]
-        # Calculate goal progress
-        progress['goal_progress'] = int((progress['current_level'] / progress.get('goal_level', 10)) * 100)
-        
-        return progress
+        set_etag(response, etag)
+        return add_goal_progress(result.data[0])
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error getting progress: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/users/{tg_id}/goals", response_model=List[Goal])
-async def get_goals(tg_id: int):
+def goals_query(user_id: str, status: Optional[str], columns: str = '*'):
+    """Goals of a user by status: active, completed (not archived) or archived; None for all"""
+    query = supabase.table('goals').select(columns).eq('user_id', user_id)
+    if status == 'active':
+        return query.eq('is_completed', False)
+    if status == 'completed':
+        return query.eq('is_completed', True).is_('archived_at', 'null')
+    if status == 'archived':
+        return query.eq('is_completed', True).not_.is_('archived_at', 'null')
+    return query
+
+@api_router.get("/users/{tg_id}/goals", response_model=List[Goal], response_model_exclude_unset=True)
+async def get_goals(
+    tg_id: int,
+    response: Response,
+    status: Optional[str] = Query(None, pattern='^(active|completed|archived)$'),
+    limit: int = Query(GOALS_PAGE_SIZE, ge=1, le=GOALS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """A page of goals, newest first; the next page's cursor is in the X-Next-Cursor header"""
     try:
-        user_result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_result.data[0]['id']
-        goals_result = supabase.table('goals').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
-        return goals_result.data or []
+        columns = select_fields(fields, Goal.model_fields)
+        etag = make_etag(tg_id, 'goals', await current_revision(tg_id, fresh=bool(if_none_match)), status, limit, cursor, columns)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        user = await resolve_user(tg_id)
+        goals_result = await run_query(keyset_page(goals_query(user['id'], status, columns), cursor, limit))
+        goals, next_cursor = split_page(goals_result.data or [], limit)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        set_etag(response, etag)
+        return trusted_response(goals, Goal, response, exclude_unset=True)
+    except InvalidFields as e:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {e}")
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except HTTPException:
         raise
     except Exception as e:
@@ -382,11 +699,8 @@ async def get_goals(tg_id: int):
 @api_router.post("/users/{tg_id}/goals", response_model=Goal)
 async def create_goal(tg_id: int, goal: GoalCreate):
     try:
-        user_result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_result.data[0]['id']
+        user = await resolve_user(tg_id)
+        user_id = user['id']
         insert_payload = {
             'user_id': user_id,
             'goal_text': goal.goal_text,
@@ -394,7 +708,8 @@ async def create_goal(tg_id: int, goal: GoalCreate):
             'notes': goal.notes,
             'image_url': goal.image_url
         }
-        result = supabase.table('goals').insert(insert_payload).execute()
+        result = await run_query(supabase.table('goals').insert(insert_payload))
+        bump_revision(tg_id)
         return result.data[0]
     except HTTPException:
         raise
@@ -405,11 +720,8 @@ async def create_goal(tg_id: int, goal: GoalCreate):
 @api_router.patch("/users/{tg_id}/goals/{goal_id}", response_model=Goal)
 async def update_goal(tg_id: int, goal_id: str, goal: GoalUpdate):
     try:
-        user_result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_result.data[0]['id']
+        user = await resolve_user(tg_id)
+        user_id = user['id']
         update_payload = {
             'goal_text': goal.goal_text,
             'goal_level': goal.goal_level,
@@ -418,13 +730,15 @@ async def update_goal(tg_id: int, goal_id: str, goal: GoalUpdate):
             'image_url': goal.image_url,
             'completed_at': goal.completed_at,
             'notified_at': goal.notified_at,
+            'archived_at': goal.archived_at,
             'updated_at': datetime.utcnow().isoformat()
         }
         update_payload = {key: value for key, value in update_payload.items() if value is not None}
         
-        result = supabase.table('goals').update(update_payload).eq('id', goal_id).eq('user_id', user_id).execute()
+        result = await run_query(supabase.table('goals').update(update_payload).eq('id', goal_id).eq('user_id', user_id))
         if not result.data:
             raise HTTPException(status_code=404, detail="Goal not found")
+        bump_revision(tg_id)
         return result.data[0]
     except HTTPException:
         raise
@@ -435,19 +749,17 @@ async def update_goal(tg_id: int, goal_id: str, goal: GoalUpdate):
 @api_router.post("/users/{tg_id}/goals/{goal_id}/complete", response_model=Goal)
 async def complete_goal(tg_id: int, goal_id: str):
     try:
-        user_result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_result.data[0]['id']
+        user = await resolve_user(tg_id)
+        user_id = user['id']
         now = datetime.utcnow().isoformat()
-        result = supabase.table('goals').update({
+        result = await run_query(supabase.table('goals').update({
             'is_completed': True,
             'completed_at': now,
             'updated_at': now
-        }).eq('id', goal_id).eq('user_id', user_id).execute()
+        }).eq('id', goal_id).eq('user_id', user_id))
         if not result.data:
             raise HTTPException(status_code=404, detail="Goal not found")
+        bump_revision(tg_id)
         return result.data[0]
     except HTTPException:
         raise
@@ -459,29 +771,25 @@ async def send_goal_achieved_notification(tg_id: int, goal_text: str, level: int
     token = os.environ.get('TELEGRAM_BOT_TOKEN')
     if not token:
         logging.warning("TELEGRAM_BOT_TOKEN not set")
-        return
+        return None
     message = f"🎁 Ты достиг уровня {level} и заслужил: {goal_text}"
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    async with httpx.AsyncClient() as client:
-        await client.post(url, json={"chat_id": tg_id, "text": message}, timeout=10.0)
+    return await outbound_http.telegram.post(f"/bot{token}/sendMessage", json={"chat_id": tg_id, "text": message})
 
 @api_router.post("/users/{tg_id}/goals/{goal_id}/notify")
 async def notify_goal(tg_id: int, goal_id: str):
     try:
-        user_result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_result.data[0]['id']
-        goal_result = supabase.table('goals').select('*').eq('id', goal_id).eq('user_id', user_id).execute()
+        user = await resolve_user(tg_id)
+        user_id = user['id']
+        goal_result = await run_query(supabase.table('goals').select('*').eq('id', goal_id).eq('user_id', user_id))
         if not goal_result.data:
             raise HTTPException(status_code=404, detail="Goal not found")
         
         goal = goal_result.data[0]
         await send_goal_achieved_notification(tg_id, goal.get('goal_text') or 'Цель', goal.get('goal_level') or 1)
-        supabase.table('goals').update({
+        await run_query(supabase.table('goals').update({
             'notified_at': datetime.utcnow().isoformat()
-        }).eq('id', goal_id).execute()
+        }).eq('id', goal_id))
+        bump_revision(tg_id)
         return {"success": True}
     except HTTPException:
         raise
@@ -492,24 +800,8 @@ async def notify_goal(tg_id: int, goal_id: str):
 @api_router.get("/users/{tg_id}/daily-xp")
 async def get_daily_xp(tg_id: int):
     try:
-        user_result = supabase.table('users').select('id, active_branches').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user = user_result.data[0]
-        branches = user['active_branches']
-        quest_branches = branches + ['global']
-        quests_result = supabase.table('quests').select('title, xp_reward').in_('branch', quest_branches).eq('is_daily', True).execute()
-        quests = quests_result.data or []
-        bonus_quest = next((quest for quest in quests if quest.get('title') == BONUS_DAILY_TITLE), None)
-        daily_quests = [quest for quest in quests if quest.get('title') != BONUS_DAILY_TITLE]
-        daily_xp = sum(quest.get('xp_reward', 0) for quest in daily_quests)
-        bonus_xp = bonus_quest.get('xp_reward', 0) if bonus_quest else 0
-        return {
-            "daily_xp": daily_xp + bonus_xp,
-            "daily_quest_count": len(daily_quests),
-            "bonus_xp": bonus_xp
-        }
+        user = await resolve_user(tg_id)
+        return await quest_catalog.daily_xp(user['active_branches'])
     except HTTPException:
         raise
     except Exception as e:
@@ -519,24 +811,21 @@ async def get_daily_xp(tg_id: int):
 @api_router.post("/users/{tg_id}/goal")
 async def update_goal(tg_id: int, goal: GoalUpdate):
     try:
-        user_result = supabase.table('users').select('id').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_result.data[0]['id']
+        user = await resolve_user(tg_id)
+        user_id = user['id']
         update_payload = {
             'goal_text': goal.goal_text,
             'goal_level': goal.goal_level,
             'updated_at': datetime.utcnow().isoformat()
         }
-        supabase.table('progress').update(update_payload).eq('user_id', user_id).execute()
+        await run_query(supabase.table('progress').update(update_payload).eq('user_id', user_id))
+        bump_revision(tg_id)
         
-        progress_result = supabase.table('progress').select('*').eq('user_id', user_id).execute()
+        progress_result = await run_query(supabase.table('progress').select('*').eq('user_id', user_id))
         if not progress_result.data:
             raise HTTPException(status_code=404, detail="Progress not found")
         
-        progress = progress_result.data[0]
-        progress['goal_progress'] = int((progress['current_level'] / progress.get('goal_level', 10)) * 100)
+        progress = add_goal_progress(progress_result.data[0])
         
         return {"success": True, "progress": progress}
     except HTTPException:
@@ -546,36 +835,33 @@ async def update_goal(tg_id: int, goal: GoalUpdate):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/users/{tg_id}/quests", response_model=List[Quest])
-async def get_quests(tg_id: int):
+async def get_quests(tg_id: int, response: Response, if_none_match: Optional[str] = Header(None)):
     """Get quests for user based on their active branches"""
     start_time = perf_counter()
     try:
-        # Get user and their branches
-        user_result = supabase.table('users').select('id, active_branches').eq('tg_id', tg_id).execute()
-        if not user_result.data:
-            raise HTTPException(status_code=404, detail="User not found")
+        # Completion marks reset daily and the catalog rows can change, so both shape the tag;
+        # the catalog part is a content hash so every worker tags the same rows alike
+        today = date.today().isoformat()
+        revision, catalog_digest = await asyncio.gather(
+            current_revision(tg_id, fresh=bool(if_none_match)), quest_catalog.digest()
+        )
+        etag = make_etag(tg_id, 'quests', revision, today, catalog_digest)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         
-        user = user_result.data[0]
+        # Get user and their branches
+        user = await resolve_user(tg_id)
         user_id = user['id']
         branches = user['active_branches']
         
-        # Get quests for user's branches + global
-        quest_branches = branches + ['global']
-        quests_result = supabase.table('quests').select('*').in_('branch', quest_branches).eq('is_daily', True).execute()
-        filtered_quests = [quest for quest in quests_result.data if quest.get('title') != BONUS_DAILY_TITLE]
+        # Get quests for user's branches + global from the catalog cache
+        filtered_quests, _ = await quest_catalog.quests_for(branches)
         
         # Get completed quests for today
-        today = date.today().isoformat()
-        completed_result = supabase.table('user_quests').select('quest_id').eq('user_id', user_id).eq('completion_date', today).execute()
-        completed_quest_ids = [q['quest_id'] for q in completed_result.data]
+        completed_result = await run_query(supabase.table('user_quests').select('quest_id').eq('user_id', user_id).eq('completion_date', today))
         
-        # Mark completed quests
-        quests = []
-        for quest in filtered_quests:
-            quest['is_completed'] = quest['id'] in completed_quest_ids
-            quests.append(quest)
-        
-        return quests
+        set_etag(response, etag)
+        return trusted_response(mark_completed_quests(filtered_quests, completed_result.data), Quest, response)
     except HTTPException:
         raise
     except Exception as e:
@@ -585,208 +871,570 @@ async def get_quests(tg_id: int):
         duration = perf_counter() - start_time
         logging.getLogger("lifequest").info(f"get_quests {tg_id} {duration:.3f}")
 
-@api_router.post("/users/{tg_id}/quests/complete")
-async def complete_quest(tg_id: int, request: CompleteQuestRequest):
-    """Complete a quest and award XP"""
+@api_router.get("/users/{tg_id}/stats/history", response_model=StatsHistory)
+async def get_stats_history(
+    tg_id: int,
+    response: Response,
+    days: int = Query(30, ge=1, le=HISTORY_MAX_DAYS),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Quests and XP per day for the last ``days`` days plus streaks, read from the daily rollups"""
+    try:
+        today = date.today()
+        etag = make_etag(tg_id, 'stats-history', await current_revision(tg_id, fresh=bool(if_none_match)), today.isoformat(), days)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        user = await resolve_user(tg_id)
+        since = today - timedelta(days=days - 1)
+        rollup_result, streak_result = await run_queries(
+            supabase.table('user_daily_stats').select('stat_date, quest_count, xp').eq('user_id', user['id']).gte('stat_date', since.isoformat()).order('stat_date'),
+            supabase.table('user_streaks').select('*').eq('user_id', user['id'])
+        )
+        history = daily_history(rollup_result.data or [], since, today)
+        streak_row = streak_result.data[0] if streak_result.data else {}
+        last_date = streak_row.get('last_completion_date')
+        streak = Streak(
+            streak_row.get('current_streak') or 0,
+            streak_row.get('best_streak') or 0,
+            date.fromisoformat(last_date) if last_date else None
+        )
+        total_quests = sum(day['quest_count'] for day in history)
+        
+        set_etag(response, etag)
+        return {
+            "days": history,
+            "current_streak": current_streak(streak, today),
+            "best_streak": streak.best,
+            "active_days": sum(1 for day in history if day['quest_count'] or day['xp']),
+            "total_quests": total_quests,
+            "total_xp": sum(day['xp'] for day in history),
+            "average_quests_per_day": round(total_quests / days, 2)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting stats history: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/users/{tg_id}/bootstrap", response_model=Bootstrap)
+async def get_bootstrap(tg_id: int):
+    """Everything the app needs on open: user, progress, quests, goals and daily XP
+
+    Existing users open the app with this single request; only a 404 sends the
+    client to /users/register first.
+    """
     start_time = perf_counter()
     try:
-        # Get user
-        user_result = supabase.table('users').select('id, active_branches').eq('tg_id', tg_id).execute()
+        identity = await resolve_user(tg_id)
+        user_id = identity['id']
+        today = date.today().isoformat()
+        
+        (
+            user_result, progress_result, active_goals_result, completed_goals_result, archived_goals_result, completed_result
+        ), (daily_quests, _), daily_xp = await asyncio.gather(
+            run_queries(
+                supabase.table('users').select('*').eq('id', user_id),
+                supabase.table('progress').select('*').eq('user_id', user_id),
+                keyset_page(goals_query(user_id, 'active'), None, GOALS_MAX_PAGE_SIZE),
+                keyset_page(goals_query(user_id, 'completed'), None, GOALS_PAGE_SIZE),
+                keyset_page(goals_query(user_id, 'archived'), None, GOALS_PAGE_SIZE),
+                supabase.table('user_quests').select('quest_id').eq('user_id', user_id).eq('completion_date', today)
+            ),
+            quest_catalog.quests_for(identity['active_branches']),
+            quest_catalog.daily_xp(identity['active_branches'])
+        )
         if not user_result.data:
+            user_identity_cache.pop(tg_id)
             raise HTTPException(status_code=404, detail="User not found")
         
-        user = user_result.data[0]
-        user_id = user['id']
-        
-        # Check if quest already completed today
-        today = date.today().isoformat()
-        completed_check = supabase.table('user_quests').select('id').eq('user_id', user_id).eq('quest_id', request.quest_id).eq('completion_date', today).execute()
-        
-        if completed_check.data:
-            raise HTTPException(status_code=400, detail="Quest already completed today")
+        user = await drop_foreign_avatar(user_result.data[0])
+        cache_user_identity(user)
+        activity_tracker.touch(tg_id)
+        
+        progress = add_goal_progress(progress_result.data[0]) if progress_result.data else None
+        active_goals, _ = split_page(active_goals_result.data or [], GOALS_MAX_PAGE_SIZE)
+        completed_goals, completed_goals_cursor = split_page(completed_goals_result.data or [], GOALS_PAGE_SIZE)
+        archived_goals, archived_goals_cursor = split_page(archived_goals_result.data or [], GOALS_PAGE_SIZE)
+        quests = mark_completed_quests(daily_quests, completed_result.data)
+        if progress:
+            for quest in quests:
+                quest['levels_up'] = not quest['is_completed'] and project_level_up(
+                    progress.get('total_xp') or 0, quest['xp_reward']
+                ).leveled_up
         
-        # Get quest details
-        quest_result = supabase.table('quests').select('*').eq('id', request.quest_id).execute()
+        return {
+            "user": user,
+            "progress": progress,
+            "quests": quests,
+            "goals": active_goals + completed_goals + archived_goals,
+            "completed_goals_cursor": completed_goals_cursor,
+            "archived_goals_cursor": archived_goals_cursor,
+            "daily_xp": daily_xp
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting bootstrap data: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        duration = perf_counter() - start_time
+        logging.getLogger("lifequest").info(f"get_bootstrap {tg_id} {duration:.3f}")
+
+async def trigger_avatar_regeneration(user_id: str, tg_id: int, user_data: dict, branches: List[str], level: int):
+    """Queue an avatar regeneration for a milestone level"""
+    try:
+        await enqueue_avatar_generation(user_id, tg_id, user_data, branches[0] if branches else 'power', level)
+    except Exception as e:
+        logging.error(f"Error queueing avatar regeneration: {e}")
+
+def notify_achieved_goals(tg_id: int, achieved_goals: List[dict], level: int):
+    """Hand achieved goals to the background dispatcher; the response does not wait for Telegram"""
+    goal_dispatcher.emit(tg_id, achieved_goals, level)
+
+async def deliver_goal_notification(event: dict):
+    response = await send_goal_achieved_notification(event['tg_id'], event['goal_text'], event['level'])
+    if response is None:
+        # No bot configured: nothing to send, and retrying would not help; count it as notified
+        return
+    response.raise_for_status()
+
+async def retry_goal_notification(event: dict):
+    await job_queue.enqueue('goal_notification', event, dedupe_key=f"goal_notification:{event['goal_id']}")
+
+async def run_goal_notification_job(payload: dict):
+    await deliver_goal_notification(payload)
+    await run_query(supabase.table('goals').update({
+        'notified_at': datetime.utcnow().isoformat()
+    }).eq('id', payload['goal_id']))
+    bump_revision(payload['tg_id'])
+
+def is_unique_violation(error: Exception) -> bool:
+    return getattr(error, 'code', None) == '23505' or 'duplicate key' in str(error)
+
+async def complete_idempotently(tg_id: int, idempotency_key: Optional[str], request_key: tuple, work):
+    """Replay the recorded outcome of an Idempotency-Key, or run ``work`` once for identical in-flight requests"""
+    if idempotency_key:
+        try:
+            record = idempotency_store.get(tg_id, idempotency_key, request_key)
+        except IdempotencyKeyReused:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if record is not None:
+            if record['status_code'] >= 400:
+                raise HTTPException(status_code=record['status_code'], detail=record['body'])
+            return record['body']
+    try:
+        result = await quest_completion_flight.do((tg_id,) + request_key, work)
+    except HTTPException as e:
+        # 4xx outcomes are final for this request; 5xx stay retryable
+        if idempotency_key and e.status_code < 500:
+            idempotency_store.save(tg_id, idempotency_key, request_key, e.status_code, e.detail)
+        raise
+    finally:
+        # Even a failed completion may have written part of its steps
+        bump_revision(tg_id)
+    if idempotency_key:
+        idempotency_store.save(tg_id, idempotency_key, request_key, 200, result)
+    return result
+
+def milestone_level(previous_level: int, new_level: int) -> Optional[int]:
+    """Highest avatar milestone (every 5 levels) reached in (previous_level, new_level]"""
+    milestone = new_level - new_level % 5
+    return milestone if milestone > previous_level else None
+
+async def complete_quest_legacy(tg_id: int, quest_id: str) -> dict:
+    """Complete a quest with one PostgREST call per step"""
+    # Get user
+    user = await resolve_user(tg_id)
+    user_id = user['id']
+    
+    # Check if quest already completed today
+    today = date.today().isoformat()
+    completed_check = await run_query(supabase.table('user_quests').select('id').eq('user_id', user_id).eq('quest_id', quest_id).eq('completion_date', today))
+    
+    if completed_check.data:
+        raise HTTPException(status_code=400, detail="Quest already completed today")
+    
+    # Get quest details
+    quest = await quest_catalog.get(quest_id)
+    if quest is None:
+        quest_result = await run_query(supabase.table('quests').select('*').eq('id', quest_id))
         if not quest_result.data:
             raise HTTPException(status_code=404, detail="Quest not found")
-        
         quest = quest_result.data[0]
-        xp_reward = quest['xp_reward']
-        
-        # Mark quest as completed
-        supabase.table('user_quests').insert({
+    xp_reward = quest['xp_reward']
+    
+    # Mark quest as completed; a concurrent duplicate loses on the unique constraint
+    try:
+        await run_query(supabase.table('user_quests').insert({
             'user_id': user_id,
-            'quest_id': request.quest_id,
+            'quest_id': quest_id,
             'completion_date': today,
             'is_today': True
-        }).execute()
-        
-        # Add XP and check for level up
-        result = supabase.rpc('add_xp_and_check_level', {
+        }))
+    except Exception as e:
+        if is_unique_violation(e):
+            raise HTTPException(status_code=400, detail="Quest already completed today")
+        raise
+    
+    # Add XP and check for level up
+    result = await run_query(supabase.rpc('add_xp_and_check_level', {
+        'p_user_id': user_id,
+        'p_xp_amount': xp_reward
+    }))
+    
+    level_up_data = result.data[0] if result.data else None
+    leveled_up = level_up_data['leveled_up'] if level_up_data else False
+    new_level = level_up_data['new_level'] if level_up_data else 1
+    bonus_awarded = False
+    bonus_xp = 0
+    bonus_leveled_up = False
+    bonus_new_level = None
+    
+    # If leveled up, update stats
+    if leveled_up:
+        branches = user['active_branches']
+        await run_query(supabase.rpc('update_stats_on_levelup', {
             'p_user_id': user_id,
-            'p_xp_amount': xp_reward
-        }).execute()
-        
-        level_up_data = result.data[0] if result.data else None
+            'p_branches': branches,
+            'p_levels': level_up_data.get('levels_gained', 1)
+        }))
+        
+        # Trigger avatar regeneration every 5 levels, also when a multi-level jump skips past one
+        milestone = milestone_level(new_level - level_up_data.get('levels_gained', 1), new_level)
+        if milestone and os.environ.get('N8N_WEBHOOK_URL'):
+            user_full = await run_query(supabase.table('users').select('*').eq('id', user_id))
+            user_data = user_full.data[0] if user_full.data else {}
+            await trigger_avatar_regeneration(user_id, tg_id, user_data, branches, milestone)
+
+    daily_quests, bonus_quest = await quest_catalog.quests_for(user['active_branches'])
+    daily_quest_ids = [quest['id'] for quest in daily_quests]
+    completed_today_result = await run_query(supabase.table('user_quests').select('quest_id').eq('user_id', user_id).eq('completion_date', today))
+    completed_today = completed_today_result.data or []
+    completed_today_ids = {quest['quest_id'] for quest in completed_today}
+
+    if daily_quest_ids and all(quest_id in completed_today_ids for quest_id in daily_quest_ids) and bonus_quest:
+        bonus_xp = bonus_quest.get('xp_reward', 0)
+        bonus_quest_id = bonus_quest['id']
+        bonus_check = await run_query(supabase.table('user_quests').select('id').eq('user_id', user_id).eq('quest_id', bonus_quest_id).eq('completion_date', today))
+        if not bonus_check.data:
+            await run_query(supabase.table('user_quests').insert({
+                'user_id': user_id,
+                'quest_id': bonus_quest_id,
+                'completion_date': today,
+                'is_today': True
+            }))
+            bonus_result = await run_query(supabase.rpc('add_xp_and_check_level', {
+                'p_user_id': user_id,
+                'p_xp_amount': bonus_xp
+            }))
+            bonus_level_up_data = bonus_result.data[0] if bonus_result.data else None
+            bonus_leveled_up = bonus_level_up_data['leveled_up'] if bonus_level_up_data else False
+            bonus_new_level = bonus_level_up_data['new_level'] if bonus_level_up_data else None
+            bonus_awarded = True
+
+            if bonus_leveled_up:
+                branches = user['active_branches']
+                await run_query(supabase.rpc('update_stats_on_levelup', {
+                    'p_user_id': user_id,
+                    'p_branches': branches,
+                    'p_levels': bonus_level_up_data.get('levels_gained', 1)
+                }))
+                
+                bonus_milestone = milestone_level(
+                    bonus_new_level - bonus_level_up_data.get('levels_gained', 1), bonus_new_level
+                ) if bonus_new_level else None
+                if bonus_milestone and os.environ.get('N8N_WEBHOOK_URL'):
+                    user_full = await run_query(supabase.table('users').select('*').eq('id', user_id))
+                    user_data = user_full.data[0] if user_full.data else {}
+                    await trigger_avatar_regeneration(user_id, tg_id, user_data, branches, bonus_milestone)
+
+    await run_query(supabase.rpc('record_daily_completion', {
+        'p_user_id': user_id,
+        'p_date': today,
+        'p_quests': 1,
+        'p_xp': xp_reward + (bonus_xp if bonus_awarded else 0)
+    }))
+    
+    effective_level = max(new_level, bonus_new_level or new_level)
+    goals_result = await run_query(supabase.table('goals').select('*').eq('user_id', user_id).eq('is_completed', False))
+    goals_data = goals_result.data or []
+    achieved_goals = [
+        goal for goal in goals_data
+        if (goal.get('goal_level') or 1) <= effective_level
+        and goal.get('notified_at') is None and goal.get('notify_claimed_at') is None
+    ]
+    notify_achieved_goals(tg_id, achieved_goals, effective_level)
+
+    return {
+        "success": True,
+        "xp_gained": xp_reward,
+        "leveled_up": leveled_up,
+        "new_level": new_level,
+        "bonus_awarded": bonus_awarded,
+        "bonus_xp": bonus_xp,
+        "bonus_leveled_up": bonus_leveled_up,
+        "bonus_new_level": bonus_new_level,
+        "achieved_goals": achieved_goals
+    }
+
+async def complete_quest_rpc(tg_id: int, quest_id: str) -> dict:
+    """Complete a quest through the complete_quest Postgres function (one round trip)"""
+    result = await run_query(supabase.rpc('complete_quest', {
+        'p_tg_id': tg_id,
+        'p_quest_id': quest_id,
+        'p_completion_date': date.today().isoformat(),
+        'p_bonus_title': BONUS_DAILY_TITLE
+    }))
+    outcome = result.data or {}
+    status = outcome.get('status')
+    if status == 'user_not_found':
+        raise HTTPException(status_code=404, detail="User not found")
+    if status == 'quest_not_found':
+        raise HTTPException(status_code=404, detail="Quest not found")
+    if status == 'already_completed':
+        raise HTTPException(status_code=400, detail="Quest already completed today")
+
+    user_id = outcome['user_id']
+    avatar = outcome.get('avatar') or {}
+    branches = avatar.get('active_branches') or []
+    new_level = outcome['new_level']
+    bonus_new_level = outcome.get('bonus_new_level')
+    effective_level = max(new_level, bonus_new_level or new_level)
+    if outcome['leveled_up'] or outcome['bonus_leveled_up']:
+        # One regeneration for the highest milestone the quest and its bonus reached
+        milestone = milestone_level(outcome.get('previous_level', new_level), effective_level)
+        if milestone:
+            await trigger_avatar_regeneration(user_id, tg_id, avatar, branches, milestone)
+
+    achieved_goals = outcome.get('achieved_goals') or []
+    notify_achieved_goals(tg_id, achieved_goals, effective_level)
+
+    return {
+        "success": True,
+        "xp_gained": outcome['xp_gained'],
+        "leveled_up": outcome['leveled_up'],
+        "new_level": new_level,
+        "bonus_awarded": outcome['bonus_awarded'],
+        "bonus_xp": outcome['bonus_xp'],
+        "bonus_leveled_up": outcome['bonus_leveled_up'],
+        "bonus_new_level": bonus_new_level,
+        "achieved_goals": achieved_goals
+    }
+
+@api_router.post("/users/{tg_id}/quests/complete")
+async def complete_quest(tg_id: int, request: CompleteQuestRequest, idempotency_key: Optional[str] = Header(None)):
+    """Complete a quest and award XP"""
+    start_time = perf_counter()
+    try:
+        complete = complete_quest_rpc if QUEST_COMPLETION_MODE == 'rpc' else complete_quest_legacy
+        return await complete_idempotently(
+            tg_id, idempotency_key, ('complete', request.quest_id),
+            lambda: complete(tg_id, request.quest_id)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error completing quest: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        duration = perf_counter() - start_time
+        logging.getLogger("lifequest").info(f"complete_quest {tg_id} {request.quest_id} {duration:.3f}")
+
+async def complete_quests(tg_id: int, requested_ids: List[str]) -> dict:
+    """Complete several quests at once: one insert, one XP pass, one bonus and goal check"""
+    user = await resolve_user(tg_id)
+    user_id = user['id']
+    branches = user['active_branches']
+    today = date.today().isoformat()
+    quest_ids = list(dict.fromkeys(requested_ids))
+
+    (completed_result, progress_result), (daily_quests, bonus_quest) = await asyncio.gather(
+        run_queries(
+            supabase.table('user_quests').select('quest_id').eq('user_id', user_id).eq('completion_date', today),
+            supabase.table('progress').select('current_level').eq('user_id', user_id)
+        ),
+        quest_catalog.quests_for(branches)
+    )
+    completed_ids = {row['quest_id'] for row in completed_result.data or []}
+    previous_level = progress_result.data[0]['current_level'] if progress_result.data else 1
+
+    results = {}
+    quests_to_complete = {}
+    for quest_id in quest_ids:
+        quest = await quest_catalog.get(quest_id)
+        if quest is None:
+            results[quest_id] = {"quest_id": quest_id, "status": "not_found", "xp_gained": 0}
+        elif quest_id in completed_ids:
+            results[quest_id] = {"quest_id": quest_id, "status": "already_completed", "xp_gained": 0}
+        else:
+            quests_to_complete[quest_id] = quest
+
+    # ignore_duplicates lets the unique constraint arbitrate concurrent taps;
+    # only rows actually inserted come back
+    inserted_ids = set()
+    if quests_to_complete:
+        insert_result = await run_query(supabase.table('user_quests').upsert([
+            {'user_id': user_id, 'quest_id': quest_id, 'completion_date': today, 'is_today': True}
+            for quest_id in quests_to_complete
+        ], on_conflict='user_id,quest_id,completion_date', ignore_duplicates=True))
+        inserted_ids = {row['quest_id'] for row in insert_result.data or []}
+    for quest_id, quest in quests_to_complete.items():
+        if quest_id in inserted_ids:
+            results[quest_id] = {"quest_id": quest_id, "status": "completed", "xp_gained": quest['xp_reward']}
+        else:
+            results[quest_id] = {"quest_id": quest_id, "status": "already_completed", "xp_gained": 0}
+    completed_ids |= inserted_ids
+
+    xp_gained = sum(quests_to_complete[quest_id]['xp_reward'] for quest_id in inserted_ids)
+    bonus_awarded = False
+    bonus_xp = 0
+    daily_quest_ids = [quest['id'] for quest in daily_quests]
+    if (
+        inserted_ids and bonus_quest and daily_quest_ids
+        and bonus_quest['id'] not in completed_ids
+        and all(quest_id in completed_ids for quest_id in daily_quest_ids)
+    ):
+        bonus_result = await run_query(supabase.table('user_quests').upsert({
+            'user_id': user_id,
+            'quest_id': bonus_quest['id'],
+            'completion_date': today,
+            'is_today': True
+        }, on_conflict='user_id,quest_id,completion_date', ignore_duplicates=True))
+        if bonus_result.data:
+            bonus_awarded = True
+            bonus_xp = bonus_quest.get('xp_reward', 0)
+
+    leveled_up = False
+    new_level = previous_level
+    levels_gained = 0
+    if xp_gained + bonus_xp:
+        xp_result = await run_query(supabase.rpc('add_xp_and_check_level', {
+            'p_user_id': user_id,
+            'p_xp_amount': xp_gained + bonus_xp
+        }))
+        level_up_data = xp_result.data[0] if xp_result.data else None
         leveled_up = level_up_data['leveled_up'] if level_up_data else False
-        new_level = level_up_data['new_level'] if level_up_data else 1
-        bonus_awarded = False
-        bonus_xp = 0
-        bonus_leveled_up = False
-        bonus_new_level = None
-        
-        # If leveled up, update stats
+        new_level = level_up_data['new_level'] if level_up_data else previous_level
+        levels_gained = level_up_data.get('levels_gained', 1) if level_up_data else 0
+
+    achieved_goals = []
+    if inserted_ids:
+        queries = [
+            supabase.table('goals').select('*').eq('user_id', user_id).eq('is_completed', False),
+            supabase.rpc('record_daily_completion', {
+                'p_user_id': user_id,
+                'p_date': today,
+                'p_quests': len(inserted_ids),
+                'p_xp': xp_gained + bonus_xp
+            })
+        ]
         if leveled_up:
-            branches = user['active_branches']
-            supabase.rpc('update_stats_on_levelup', {
+            queries.append(supabase.rpc('update_stats_on_levelup', {
                 'p_user_id': user_id,
-                'p_branches': branches
-            }).execute()
-            
-            # Trigger avatar regeneration every 5 levels
-            if new_level % 5 == 0:
-                n8n_webhook = os.environ.get('N8N_WEBHOOK_URL')
-                if n8n_webhook:
-                    try:
-                        user_full = supabase.table('users').select('*').eq('id', user_id).execute()
-                        user_data = user_full.data[0] if user_full.data else {}
-                        
-                        async with httpx.AsyncClient() as client:
-                            await client.post(n8n_webhook, json={
-                                'user_id': user_id,
-                                'tg_id': tg_id,
-                                'selfie_url': user_data.get('selfie_url'),
-                                'branch': branches[0] if branches else 'power',
-                                'gender': user_data.get('gender'),
-                                'age': user_data.get('age'),
-                                'level': new_level
-                            }, timeout=5.0)
-                    except Exception as e:
-                        logging.error(f"Error calling n8n webhook for avatar: {e}")
-
-        quest_branches = user['active_branches'] + ['global']
-        all_quests_result = supabase.table('quests').select('*').in_('branch', quest_branches).eq('is_daily', True).execute()
-        all_quests = all_quests_result.data or []
-        bonus_quest = next((quest for quest in all_quests if quest.get('title') == BONUS_DAILY_TITLE), None)
-        daily_quest_ids = [quest['id'] for quest in all_quests if quest.get('title') != BONUS_DAILY_TITLE]
-        completed_today_result = supabase.table('user_quests').select('quest_id').eq('user_id', user_id).eq('completion_date', today).execute()
-        completed_today = completed_today_result.data or []
-        completed_today_ids = {quest['quest_id'] for quest in completed_today}
-
-        if daily_quest_ids and all(quest_id in completed_today_ids for quest_id in daily_quest_ids) and bonus_quest:
-            bonus_xp = bonus_quest.get('xp_reward', 0)
-            bonus_quest_id = bonus_quest['id']
-            bonus_check = supabase.table('user_quests').select('id').eq('user_id', user_id).eq('quest_id', bonus_quest_id).eq('completion_date', today).execute()
-            if not bonus_check.data:
-                supabase.table('user_quests').insert({
-                    'user_id': user_id,
-                    'quest_id': bonus_quest_id,
-                    'completion_date': today,
-                    'is_today': True
-                }).execute()
-                bonus_result = supabase.rpc('add_xp_and_check_level', {
-                    'p_user_id': user_id,
-                    'p_xp_amount': bonus_xp
-                }).execute()
-                bonus_level_up_data = bonus_result.data[0] if bonus_result.data else None
-                bonus_leveled_up = bonus_level_up_data['leveled_up'] if bonus_level_up_data else False
-                bonus_new_level = bonus_level_up_data['new_level'] if bonus_level_up_data else None
-                bonus_awarded = True
-
-                if bonus_leveled_up:
-                    branches = user['active_branches']
-                    supabase.rpc('update_stats_on_levelup', {
-                        'p_user_id': user_id,
-                        'p_branches': branches
-                    }).execute()
-                    
-                    if bonus_new_level and bonus_new_level % 5 == 0:
-                        n8n_webhook = os.environ.get('N8N_WEBHOOK_URL')
-                        if n8n_webhook:
-                            try:
-                                user_full = supabase.table('users').select('*').eq('id', user_id).execute()
-                                user_data = user_full.data[0] if user_full.data else {}
-                                
-                                async with httpx.AsyncClient() as client:
-                                    await client.post(n8n_webhook, json={
-                                        'user_id': user_id,
-                                        'tg_id': tg_id,
-                                        'selfie_url': user_data.get('selfie_url'),
-                                        'branch': branches[0] if branches else 'power',
-                                        'gender': user_data.get('gender'),
-                                        'age': user_data.get('age'),
-                                        'level': bonus_new_level
-                                    }, timeout=5.0)
-                            except Exception as e:
-                                logging.error(f"Error calling n8n webhook for avatar: {e}")
-        
-        effective_level = max(new_level, bonus_new_level or new_level)
-        goals_result = supabase.table('goals').select('*').eq('user_id', user_id).eq('is_completed', False).execute()
-        goals_data = goals_result.data or []
+                'p_branches': branches,
+                'p_levels': levels_gained
+            }))
+        goals_result = (await run_queries(*queries))[0]
         achieved_goals = [
-            goal for goal in goals_data
-            if (goal.get('goal_level') or 1) <= effective_level and goal.get('notified_at') is None
+            goal for goal in goals_result.data or []
+            if (goal.get('goal_level') or 1) <= new_level
+            and goal.get('notified_at') is None and goal.get('notify_claimed_at') is None
         ]
+        notify_achieved_goals(tg_id, achieved_goals, new_level)
 
-        for goal in achieved_goals:
-            try:
-                await send_goal_achieved_notification(tg_id, goal.get('goal_text') or 'Цель', effective_level)
-                supabase.table('goals').update({
-                    'notified_at': datetime.utcnow().isoformat()
-                }).eq('id', goal['id']).execute()
-            except Exception as e:
-                logging.error(f"Error sending goal achieved notification: {e}")
+    if leveled_up:
+        milestone = milestone_level(previous_level, new_level)
+        if milestone and os.environ.get('N8N_WEBHOOK_URL'):
+            user_full = await run_query(supabase.table('users').select('*').eq('id', user_id))
+            user_data = user_full.data[0] if user_full.data else {}
+            await trigger_avatar_regeneration(user_id, tg_id, user_data, branches, milestone)
 
-        return {
-            "success": True,
-            "xp_gained": xp_reward,
-            "leveled_up": leveled_up,
-            "new_level": new_level,
-            "bonus_awarded": bonus_awarded,
-            "bonus_xp": bonus_xp,
-            "bonus_leveled_up": bonus_leveled_up,
-            "bonus_new_level": bonus_new_level,
-            "achieved_goals": achieved_goals
-        }
-        
+    return {
+        "success": True,
+        "results": [results[quest_id] for quest_id in quest_ids],
+        "xp_gained": xp_gained,
+        "leveled_up": leveled_up,
+        "new_level": new_level,
+        "bonus_awarded": bonus_awarded,
+        "bonus_xp": bonus_xp,
+        "achieved_goals": achieved_goals
+    }
+
+@api_router.post("/users/{tg_id}/quests/complete-batch")
+async def complete_quests_batch(tg_id: int, request: CompleteQuestsBatchRequest, idempotency_key: Optional[str] = Header(None)):
+    """Complete several quests in one request, with a result per quest"""
+    start_time = perf_counter()
+    try:
+        return await complete_idempotently(
+            tg_id, idempotency_key, ('complete-batch',) + tuple(request.quest_ids),
+            lambda: complete_quests(tg_id, request.quest_ids)
+        )
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error completing quest: {e}")
+        logging.error(f"Error completing quests batch: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         duration = perf_counter() - start_time
-        logging.getLogger("lifequest").info(f"complete_quest {tg_id} {request.quest_id} {duration:.3f}")
+        logging.getLogger("lifequest").info(f"complete_quests_batch {tg_id} {len(request.quest_ids)} {duration:.3f}")
+
+@api_router.post("/telegram/webhook")
+async def receive_telegram_update(request: Request, x_telegram_bot_api_secret_token: Optional[str] = Header(None)):
+    """Bot updates pushed by Telegram (BOT_MODE=webhook); handled after the reply"""
+    if not telegram_webhook.enabled:
+        raise HTTPException(status_code=404, detail="Bot webhook is not enabled")
+    if not telegram_webhook.verify(x_telegram_bot_api_secret_token):
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    try:
+        await telegram_webhook.feed(await request.json())
+    except Exception as e:
+        # Telegram redelivers on errors; a malformed update would be retried forever
+        logging.error(f"Error queueing Telegram update: {e}")
+    return {"ok": True}
 
 @api_router.post("/webhooks/avatar-generated")
-async def avatar_generated_webhook(data: dict):
-    """Webhook to receive generated avatar from n8n"""
+async def avatar_generated_webhook(data: dict, x_webhook_secret: Optional[str] = Header(None)):
+    """Webhook to receive generated avatar from n8n; retries for a level already recorded are no-ops"""
     try:
-        # Логируем полученные данные
-        logging.info(f"Avatar webhook received data: {data}")
+        if not AVATAR_WEBHOOK_SECRET or not x_webhook_secret or not hmac.compare_digest(
+            x_webhook_secret.encode(), AVATAR_WEBHOOK_SECRET.encode()
+        ):
+            raise HTTPException(status_code=403, detail="Invalid webhook secret")
         
         user_id = data.get('user_id')
         avatar_url = data.get('avatar_url')
         
         if not user_id or not avatar_url:
-            logging.error(f"Missing fields - user_id: {user_id}, avatar_url: {avatar_url}")
+            logging.error(f"Missing fields in avatar webhook - user_id: {user_id}, avatar_url: {bool(avatar_url)}")
             raise HTTPException(status_code=400, detail="Missing required fields")
+        if not is_allowed_source(avatar_url):
+            logging.error(f"Avatar webhook for user {user_id} has an untrusted avatar_url host")
+            raise HTTPException(status_code=400, detail="avatar_url host is not allowed")
         
-        # Update user avatar
-        supabase.table('users').update({
-            'avatar_url': avatar_url,
-            'updated_at': datetime.utcnow().isoformat()
-        }).eq('id', user_id).execute()
+        # Avatar, generation log and dedupe in one transaction
+        result = await run_query(supabase.rpc('ingest_avatar', {
+            'p_user_id': user_id,
+            'p_avatar_url': avatar_url,
+            'p_level': data.get('level'),
+            'p_generation_id': data.get('generation_id')
+        }))
+        outcome = result.data or {}
+        status = outcome.get('status')
+        if status == 'user_not_found':
+            raise HTTPException(status_code=404, detail="User not found")
+        if status == 'duplicate':
+            logging.info(f"Duplicate avatar webhook for user {user_id} level {outcome.get('level')}")
+            return {"success": True, "message": "Avatar already recorded"}
         
-        # Log avatar generation
-        supabase.table('avatar_generations').insert({
+        bump_revision(outcome['tg_id'])
+        await job_queue.enqueue('avatar_variants', {
             'user_id': user_id,
-            'level': data.get('level', 1),
-            'avatar_url': avatar_url,
-            'generation_status': 'completed'
-        }).execute()
+            'level': outcome['level'],
+            'source_url': avatar_url
+        }, dedupe_key=f"avatar_variants:{outcome['generation_id']}")
         
-        logging.info(f"Avatar updated for user {user_id}: {avatar_url}")
+        logging.info(f"Avatar updated for user {user_id} level {outcome['level']}")
         return {"success": True, "message": "Avatar updated"}
         
     except HTTPException:
@@ -801,10 +1449,12 @@ async def activate_pro(tg_id: int):
     try:
         # In production, this would be called by Telegram payment webhook
         # For now, simple activation
-        supabase.table('users').update({
+        await run_query(supabase.table('users').update({
             'is_pro': True,
             'updated_at': datetime.utcnow().isoformat()
-        }).eq('tg_id', tg_id).execute()
+        }).eq('tg_id', tg_id))
+        user_identity_cache.pop(tg_id)
+        bump_revision(tg_id)
         
         return {"success": True, "message": "PRO activated"}
         
@@ -817,7 +1467,7 @@ async def add_branch(tg_id: int, branch: str):
     """Add a branch to user's active branches (PRO feature)"""
     try:
         # Get user
-        result = supabase.table('users').select('*').eq('tg_id', tg_id).execute()
+        result = await run_query(supabase.table('users').select('*').eq('tg_id', tg_id))
         if not result.data:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -830,10 +1480,12 @@ async def add_branch(tg_id: int, branch: str):
         branches = user.get('active_branches', [])
         if branch not in branches:
             branches.append(branch)
-            supabase.table('users').update({
+            await run_query(supabase.table('users').update({
                 'active_branches': branches,
                 'updated_at': datetime.utcnow().isoformat()
-            }).eq('tg_id', tg_id).execute()
+            }).eq('tg_id', tg_id))
+            user_identity_cache.pop(tg_id)
+            bump_revision(tg_id)
         
         return {"success": True, "active_branches": branches}
         
@@ -843,14 +1495,25 @@ async def add_branch(tg_id: int, branch: str):
         logging.error(f"Error adding branch: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+goal_dispatcher = GoalNotificationDispatcher(
+    supabase, deliver_goal_notification, on_failure=retry_goal_notification, on_written=bump_revision
+)
+
+job_queue.register('avatar_generation', run_avatar_generation_job, on_dead=fail_avatar_generation)
+job_queue.register('avatar_variants', run_avatar_variants_job)
+job_queue.register('goal_notification', run_goal_notification_job)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 logger = logging.getLogger("lifequest")
@@ -0,0 +1,55 @@
+"""Completion streaks and history from the daily rollups
+
+``user_streaks`` stores the current and best streak with the last day that
+had a completion. Recording a day only looks at that row, and the streak
+shown today is derived from it without reading any history: it is still
+alive while the last active day is today or yesterday. Mirrors
+``record_daily_completion`` in supabase_schema.sql.
+"""
+from datetime import date, timedelta
+from typing import Iterable, List, NamedTuple, Optional
+
+
+class Streak(NamedTuple):
+    current: int = 0
+    best: int = 0
+    last_date: Optional[date] = None
+
+
+def advance(streak: Streak, day: date) -> Streak:
+    """Streak after a completion on ``day``"""
+    if streak.last_date is not None and day <= streak.last_date:
+        # Another completion the same day, or a late write for an earlier day
+        return streak
+    if streak.last_date is not None and day - streak.last_date == timedelta(days=1):
+        current = streak.current + 1
+    else:
+        current = 1
+    return Streak(current, max(streak.best, current), day)
+
+
+def current_streak(streak: Streak, today: date) -> int:
+    """Streak as of ``today``: a missed yesterday breaks it, an empty today does not yet"""
+    if streak.last_date is None or today - streak.last_date > timedelta(days=1):
+        return 0
+    return streak.current
+
+
+def streak_from_days(days: Iterable[date]) -> Streak:
+    """Replay active days from scratch (backfills and tests)"""
+    streak = Streak()
+    for day in sorted(set(days)):
+        streak = advance(streak, day)
+    return streak
+
+
+def daily_history(rows: Iterable[dict], since: date, today: date) -> List[dict]:
+    """One entry per day from ``since`` to ``today``, zero-filled where the rollup has no row"""
+    by_date = {str(row['stat_date']): row for row in rows}
+    history = []
+    day = since
+    while day <= today:
+        row = by_date.get(day.isoformat(), {})
+        history.append({'date': day.isoformat(), 'quest_count': row.get('quest_count', 0), 'xp': row.get('xp', 0)})
+        day += timedelta(days=1)
+    return history
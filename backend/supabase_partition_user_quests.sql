@@ -0,0 +1,54 @@
+-- One-off migration of an existing, unpartitioned user_quests to the monthly
+-- range-partitioned layout of supabase_schema.sql.
+-- Run supabase_schema.sql first (it creates ensure_user_quests_partitions and
+-- skips the partition setup while the old table is in place), then this file.
+-- Policies from supabase_fix_rls.sql go with the old table; re-apply them if used.
+-- The copy holds an exclusive lock on user_quests; run it in a quiet window.
+
+BEGIN;
+
+LOCK TABLE user_quests IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE user_quests RENAME TO user_quests_unpartitioned;
+ALTER TABLE user_quests_unpartitioned RENAME CONSTRAINT user_quests_pkey TO user_quests_unpartitioned_pkey;
+ALTER TABLE user_quests_unpartitioned
+    RENAME CONSTRAINT user_quests_user_id_quest_id_completion_date_key TO user_quests_unpartitioned_user_quest_date_key;
+DROP INDEX IF EXISTS idx_user_quests_user_date;
+DROP INDEX IF EXISTS idx_user_quests_user_id;
+DROP INDEX IF EXISTS idx_user_quests_date;
+
+CREATE TABLE user_quests (
+    id UUID DEFAULT uuid_generate_v4(),
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    quest_id UUID REFERENCES quests(id) ON DELETE CASCADE,
+    completed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    completion_date DATE NOT NULL DEFAULT CURRENT_DATE,
+    is_today BOOLEAN DEFAULT TRUE,
+    PRIMARY KEY (id, completion_date),
+    UNIQUE(user_id, quest_id, completion_date)
+) PARTITION BY RANGE (completion_date);
+
+CREATE INDEX idx_user_quests_user_date ON user_quests(user_id, completion_date) INCLUDE (quest_id);
+
+-- One partition for every month that has completions, plus the next two
+SELECT ensure_user_quests_partitions(
+    COALESCE((SELECT MIN(completion_date) FROM user_quests_unpartitioned), CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '2 months')::DATE
+);
+
+INSERT INTO user_quests (id, user_id, quest_id, completed_at, completion_date, is_today)
+SELECT id, user_id, quest_id, completed_at, COALESCE(completion_date, completed_at::DATE, CURRENT_DATE), is_today
+FROM user_quests_unpartitioned;
+
+DROP TABLE user_quests_unpartitioned;
+
+-- Created after the copy so it does not bump every user's revision once per row
+CREATE TRIGGER user_quests_bump_revision
+    AFTER INSERT OR UPDATE OR DELETE ON user_quests
+    FOR EACH ROW EXECUTE FUNCTION bump_user_revision();
+
+ALTER TABLE user_quests ENABLE ROW LEVEL SECURITY;
+
+COMMIT;
+
+ANALYZE user_quests;
@@ -18,6 +18,9 @@ CREATE TABLE IF NOT EXISTS users (
     gender TEXT,
     avatar_url TEXT,
     selfie_url TEXT,
+    -- Resized AVIF/WebP copies of avatar_url and its blurhash placeholder
+    avatar_variants JSONB,
+    avatar_blurhash TEXT,
     
     -- Active branches (free: 1, PRO: multiple)
     active_branches TEXT[] DEFAULT ARRAY['power'],
@@ -35,9 +38,18 @@ CREATE TABLE IF NOT EXISTS users (
     -- Timestamps
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    last_active_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    last_active_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    
+    -- Bumped by triggers on any change to the user, progress, quests or goals (ETags)
+    revision BIGINT NOT NULL DEFAULT 0
 );
 
+-- For databases created before revision existed
+ALTER TABLE users ADD COLUMN IF NOT EXISTS revision BIGINT NOT NULL DEFAULT 0;
+-- ...and before avatar variants existed
+ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_variants JSONB;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_blurhash TEXT;
+
 -- Progress table
 CREATE TABLE IF NOT EXISTS progress (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -69,12 +81,18 @@ CREATE TABLE IF NOT EXISTS goals (
     is_completed BOOLEAN DEFAULT FALSE,
     completed_at TIMESTAMP WITH TIME ZONE,
     notified_at TIMESTAMP WITH TIME ZONE,
+    notify_claimed_at TIMESTAMP WITH TIME ZONE, -- a retry job owns the notification
+    archived_at TIMESTAMP WITH TIME ZONE, -- archived goals are also is_completed
     notes TEXT,
     image_url TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- For databases created before archived_at existed
+ALTER TABLE goals ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE goals ADD COLUMN IF NOT EXISTS notify_claimed_at TIMESTAMP WITH TIME ZONE;
+
 -- Quests table (templates)
 CREATE TABLE IF NOT EXISTS quests (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -92,18 +110,42 @@ CREATE TABLE IF NOT EXISTS quests (
 );
 
 -- User quest completions
+-- Range-partitioned by month on completion_date, so the today-lookup reads one
+-- small partition and maintain_user_quests drops whole old months. Every unique
+-- constraint must contain the partition key, hence (id, completion_date).
+-- Databases created before partitioning: run supabase_partition_user_quests.sql
 CREATE TABLE IF NOT EXISTS user_quests (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID DEFAULT uuid_generate_v4(),
     user_id UUID REFERENCES users(id) ON DELETE CASCADE,
     quest_id UUID REFERENCES quests(id) ON DELETE CASCADE,
     
     completed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    completion_date DATE DEFAULT CURRENT_DATE,
+    completion_date DATE NOT NULL DEFAULT CURRENT_DATE,
     
     -- For tracking streaks
     is_today BOOLEAN DEFAULT TRUE,
     
+    PRIMARY KEY (id, completion_date),
     UNIQUE(user_id, quest_id, completion_date)
+) PARTITION BY RANGE (completion_date);
+
+-- Per-day rollup of completions, maintained by record_daily_completion so
+-- history and averages never scan user_quests. quest_count excludes the daily
+-- bonus, xp includes it
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    stat_date DATE NOT NULL,
+    quest_count INTEGER NOT NULL DEFAULT 0,
+    xp INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, stat_date)
+);
+
+-- Current and best streak of consecutive active days (see backend/streaks.py)
+CREATE TABLE IF NOT EXISTS user_streaks (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    last_completion_date DATE
 );
 
 -- Payment transactions
@@ -129,21 +171,64 @@ CREATE TABLE IF NOT EXISTS avatar_generations (
     level INTEGER,
     prompt TEXT,
     avatar_url TEXT,
-    generation_status TEXT DEFAULT 'pending', -- 'pending', 'completed', 'failed'
+    generation_status TEXT DEFAULT 'pending', -- 'pending', 'processing', 'completed', 'failed'
     
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Broadcast progress checkpoints (daily reminders), one row per run
+CREATE TABLE IF NOT EXISTS broadcast_runs (
+    id TEXT PRIMARY KEY, -- e.g. 'daily_reminders:2026-01-31'
+    status TEXT DEFAULT 'running', -- 'running', 'completed', 'aborted' (fatal send error)
+    last_tg_id BIGINT, -- keyset cursor: recipients up to this tg_id are done
+    sent INTEGER DEFAULT 0,
+    blocked INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    rate_limited INTEGER DEFAULT 0,
+    pages INTEGER DEFAULT 0,
+    
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Outbound jobs (n8n avatar generation, Telegram notifications)
+CREATE TABLE IF NOT EXISTS outbound_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    kind TEXT NOT NULL, -- 'avatar_generation', 'avatar_variants', 'goal_notification'
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    dedupe_key TEXT UNIQUE,
+    
+    status TEXT DEFAULT 'pending', -- 'pending', 'running', 'completed', 'dead'
+    attempts INTEGER DEFAULT 0,
+    max_attempts INTEGER DEFAULT 6,
+    run_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    locked_at TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- Create indexes for performance
 CREATE INDEX IF NOT EXISTS idx_users_tg_id ON users(tg_id);
 CREATE INDEX IF NOT EXISTS idx_progress_user_id ON progress(user_id);
-CREATE INDEX IF NOT EXISTS idx_user_quests_user_id ON user_quests(user_id);
-CREATE INDEX IF NOT EXISTS idx_user_quests_date ON user_quests(completion_date);
+-- Today's completions of a user as an index-only scan; the user_id prefix also
+-- serves per-user deletes, so the old single-column indexes are gone
+CREATE INDEX IF NOT EXISTS idx_user_quests_user_date ON user_quests(user_id, completion_date) INCLUDE (quest_id);
+DROP INDEX IF EXISTS idx_user_quests_user_id;
+DROP INDEX IF EXISTS idx_user_quests_date;
 CREATE INDEX IF NOT EXISTS idx_goals_user_id ON goals(user_id);
+-- Keyset pages of a user's goals by status, newest first
+CREATE INDEX IF NOT EXISTS idx_goals_user_status_created ON goals(user_id, is_completed, created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id);
-CREATE INDEX IF NOT EXISTS idx_avatar_generations_user_id ON avatar_generations(user_id);
+-- (user_id, level) is the dedupe key of avatar webhooks; it also serves lookups by user_id
+DROP INDEX IF EXISTS idx_avatar_generations_user_id;
+CREATE INDEX IF NOT EXISTS idx_avatar_generations_user_level ON avatar_generations(user_id, level);
+CREATE INDEX IF NOT EXISTS idx_outbound_jobs_due ON outbound_jobs(status, run_at);
 
 -- Create analytics view for DAU
+-- last_active_at is written in batches by the backend (touch_last_active), so it
+-- may lag real activity by up to ACTIVITY_FLUSH_INTERVAL_SECONDS
 CREATE OR REPLACE VIEW analytics_dau AS
 SELECT 
     DATE(last_active_at) as date,
@@ -153,93 +238,606 @@ WHERE last_active_at >= NOW() - INTERVAL '30 days'
 GROUP BY DATE(last_active_at)
 ORDER BY date DESC;
 
+-- Function to record buffered activity heartbeats in one statement
+CREATE OR REPLACE FUNCTION touch_last_active(
+    p_tg_ids BIGINT[],
+    p_seen_at TIMESTAMP WITH TIME ZONE[]
+) RETURNS INTEGER AS $$
+    WITH updated AS (
+        UPDATE users u
+        SET last_active_at = GREATEST(u.last_active_at, s.seen_at)
+        FROM unnest(p_tg_ids, p_seen_at) AS s(tg_id, seen_at)
+        WHERE u.tg_id = s.tg_id
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$ LANGUAGE sql;
+
+-- Function to claim due outbound jobs for a backend worker
+-- Running jobs whose lease expired (worker died mid-run) are claimed again
+CREATE OR REPLACE FUNCTION claim_outbound_jobs(
+    p_limit INTEGER DEFAULT 10,
+    p_lease_seconds INTEGER DEFAULT 300
+) RETURNS SETOF outbound_jobs AS $$
+    UPDATE outbound_jobs j
+    SET
+        status = 'running',
+        attempts = j.attempts + 1,
+        locked_at = NOW(),
+        updated_at = NOW()
+    WHERE j.id IN (
+        SELECT id
+        FROM outbound_jobs
+        WHERE (status = 'pending' AND run_at <= NOW())
+            OR (status = 'running' AND locked_at < NOW() - make_interval(secs => p_lease_seconds))
+        ORDER BY run_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING j.*;
+$$ LANGUAGE sql;
+
+-- Level curve: leveling from L to L + 1 costs FLOOR(100 * 1.05^(L-1)) XP.
+-- cumulative_xp is the lifetime XP needed to reach a level, so the level for
+-- any total_xp is one index lookup. Mirrors backend/leveling.py.
+CREATE TABLE IF NOT EXISTS level_thresholds (
+    level INTEGER PRIMARY KEY,
+    xp_required INTEGER NOT NULL,
+    cumulative_xp BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_level_thresholds_cumulative ON level_thresholds(cumulative_xp);
+
+INSERT INTO level_thresholds (level, xp_required, cumulative_xp)
+SELECT level, xp_required, SUM(xp_required) OVER (ORDER BY level) - xp_required
+FROM (
+    SELECT level, FLOOR(100 * POWER(1.05::NUMERIC, level - 1))::INTEGER AS xp_required
+    FROM generate_series(1, 300) AS level
+) curve
+ON CONFLICT (level) DO NOTHING;
+
 -- Function to add XP and check for level up
+-- total_xp is the source of truth; the level is looked up from level_thresholds
+-- (the return type changed, so the old definition has to be dropped first)
+DROP FUNCTION IF EXISTS add_xp_and_check_level(UUID, INTEGER);
 CREATE OR REPLACE FUNCTION add_xp_and_check_level(
     p_user_id UUID,
     p_xp_amount INTEGER
 ) RETURNS TABLE (
     leveled_up BOOLEAN,
     new_level INTEGER,
-    new_xp INTEGER
+    new_xp INTEGER,
+    levels_gained INTEGER
 ) AS $$
 DECLARE
-    v_current_xp INTEGER;
-    v_current_level INTEGER;
+    v_previous_level INTEGER;
+    v_total_xp BIGINT;
+    v_level INTEGER;
+    v_cumulative_xp BIGINT;
     v_next_level_xp INTEGER;
-    v_leveled_up BOOLEAN := FALSE;
 BEGIN
-    -- Get current progress
-    SELECT current_xp, current_level, next_level_xp
-    INTO v_current_xp, v_current_level, v_next_level_xp
+    SELECT current_level, total_xp + p_xp_amount
+    INTO v_previous_level, v_total_xp
     FROM progress
-    WHERE user_id = p_user_id;
+    WHERE user_id = p_user_id
+    FOR UPDATE;
     
-    -- Add XP
-    v_current_xp := v_current_xp + p_xp_amount;
-    
-    -- Check for level up
-    WHILE v_current_xp >= v_next_level_xp LOOP
-        v_current_xp := v_current_xp - v_next_level_xp;
-        v_current_level := v_current_level + 1;
-        v_next_level_xp := FLOOR(100 * POWER(1.05, v_current_level - 1));
-        v_leveled_up := TRUE;
-    END LOOP;
+    SELECT level, cumulative_xp, xp_required
+    INTO v_level, v_cumulative_xp, v_next_level_xp
+    FROM level_thresholds
+    WHERE cumulative_xp <= v_total_xp
+    ORDER BY cumulative_xp DESC
+    LIMIT 1;
     
-    -- Update progress
     UPDATE progress
     SET 
-        current_xp = v_current_xp,
-        current_level = v_current_level,
+        current_xp = v_total_xp - v_cumulative_xp,
+        current_level = v_level,
         next_level_xp = v_next_level_xp,
-        total_xp = total_xp + p_xp_amount,
+        total_xp = v_total_xp,
         updated_at = NOW()
     WHERE user_id = p_user_id;
     
-    RETURN QUERY SELECT v_leveled_up, v_current_level, v_current_xp;
+    RETURN QUERY SELECT
+        v_level > v_previous_level,
+        v_level,
+        (v_total_xp - v_cumulative_xp)::INTEGER,
+        GREATEST(v_level - v_previous_level, 0);
 END;
 $$ LANGUAGE plpgsql;
 
+-- Per-level stat bonus of each branch, on top of the base +1 to every stat
+CREATE TABLE IF NOT EXISTS branch_stat_bonuses (
+    branch TEXT PRIMARY KEY,
+    strength INTEGER NOT NULL DEFAULT 0,
+    health INTEGER NOT NULL DEFAULT 0,
+    intellect INTEGER NOT NULL DEFAULT 0,
+    agility INTEGER NOT NULL DEFAULT 0,
+    confidence INTEGER NOT NULL DEFAULT 0,
+    stability INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO branch_stat_bonuses (branch, strength, health, intellect, agility, confidence, stability) VALUES
+('power', 2, 0, 0, 0, 1, 0),
+('stability', 0, 0, 1, 0, 0, 2),
+('longevity', 0, 2, 0, 1, 0, 0)
+ON CONFLICT (branch) DO NOTHING;
+
 -- Function to update stats on level up
+-- Applies p_levels level-ups for all branches in one UPDATE
+DROP FUNCTION IF EXISTS update_stats_on_levelup(UUID, TEXT[]);
 CREATE OR REPLACE FUNCTION update_stats_on_levelup(
     p_user_id UUID,
-    p_branches TEXT[]
+    p_branches TEXT[],
+    p_levels INTEGER DEFAULT 1
 ) RETURNS VOID AS $$
-DECLARE
-    v_branch TEXT;
-BEGIN
-    -- Base +1 to all stats
-    UPDATE users
+    UPDATE users u
     SET
-        strength = strength + 1,
-        health = health + 1,
-        intellect = intellect + 1,
-        agility = agility + 1,
-        confidence = confidence + 1,
-        stability = stability + 1,
+        strength = u.strength + p_levels * (1 + b.strength),
+        health = u.health + p_levels * (1 + b.health),
+        intellect = u.intellect + p_levels * (1 + b.intellect),
+        agility = u.agility + p_levels * (1 + b.agility),
+        confidence = u.confidence + p_levels * (1 + b.confidence),
+        stability = u.stability + p_levels * (1 + b.stability),
         updated_at = NOW()
-    WHERE id = p_user_id;
-    
-    -- Branch bonuses
-    FOREACH v_branch IN ARRAY p_branches
+    FROM (
+        SELECT
+            COALESCE(SUM(strength), 0) AS strength,
+            COALESCE(SUM(health), 0) AS health,
+            COALESCE(SUM(intellect), 0) AS intellect,
+            COALESCE(SUM(agility), 0) AS agility,
+            COALESCE(SUM(confidence), 0) AS confidence,
+            COALESCE(SUM(stability), 0) AS stability
+        FROM branch_stat_bonuses
+        WHERE branch = ANY(p_branches)
+    ) b
+    WHERE u.id = p_user_id AND p_levels > 0;
+$$ LANGUAGE sql;
+
+-- Function to roll completions up into the day's totals and advance the streak
+-- A day right after the last active one extends the streak, a later one
+-- restarts it; repeated or late writes for earlier days leave it as it is
+CREATE OR REPLACE FUNCTION record_daily_completion(
+    p_user_id UUID,
+    p_date DATE,
+    p_quests INTEGER,
+    p_xp INTEGER
+) RETURNS VOID AS $$
+    INSERT INTO user_daily_stats (user_id, stat_date, quest_count, xp)
+    VALUES (p_user_id, p_date, p_quests, p_xp)
+    ON CONFLICT (user_id, stat_date) DO UPDATE
+    SET quest_count = user_daily_stats.quest_count + EXCLUDED.quest_count,
+        xp = user_daily_stats.xp + EXCLUDED.xp;
+
+    INSERT INTO user_streaks (user_id, current_streak, best_streak, last_completion_date)
+    VALUES (p_user_id, 1, 1, p_date)
+    ON CONFLICT (user_id) DO UPDATE
+    SET current_streak = CASE
+            WHEN p_date <= user_streaks.last_completion_date THEN user_streaks.current_streak
+            WHEN p_date = user_streaks.last_completion_date + 1 THEN user_streaks.current_streak + 1
+            ELSE 1
+        END,
+        best_streak = GREATEST(user_streaks.best_streak, CASE
+            WHEN p_date <= user_streaks.last_completion_date THEN user_streaks.current_streak
+            WHEN p_date = user_streaks.last_completion_date + 1 THEN user_streaks.current_streak + 1
+            ELSE 1
+        END),
+        last_completion_date = GREATEST(user_streaks.last_completion_date, p_date);
+$$ LANGUAGE sql;
+
+-- Backfill rollups and streaks from completions recorded before they existed
+-- (a no-op for days and users that already have them)
+INSERT INTO user_daily_stats (user_id, stat_date, quest_count, xp)
+SELECT
+    uq.user_id,
+    uq.completion_date,
+    COUNT(*) FILTER (WHERE q.title <> '⭐ Выполни все daily квесты'),
+    COALESCE(SUM(q.xp_reward), 0)
+FROM user_quests uq
+JOIN quests q ON q.id = uq.quest_id
+GROUP BY uq.user_id, uq.completion_date
+ON CONFLICT (user_id, stat_date) DO NOTHING;
+
+INSERT INTO user_streaks (user_id, current_streak, best_streak, last_completion_date)
+SELECT user_id, (ARRAY_AGG(days ORDER BY last_day DESC))[1], MAX(days), MAX(last_day)
+FROM (
+    -- Consecutive dates share stat_date - row_number, one group per run
+    SELECT user_id, COUNT(*) AS days, MAX(stat_date) AS last_day
+    FROM (
+        SELECT user_id, stat_date, stat_date - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY stat_date)::INTEGER AS run
+        FROM user_daily_stats
+    ) dated
+    GROUP BY user_id, run
+) runs
+GROUP BY user_id
+ON CONFLICT (user_id) DO NOTHING;
+
+-- Function to create the monthly user_quests partitions from p_from to p_to
+-- The default partition catches dates no month covers yet; its rows are moved
+-- into a month when that month is created.
+-- Insert-only partitions are vacuumed early so the visibility map stays current
+-- and the today-lookup stays index-only
+CREATE OR REPLACE FUNCTION ensure_user_quests_partitions(
+    p_from DATE,
+    p_to DATE
+) RETURNS TEXT[] AS $$
+DECLARE
+    v_month DATE;
+    v_name TEXT;
+    v_created TEXT[] := ARRAY[]::TEXT[];
+BEGIN
+    CREATE TABLE IF NOT EXISTS user_quests_default PARTITION OF user_quests DEFAULT;
+
+    FOR v_month IN
+        SELECT generate_series(date_trunc('month', p_from), date_trunc('month', p_to), INTERVAL '1 month')::DATE
+    LOOP
+        v_name := 'user_quests_' || to_char(v_month, 'YYYY_MM');
+        CONTINUE WHEN to_regclass(v_name) IS NOT NULL;
+
+        EXECUTE format('CREATE TABLE %I (LIKE user_quests INCLUDING DEFAULTS)', v_name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM user_quests_default WHERE completion_date >= %L AND completion_date < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            v_month, (v_month + INTERVAL '1 month')::DATE, v_name
+        );
+        EXECUTE format(
+            'ALTER TABLE user_quests ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            v_name, v_month, (v_month + INTERVAL '1 month')::DATE
+        );
+        EXECUTE format(
+            'ALTER TABLE %I SET (autovacuum_vacuum_insert_scale_factor = 0.01, autovacuum_vacuum_insert_threshold = 10000)',
+            v_name
+        );
+        v_created := v_created || v_name;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to keep user_quests partitioned and bounded, run by the backend's
+-- retention job: creates the current and the next p_months_ahead months, and
+-- folds months older than p_keep_months into user_daily_stats before dropping
+-- them. Only one caller does the work at a time
+CREATE OR REPLACE FUNCTION maintain_user_quests(
+    p_keep_months INTEGER DEFAULT 3,
+    p_months_ahead INTEGER DEFAULT 2,
+    p_bonus_title TEXT DEFAULT '⭐ Выполни все daily квесты'
+) RETURNS JSONB AS $$
+DECLARE
+    v_cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => p_keep_months))::DATE;
+    v_created TEXT[];
+    v_archived TEXT[] := ARRAY[]::TEXT[];
+    v_partition RECORD;
+    v_rollup TEXT := 'INSERT INTO user_daily_stats (user_id, stat_date, quest_count, xp) '
+        'SELECT uq.user_id, uq.completion_date, COUNT(*) FILTER (WHERE q.title IS DISTINCT FROM %L), COALESCE(SUM(q.xp_reward), 0) '
+        'FROM %I uq LEFT JOIN quests q ON q.id = uq.quest_id %s '
+        'GROUP BY uq.user_id, uq.completion_date '
+        'ON CONFLICT (user_id, stat_date) DO NOTHING';
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('maintain_user_quests')) THEN
+        RETURN jsonb_build_object('skipped', TRUE);
+    END IF;
+
+    v_created := ensure_user_quests_partitions(
+        CURRENT_DATE, (CURRENT_DATE + make_interval(months => p_months_ahead))::DATE
+    );
+
+    -- Rollups are written live by record_daily_completion; this only fills days
+    -- that predate it, so nothing is counted twice
+    FOR v_partition IN
+        SELECT c.relname AS name, to_date(right(c.relname, 7), 'YYYY_MM') AS month
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'user_quests'::REGCLASS AND c.relname ~ '^user_quests_[0-9]{4}_[0-9]{2}$'
+        ORDER BY month
     LOOP
-        CASE v_branch
-            WHEN 'power' THEN
-                UPDATE users
-                SET strength = strength + 2, confidence = confidence + 1
-                WHERE id = p_user_id;
-            WHEN 'stability' THEN
-                UPDATE users
-                SET stability = stability + 2, intellect = intellect + 1
-                WHERE id = p_user_id;
-            WHEN 'longevity' THEN
-                UPDATE users
-                SET health = health + 2, agility = agility + 1
-                WHERE id = p_user_id;
-        END CASE;
+        EXIT WHEN v_partition.month >= v_cutoff;
+        EXECUTE format(v_rollup, p_bonus_title, v_partition.name, '');
+        EXECUTE format('ALTER TABLE user_quests DETACH PARTITION %I', v_partition.name);
+        EXECUTE format('DROP TABLE %I', v_partition.name);
+        v_archived := v_archived || v_partition.name;
     END LOOP;
+
+    EXECUTE format(v_rollup, p_bonus_title, 'user_quests_default', format('WHERE uq.completion_date < %L', v_cutoff));
+    DELETE FROM user_quests_default WHERE completion_date < v_cutoff;
+
+    RETURN jsonb_build_object('created', to_jsonb(v_created), 'archived', to_jsonb(v_archived), 'cutoff', v_cutoff);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Skipped while an older, unpartitioned user_quests has not been migrated yet
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'user_quests'::REGCLASS) = 'p' THEN
+        PERFORM ensure_user_quests_partitions(CURRENT_DATE, (CURRENT_DATE + INTERVAL '2 months')::DATE);
+    END IF;
+END $$;
+
+-- Function to read what the bot's /stats shows in one joined statement
+-- NULL for an unknown tg_id; the current streak is 0 once a day was missed
+CREATE OR REPLACE FUNCTION get_user_stats(p_tg_id BIGINT)
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'first_name', u.first_name,
+        'active_branches', to_jsonb(COALESCE(u.active_branches, ARRAY['power'])),
+        'is_pro', COALESCE(u.is_pro, FALSE),
+        'strength', u.strength,
+        'health', u.health,
+        'intellect', u.intellect,
+        'agility', u.agility,
+        'confidence', u.confidence,
+        'stability', u.stability,
+        'current_level', COALESCE(p.current_level, 1),
+        'current_xp', COALESCE(p.current_xp, 0),
+        'next_level_xp', COALESCE(p.next_level_xp, 100),
+        'total_xp', COALESCE(p.total_xp, 0),
+        'goal_text', p.goal_text,
+        'current_streak', CASE WHEN s.last_completion_date >= CURRENT_DATE - 1 THEN s.current_streak ELSE 0 END,
+        'best_streak', COALESCE(s.best_streak, 0)
+    )
+    FROM users u
+    LEFT JOIN progress p ON p.user_id = u.id
+    LEFT JOIN user_streaks s ON s.user_id = u.id
+    WHERE u.tg_id = p_tg_id;
+$$ LANGUAGE sql STABLE;
+
+-- Function to record a generated avatar in a single round trip
+-- Idempotent per (user_id, level): n8n retries of a level that is already
+-- completed change nothing and report 'duplicate'. Otherwise the user's avatar
+-- is replaced (its old variants cleared until the new ones are rendered) and
+-- the generation row is completed: the one echoed back, else the newest open
+-- one for the level, else a new one.
+CREATE OR REPLACE FUNCTION ingest_avatar(
+    p_user_id UUID,
+    p_avatar_url TEXT,
+    p_level INTEGER DEFAULT NULL,
+    p_generation_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_level INTEGER;
+    v_generation_id UUID;
+    v_completed_id UUID;
+    v_tg_id BIGINT;
+BEGIN
+    IF p_generation_id IS NOT NULL THEN
+        SELECT id, level INTO v_generation_id, v_level
+        FROM avatar_generations
+        WHERE id = p_generation_id AND user_id = p_user_id;
+    END IF;
+    v_level := COALESCE(v_level, p_level, 1);
+
+    -- Concurrent deliveries of the same callback are serialized here
+    PERFORM pg_advisory_xact_lock(hashtext('avatar:' || p_user_id::TEXT), v_level);
+
+    SELECT id INTO v_completed_id
+    FROM avatar_generations
+    WHERE user_id = p_user_id AND level = v_level AND generation_status = 'completed'
+    LIMIT 1;
+    IF FOUND THEN
+        RETURN jsonb_build_object('status', 'duplicate', 'generation_id', v_completed_id, 'level', v_level);
+    END IF;
+
+    UPDATE users
+    SET avatar_url = p_avatar_url, avatar_variants = NULL, avatar_blurhash = NULL, updated_at = NOW()
+    WHERE id = p_user_id
+    RETURNING tg_id INTO v_tg_id;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'user_not_found');
+    END IF;
+
+    IF v_generation_id IS NULL THEN
+        SELECT id INTO v_generation_id
+        FROM avatar_generations
+        WHERE user_id = p_user_id AND level = v_level AND generation_status IN ('pending', 'processing', 'failed')
+        ORDER BY created_at DESC
+        LIMIT 1;
+    END IF;
+    IF v_generation_id IS NULL THEN
+        INSERT INTO avatar_generations (user_id, level, avatar_url, generation_status)
+        VALUES (p_user_id, v_level, p_avatar_url, 'completed')
+        RETURNING id INTO v_generation_id;
+    ELSE
+        UPDATE avatar_generations
+        SET avatar_url = p_avatar_url, generation_status = 'completed'
+        WHERE id = v_generation_id;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'accepted',
+        'generation_id', v_generation_id,
+        'level', v_level,
+        'tg_id', v_tg_id
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to complete a quest in a single round trip
+-- Covers the duplicate check, XP, stats, the daily bonus and achieved goals
+-- atomically; concurrent taps by the same user are serialized on the progress row
+CREATE OR REPLACE FUNCTION complete_quest(
+    p_tg_id BIGINT,
+    p_quest_id UUID,
+    p_completion_date DATE DEFAULT CURRENT_DATE,
+    p_bonus_title TEXT DEFAULT '⭐ Выполни все daily квесты'
+) RETURNS JSONB AS $$
+DECLARE
+    v_user users%ROWTYPE;
+    v_branches TEXT[];
+    v_xp_reward INTEGER;
+    v_leveled_up BOOLEAN;
+    v_levels_gained INTEGER;
+    v_new_level INTEGER;
+    v_bonus_quest_id UUID;
+    v_bonus_reward INTEGER;
+    v_bonus_xp INTEGER := 0;
+    v_bonus_awarded BOOLEAN := FALSE;
+    v_bonus_leveled_up BOOLEAN := FALSE;
+    v_bonus_levels_gained INTEGER;
+    v_bonus_new_level INTEGER;
+    v_daily_total INTEGER;
+    v_daily_remaining INTEGER;
+    v_achieved_goals JSONB;
+BEGIN
+    SELECT * INTO v_user FROM users WHERE tg_id = p_tg_id;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'user_not_found');
+    END IF;
+    v_branches := COALESCE(v_user.active_branches, ARRAY['power']);
+
+    SELECT xp_reward INTO v_xp_reward FROM quests WHERE id = p_quest_id;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'quest_not_found');
+    END IF;
+
+    PERFORM 1 FROM progress WHERE user_id = v_user.id FOR UPDATE;
+
+    -- The unique constraint arbitrates double-taps instead of a separate check
+    INSERT INTO user_quests (user_id, quest_id, completion_date, is_today)
+    VALUES (v_user.id, p_quest_id, p_completion_date, TRUE)
+    ON CONFLICT (user_id, quest_id, completion_date) DO NOTHING;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'already_completed');
+    END IF;
+
+    SELECT leveled_up, new_level, levels_gained
+    INTO v_leveled_up, v_new_level, v_levels_gained
+    FROM add_xp_and_check_level(v_user.id, v_xp_reward);
+
+    IF v_leveled_up THEN
+        PERFORM update_stats_on_levelup(v_user.id, v_branches, v_levels_gained);
+    END IF;
+
+    -- Daily bonus once every other daily quest of the user's branches is done
+    SELECT id, xp_reward INTO v_bonus_quest_id, v_bonus_reward
+    FROM quests
+    WHERE title = p_bonus_title AND is_daily AND branch = ANY(v_branches || ARRAY['global'])
+    LIMIT 1;
+
+    IF v_bonus_quest_id IS NOT NULL THEN
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE uq.id IS NULL)
+        INTO v_daily_total, v_daily_remaining
+        FROM quests q
+        LEFT JOIN user_quests uq
+            ON uq.quest_id = q.id
+            AND uq.user_id = v_user.id
+            AND uq.completion_date = p_completion_date
+        WHERE q.is_daily
+            AND q.branch = ANY(v_branches || ARRAY['global'])
+            AND q.title <> p_bonus_title;
+
+        IF v_daily_total > 0 AND v_daily_remaining = 0 THEN
+            v_bonus_xp := COALESCE(v_bonus_reward, 0);
+
+            INSERT INTO user_quests (user_id, quest_id, completion_date, is_today)
+            VALUES (v_user.id, v_bonus_quest_id, p_completion_date, TRUE)
+            ON CONFLICT (user_id, quest_id, completion_date) DO NOTHING;
+
+            IF FOUND THEN
+                v_bonus_awarded := TRUE;
+                SELECT leveled_up, new_level, levels_gained
+                INTO v_bonus_leveled_up, v_bonus_new_level, v_bonus_levels_gained
+                FROM add_xp_and_check_level(v_user.id, v_bonus_xp);
+
+                IF v_bonus_leveled_up THEN
+                    PERFORM update_stats_on_levelup(v_user.id, v_branches, v_bonus_levels_gained);
+                END IF;
+            END IF;
+        END IF;
+    END IF;
+
+    PERFORM record_daily_completion(
+        v_user.id, p_completion_date, 1,
+        v_xp_reward + CASE WHEN v_bonus_awarded THEN v_bonus_xp ELSE 0 END
+    );
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(g) ORDER BY g.created_at), '[]'::jsonb)
+    INTO v_achieved_goals
+    FROM goals g
+    WHERE g.user_id = v_user.id
+        AND g.is_completed = FALSE
+        AND g.notified_at IS NULL
+        AND g.notify_claimed_at IS NULL
+        AND COALESCE(g.goal_level, 1) <= GREATEST(v_new_level, COALESCE(v_bonus_new_level, v_new_level));
+
+    RETURN jsonb_build_object(
+        'status', 'completed',
+        'user_id', v_user.id,
+        'xp_gained', v_xp_reward,
+        'leveled_up', v_leveled_up,
+        'previous_level', v_new_level - COALESCE(v_levels_gained, 0),
+        'new_level', v_new_level,
+        'bonus_awarded', v_bonus_awarded,
+        'bonus_xp', v_bonus_xp,
+        'bonus_leveled_up', v_bonus_leveled_up,
+        'bonus_new_level', v_bonus_new_level,
+        'achieved_goals', v_achieved_goals,
+        'avatar', jsonb_build_object(
+            'selfie_url', v_user.selfie_url,
+            'gender', v_user.gender,
+            'age', v_user.age,
+            'active_branches', to_jsonb(v_branches)
+        )
+    );
 END;
 $$ LANGUAGE plpgsql;
 
+-- Revision counter behind the API's ETags
+-- Activity heartbeats (last_active_at) alone do not change what the app shows,
+-- so they leave the revision as it is
+CREATE OR REPLACE FUNCTION bump_own_revision()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF to_jsonb(NEW) - 'last_active_at' - 'updated_at' - 'revision'
+        IS DISTINCT FROM to_jsonb(OLD) - 'last_active_at' - 'updated_at' - 'revision' THEN
+        NEW.revision := OLD.revision + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_bump_revision ON users;
+CREATE TRIGGER users_bump_revision
+    BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION bump_own_revision();
+
+-- Changes to a user's progress, completions or goals bump the owner's revision
+CREATE OR REPLACE FUNCTION bump_user_revision()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_user_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_user_id := OLD.user_id;
+    ELSE
+        v_user_id := NEW.user_id;
+    END IF;
+    UPDATE users SET revision = revision + 1 WHERE id = v_user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS progress_bump_revision ON progress;
+CREATE TRIGGER progress_bump_revision
+    AFTER INSERT OR UPDATE OR DELETE ON progress
+    FOR EACH ROW EXECUTE FUNCTION bump_user_revision();
+
+DROP TRIGGER IF EXISTS user_quests_bump_revision ON user_quests;
+CREATE TRIGGER user_quests_bump_revision
+    AFTER INSERT OR UPDATE OR DELETE ON user_quests
+    FOR EACH ROW EXECUTE FUNCTION bump_user_revision();
+
+DROP TRIGGER IF EXISTS goals_bump_revision ON goals;
+CREATE TRIGGER goals_bump_revision
+    AFTER INSERT OR UPDATE OR DELETE ON goals
+    FOR EACH ROW EXECUTE FUNCTION bump_user_revision();
+
+-- Public bucket for resized avatar variants (written by the backend's service key)
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('avatars', 'avatars', TRUE)
+ON CONFLICT (id) DO NOTHING;
+
 -- Enable Row Level Security
 ALTER TABLE users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE progress ENABLE ROW LEVEL SECURITY;
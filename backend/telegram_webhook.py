@@ -0,0 +1,93 @@
+"""Webhook intake for the Telegram bot inside the API process
+
+With ``BOT_MODE=webhook`` Telegram pushes updates to
+``POST /api/telegram/webhook`` instead of ``bot.py`` long-polling for them.
+Each API worker runs the bot's PTB ``Application`` without an updater: the
+route checks the ``X-Telegram-Bot-Api-Secret-Token`` header against
+``BOT_WEBHOOK_SECRET``, decodes the update and puts it on the application's
+update queue, then answers at once while the handlers run concurrently.
+Bot traffic is therefore spread over the API workers, and nothing waits on a
+polling interval. ``bot.py`` keeps running the scheduled reminders so they are
+sent once, not once per worker.
+
+The webhook is registered on every startup, since ``getWebhookInfo`` does not
+report the secret token and a rotated ``BOT_WEBHOOK_SECRET`` would otherwise
+never reach Telegram (``setWebhook`` is idempotent). It is left in place on
+shutdown, since other workers are still serving it.
+"""
+import os
+import hmac
+import logging
+from typing import Callable, Optional
+
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+BOT_WEBHOOK_URL = os.environ.get('BOT_WEBHOOK_URL')
+BOT_WEBHOOK_SECRET = os.environ.get('BOT_WEBHOOK_SECRET')
+BOT_WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('BOT_WEBHOOK_MAX_CONNECTIONS', '40'))
+# The bot only has command handlers, so Telegram is asked for messages alone
+# (for polling and the webhook alike)
+ALLOWED_UPDATES = ['message']
+
+logger = logging.getLogger("lifequest")
+
+
+class TelegramWebhook:
+    def __init__(
+        self,
+        build_application: Callable,
+        allowed_updates=ALLOWED_UPDATES,
+        url: Optional[str] = BOT_WEBHOOK_URL,
+        secret: Optional[str] = BOT_WEBHOOK_SECRET,
+        enabled: bool = BOT_MODE == 'webhook',
+        decode: Optional[Callable] = None
+    ):
+        self._build_application = build_application
+        self._allowed_updates = list(allowed_updates)
+        self._url = url
+        self._secret = secret
+        self._decode = decode
+        self.enabled = enabled
+        self.application = None
+
+    def verify(self, secret_token: Optional[str]) -> bool:
+        if not self._secret or not secret_token:
+            return False
+        return hmac.compare_digest(secret_token.encode(), self._secret.encode())
+
+    async def start(self) -> None:
+        if not self.enabled:
+            return
+        if not self._url or not self._secret:
+            raise RuntimeError("BOT_MODE=webhook needs BOT_WEBHOOK_URL and BOT_WEBHOOK_SECRET")
+        self.application = self._build_application()
+        await self.application.initialize()
+        await self.application.start()
+
+        await self.application.bot.set_webhook(
+            url=self._url,
+            secret_token=self._secret,
+            allowed_updates=self._allowed_updates,
+            max_connections=BOT_WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Telegram webhook set to {self._url} for {self._allowed_updates}")
+
+    async def stop(self) -> None:
+        if self.application is None:
+            return
+        await self.application.stop()
+        await self.application.shutdown()
+        self.application = None
+
+    async def feed(self, data: dict) -> None:
+        """Queue one decoded update for the application's handlers"""
+        decode = self._decode
+        if decode is None:
+            from telegram import Update
+            decode = Update.de_json
+        update = decode(data, self.application.bot)
+        if update is not None:
+            await self.application.update_queue.put(update)
+
+    @property
+    def pending(self) -> int:
+        return self.application.update_queue.qsize() if self.application is not None else 0
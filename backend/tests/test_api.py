@@ -12,6 +12,7 @@ BASE_URL = (
     or 'http://localhost:8000'
 ).rstrip('/')
 TEST_TG_ID = 123456789
+AVATAR_WEBHOOK_HEADERS = {'X-Webhook-Secret': os.environ.get('AVATAR_WEBHOOK_SECRET', '')}
 
 class TestHealthCheck:
     """API health check tests"""
@@ -88,6 +89,18 @@ class TestProgressEndpoints:
         assert isinstance(data["current_xp"], int)
         assert data["current_level"] >= 1
     
+    def test_get_progress_conditional(self):
+        """Test an unchanged progress answers If-None-Match with 304 and no body"""
+        response = requests.get(f"{BASE_URL}/api/users/{TEST_TG_ID}/progress")
+        assert response.status_code == 200
+        etag = response.headers.get("ETag")
+        assert etag
+        
+        cached = requests.get(f"{BASE_URL}/api/users/{TEST_TG_ID}/progress", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.headers.get("ETag") == etag
+        assert cached.content == b""
+    
     def test_get_progress_nonexistent_user(self):
         """Test getting progress for non-existent user returns 404"""
         response = requests.get(f"{BASE_URL}/api/users/999999999999/progress")
@@ -156,6 +169,123 @@ class TestQuestEndpoints:
             assert "xp_gained" in data
             assert "leveled_up" in data
 
+    
+    def test_complete_quests_batch(self):
+        """Test batch completion returns a result per quest"""
+        quests_response = requests.get(f"{BASE_URL}/api/users/{TEST_TG_ID}/quests")
+        quest_ids = [q["id"] for q in quests_response.json()][:3]
+        payload = {"quest_ids": quest_ids + ["00000000-0000-0000-0000-000000000000"]}
+        
+        response = requests.post(
+            f"{BASE_URL}/api/users/{TEST_TG_ID}/quests/complete-batch",
+            json=payload
+        )
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert data["success"] == True
+        assert [r["quest_id"] for r in data["results"]] == payload["quest_ids"]
+        assert data["results"][-1]["status"] == "not_found"
+        assert all(r["status"] in ["completed", "already_completed"] for r in data["results"][:-1])
+    
+    def test_complete_quests_batch_empty(self):
+        """Test batch completion rejects an empty list"""
+        response = requests.post(
+            f"{BASE_URL}/api/users/{TEST_TG_ID}/quests/complete-batch",
+            json={"quest_ids": []}
+        )
+        assert response.status_code == 422
+
+
+class TestGoalEndpoints:
+    """Paginated goals API tests"""
+    
+    def test_get_goals_page(self):
+        """Test goals can be paged with a cursor and sparse fields"""
+        response = requests.get(
+            f"{BASE_URL}/api/users/{TEST_TG_ID}/goals",
+            params={"status": "completed", "limit": 1, "fields": "goal_text"}
+        )
+        assert response.status_code == 200
+        goals = response.json()
+        assert len(goals) <= 1
+        assert all(set(goal) <= {"id", "created_at", "goal_text"} for goal in goals)
+        
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor:
+            next_page = requests.get(
+                f"{BASE_URL}/api/users/{TEST_TG_ID}/goals",
+                params={"status": "completed", "limit": 1, "cursor": cursor}
+            )
+            assert next_page.status_code == 200
+            assert next_page.json()[0]["id"] != goals[0]["id"]
+    
+    def test_archived_goal_stays_listed(self):
+        """Test an archived goal moves from the active page to the archived one"""
+        url = f"{BASE_URL}/api/users/{TEST_TG_ID}/goals"
+        created = requests.post(url, json={"goal_text": "TEST_archive", "goal_level": 50})
+        assert created.status_code == 200
+        goal_id = created.json()["id"]
+        archived = requests.patch(f"{url}/{goal_id}", json={
+            "is_completed": True,
+            "completed_at": "2026-01-01T00:00:00+00:00",
+            "archived_at": "2026-01-01T00:00:00+00:00"
+        })
+        assert archived.status_code == 200
+        
+        archived_ids = [goal["id"] for goal in requests.get(url, params={"status": "archived", "limit": 100}).json()]
+        active_ids = [goal["id"] for goal in requests.get(url, params={"status": "active", "limit": 100}).json()]
+        assert goal_id in archived_ids and goal_id not in active_ids
+        bootstrap = requests.get(f"{BASE_URL}/api/users/{TEST_TG_ID}/bootstrap").json()
+        assert goal_id in [goal["id"] for goal in bootstrap["goals"]] or bootstrap["archived_goals_cursor"]
+    
+    def test_get_goals_invalid_params(self):
+        """Test unknown statuses, fields and cursors are rejected"""
+        url = f"{BASE_URL}/api/users/{TEST_TG_ID}/goals"
+        assert requests.get(url, params={"status": "deleted"}).status_code == 422
+        assert requests.get(url, params={"fields": "user_id"}).status_code == 400
+        assert requests.get(url, params={"cursor": "garbage"}).status_code == 400
+
+class TestStatsHistory:
+    """Completion history endpoint tests"""
+    
+    def test_get_stats_history(self):
+        """Test one zero-filled entry per day and streak fields"""
+        response = requests.get(f"{BASE_URL}/api/users/{TEST_TG_ID}/stats/history", params={"days": 7})
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert len(data["days"]) == 7
+        assert data["days"] == sorted(data["days"], key=lambda day: day["date"])
+        assert data["best_streak"] >= data["current_streak"] >= 0
+        assert data["total_quests"] == sum(day["quest_count"] for day in data["days"])
+    
+    def test_get_stats_history_invalid_days(self):
+        response = requests.get(f"{BASE_URL}/api/users/{TEST_TG_ID}/stats/history", params={"days": 0})
+        assert response.status_code == 422
+
+class TestBootstrapEndpoint:
+    """Aggregated home screen endpoint tests"""
+    
+    def test_get_bootstrap(self):
+        """Test bootstrap returns user, progress, quests, goals and daily XP"""
+        response = requests.get(f"{BASE_URL}/api/users/{TEST_TG_ID}/bootstrap")
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert data["user"]["tg_id"] == TEST_TG_ID
+        assert "current_level" in data["progress"]
+        assert isinstance(data["quests"], list)
+        assert all("is_completed" in quest for quest in data["quests"])
+        assert isinstance(data["goals"], list)
+        assert "archived_goals_cursor" in data
+        assert "daily_xp" in data["daily_xp"]
+    
+    def test_get_bootstrap_nonexistent_user(self):
+        """Test bootstrap for non-existent user returns 404"""
+        response = requests.get(f"{BASE_URL}/api/users/999999999999/bootstrap")
+        assert response.status_code == 404
+
 
 class TestProFeatures:
     """PRO subscription tests"""
@@ -216,6 +346,37 @@ class TestWebhooks:
         """Test avatar webhook with missing fields returns 400"""
         response = requests.post(
             f"{BASE_URL}/api/webhooks/avatar-generated",
-            json={"user_id": "test"}  # Missing avatar_url
+            json={"user_id": "test"},  # Missing avatar_url
+            headers=AVATAR_WEBHOOK_HEADERS
+        )
+        assert response.status_code == 400
+    
+    def test_avatar_webhook_requires_secret(self):
+        """Test avatar webhook without the shared secret returns 403"""
+        response = requests.post(
+            f"{BASE_URL}/api/webhooks/avatar-generated",
+            json={"user_id": "00000000-0000-0000-0000-000000000000", "avatar_url": "https://example.com/a.png"}
+        )
+        assert response.status_code == 403
+
+    def test_avatar_webhook_unknown_user(self):
+        """Test avatar webhook for a user that does not exist returns 404"""
+        response = requests.post(
+            f"{BASE_URL}/api/webhooks/avatar-generated",
+            json={
+                "user_id": "00000000-0000-0000-0000-000000000000",
+                "avatar_url": f"{os.environ.get('SUPABASE_URL', '').rstrip('/')}/storage/v1/object/public/avatars/a.png",
+                "level": 1
+            },
+            headers=AVATAR_WEBHOOK_HEADERS
+        )
+        assert response.status_code == 404
+    
+    def test_avatar_webhook_untrusted_host(self):
+        """Test avatar webhook with an avatar_url outside the allowed hosts returns 400"""
+        response = requests.post(
+            f"{BASE_URL}/api/webhooks/avatar-generated",
+            json={"user_id": "00000000-0000-0000-0000-000000000000", "avatar_url": "http://169.254.169.254/latest"},
+            headers=AVATAR_WEBHOOK_HEADERS
         )
         assert response.status_code == 400
@@ -0,0 +1,261 @@
+"""
+Avatar ingestion and image pipeline tests
+ingest_avatar dedupe against the in-memory Supabase, blurhash encoding, and
+variant rendering/upload where Pillow is installed
+"""
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from avatar_images import (  # noqa: E402
+    AvatarImagePipeline, BASE83, available_formats, blurhash_encode, is_allowed_source, render_variants
+)
+from fake_supabase import FakeSupabase  # noqa: E402
+
+
+def decode83(text):
+    value = 0
+    for char in text:
+        value = value * 83 + BASE83.index(char)
+    return value
+
+
+def make_user(fake, tg_id=7):
+    return fake.table('users').insert({'tg_id': tg_id, 'first_name': 'Лев'}).execute().data[0]
+
+
+def ingest(fake, **params):
+    return fake.rpc('ingest_avatar', params).execute().data
+
+
+class TestIngestAvatar:
+    """One completed generation per (user_id, level); retries change nothing"""
+
+    def test_retry_is_duplicate(self):
+        fake = FakeSupabase()
+        user = make_user(fake)
+        first = ingest(fake, p_user_id=user['id'], p_avatar_url='https://cdn/a.png', p_level=5)
+        retry = ingest(fake, p_user_id=user['id'], p_avatar_url='https://cdn/a-retry.png', p_level=5)
+        assert first['status'] == 'accepted' and first['tg_id'] == 7
+        assert retry == {'status': 'duplicate', 'generation_id': first['generation_id'], 'level': 5}
+        assert fake._first('users', id=user['id'])['avatar_url'] == 'https://cdn/a.png'
+        assert len(fake.tables['avatar_generations']) == 1
+
+    def test_completes_queued_generation(self):
+        fake = FakeSupabase()
+        user = make_user(fake)
+        pending = fake.table('avatar_generations').insert({'user_id': user['id'], 'level': 10}).execute().data[0]
+        outcome = ingest(fake, p_user_id=user['id'], p_avatar_url='https://cdn/b.png', p_generation_id=pending['id'])
+        assert outcome['generation_id'] == pending['id'] and outcome['level'] == 10
+        assert fake._first('avatar_generations', id=pending['id'])['generation_status'] == 'completed'
+        assert len(fake.tables['avatar_generations']) == 1
+
+    def test_new_level_clears_variants(self):
+        fake = FakeSupabase()
+        user = make_user(fake)
+        ingest(fake, p_user_id=user['id'], p_avatar_url='https://cdn/1.png', p_level=1)
+        row = fake._first('users', id=user['id'])
+        row.update(avatar_variants=[{'format': 'webp', 'width': 360}], avatar_blurhash='LEHV6nWB2yk8')
+        assert ingest(fake, p_user_id=user['id'], p_avatar_url='https://cdn/5.png', p_level=5)['status'] == 'accepted'
+        assert row['avatar_url'] == 'https://cdn/5.png'
+        assert row['avatar_variants'] is None and row['avatar_blurhash'] is None
+
+    def test_unknown_user(self):
+        fake = FakeSupabase()
+        assert ingest(fake, p_user_id='missing', p_avatar_url='https://cdn/x.png')['status'] == 'user_not_found'
+
+
+class TestBlurhash:
+    """Encoder follows the blurhash format: size flag, AC max, DC colour, AC terms"""
+
+    def test_solid_colour(self):
+        pixels = [(200, 40, 10)] * (8 * 14)
+        blurhash = blurhash_encode(pixels, 8, 14, components=(3, 5))
+        assert len(blurhash) == 4 + 2 * 3 * 5
+        assert decode83(blurhash[0]) == 2 + 4 * 9
+        dc = decode83(blurhash[2:6])
+        assert (dc >> 16, (dc >> 8) & 255, dc & 255) == (200, 40, 10)
+
+    def test_gradient_has_ac_energy(self):
+        width, height = 8, 14
+        pixels = [(0, 0, 0) if y < height // 2 else (255, 255, 255) for y in range(height) for x in range(width)]
+        blurhash = blurhash_encode(pixels, width, height, components=(3, 5))
+        assert decode83(blurhash[1]) > 0
+        assert blurhash != blurhash_encode([(128, 128, 128)] * (width * height), width, height, components=(3, 5))
+
+
+def portrait_png(width=540, height=960):
+    Image = pytest.importorskip('PIL.Image')
+    # Noise over a gradient: detail a photo-like avatar has and PNG cannot squeeze
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (noise, gradient, noise))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class TestRenderVariants:
+    """Resized AVIF/WebP copies without upscaling"""
+
+    def test_widths_capped_at_source(self):
+        source = portrait_png()
+        variants, blurhash = render_variants(source, widths=(360, 720), formats=('webp',))
+        assert [(v['width'], v['height']) for v in variants] == [(360, 640), (540, 960)]
+        assert all(v['data'][8:12] == b'WEBP' for v in variants)
+        assert sum(len(v['data']) for v in variants) < len(source)
+        assert len(blurhash) == 4 + 2 * 3 * 5
+
+    def test_avif_when_supported(self):
+        source = portrait_png()
+        if 'avif' not in available_formats():
+            pytest.skip('Pillow built without AVIF')
+        variants, _ = render_variants(source, widths=(360,))
+        assert [v['format'] for v in variants] == ['avif', 'webp']
+        assert variants[0]['data'][4:12] == b'ftypavif'
+
+
+class StubStorage:
+    def __init__(self):
+        self.uploads = {}
+
+    def from_(self, bucket):
+        storage = self
+
+        class Bucket:
+            def upload(self, path, data, options):
+                storage.uploads[path] = (data, options)
+
+            def get_public_url(self, path):
+                return f"https://storage.test/{bucket}/{path}"
+
+        return Bucket()
+
+
+class StubResponse:
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.is_redirect = 300 <= status_code < 400
+        self.read_bytes = 0
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    async def aiter_bytes(self):
+        for start in range(0, len(self.content), 1024):
+            self.read_bytes += len(self.content[start:start + 1024])
+            yield self.content[start:start + 1024]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class StubHttp:
+    def __init__(self, content, **response_options):
+        self.response = StubResponse(content, **response_options)
+        self.requests = []
+
+    def stream(self, method, url, follow_redirects=True):
+        self.requests.append((method, url, follow_redirects))
+        return self.response
+
+
+class TestFetch:
+    """Only trusted hosts, no redirects, and a hard cap on the bytes read"""
+
+    def make(self, content=b'x' * 4096, **response_options):
+        http = StubHttp(content, **response_options)
+        return AvatarImagePipeline(FakeSupabase(), lambda: http, workers=1, max_source_bytes=2048, source_hosts={'cdn'}), http
+
+    def test_allowed_hosts(self):
+        assert is_allowed_source('https://cdn/a.png', {'cdn'})
+        assert not is_allowed_source('https://169.254.169.254/latest/meta-data', {'cdn'})
+        assert not is_allowed_source('file:///etc/passwd', {'cdn'})
+        assert not is_allowed_source('https://cdn.evil.test/a.png', {'cdn'})
+
+    def test_untrusted_host_never_requested(self):
+        pipeline, http = self.make()
+        with pytest.raises(ValueError):
+            asyncio.run(pipeline.fetch('http://localhost:8000/api/metrics'))
+        assert http.requests == []
+        pipeline.shutdown()
+
+    def test_redirect_refused(self):
+        pipeline, http = self.make(status_code=302, headers={'location': 'http://169.254.169.254/'})
+        with pytest.raises(ValueError):
+            asyncio.run(pipeline.fetch('https://cdn/a.png'))
+        assert http.requests == [('GET', 'https://cdn/a.png', False)]
+        pipeline.shutdown()
+
+    def test_oversized_body_aborted(self):
+        pipeline, http = self.make(content=b'x' * 1_000_000)
+        with pytest.raises(ValueError):
+            asyncio.run(pipeline.fetch('https://cdn/a.png'))
+        assert http.response.read_bytes <= 2048 + 1024
+        pipeline.shutdown()
+
+    def test_declared_length_rejected_up_front(self):
+        pipeline, http = self.make(headers={'content-length': '999999'})
+        with pytest.raises(ValueError):
+            asyncio.run(pipeline.fetch('https://cdn/a.png'))
+        assert http.response.read_bytes == 0
+        pipeline.shutdown()
+
+    def test_small_body_returned(self):
+        pipeline, _ = self.make(content=b'y' * 2000)
+        assert asyncio.run(pipeline.fetch('https://cdn/a.png')) == b'y' * 2000
+        pipeline.shutdown()
+
+
+class TestPipeline:
+    """Variants land in Storage and on the user row, unless the avatar moved on"""
+
+    def make(self, source):
+        fake = FakeSupabase()
+        fake.storage = StubStorage()
+        user = make_user(fake)
+        ingest(fake, p_user_id=user['id'], p_avatar_url='https://cdn/1.png', p_level=1)
+        http = StubHttp(source)
+        pipeline = AvatarImagePipeline(
+            fake, lambda: http, widths=(360,), formats=('webp',), workers=1, source_hosts={'cdn'}
+        )
+        return fake, user, pipeline
+
+    def test_variants_attached(self):
+        fake, user, pipeline = self.make(portrait_png())
+        rows = asyncio.run(pipeline.process({'user_id': user['id'], 'level': 1, 'source_url': 'https://cdn/1.png'}))
+        pipeline.shutdown()
+        assert rows and rows[0]['tg_id'] == 7
+        row = fake._first('users', id=user['id'])
+        assert [(v['format'], v['width']) for v in row['avatar_variants']] == [('webp', 360)]
+        path = row['avatar_variants'][0]['url'].split('/avatars/', 1)[1]
+        assert fake.storage.uploads[path][1]['cache-control'] == '31536000'
+        assert row['avatar_blurhash']
+
+    def test_stale_source_discarded(self):
+        fake, user, pipeline = self.make(portrait_png())
+        ingest(fake, p_user_id=user['id'], p_avatar_url='https://cdn/5.png', p_level=5)
+        rows = asyncio.run(pipeline.process({'user_id': user['id'], 'level': 1, 'source_url': 'https://cdn/1.png'}))
+        pipeline.shutdown()
+        assert rows == []
+        assert fake._first('users', id=user['id'])['avatar_variants'] is None
+
+    def test_processes_after_shutdown(self):
+        """Test a pipeline shut down by one lifespan still renders in the next"""
+        fake, user, pipeline = self.make(portrait_png())
+        pipeline.shutdown()
+        rows = asyncio.run(pipeline.process({'user_id': user['id'], 'level': 1, 'source_url': 'https://cdn/1.png'}))
+        pipeline.shutdown()
+        assert rows and rows[0]['avatar_blurhash']
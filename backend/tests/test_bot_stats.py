@@ -0,0 +1,69 @@
+"""
+Bot /stats data path tests
+Reads through UserStatsReader against the in-memory Supabase
+"""
+import asyncio
+import sys
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from bot_stats import UserStatsReader, format_stats  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+
+
+def make_fake(latency=0.0):
+    fake = FakeSupabase(latency=latency)
+    user = fake.table('users').insert({'tg_id': 5, 'first_name': 'Ира', 'strength': 4}).execute().data[0]
+    fake.table('progress').insert({'user_id': user['id'], 'total_xp': 250, 'goal_text': 'Марафон'}).execute()
+    fake.rpc('record_daily_completion', {
+        'p_user_id': user['id'], 'p_date': date.today().isoformat(), 'p_quests': 1, 'p_xp': 20
+    }).execute()
+    return fake
+
+
+class TestUserStatsReader:
+    """One RPC per user per TTL, shared by concurrent commands"""
+
+    def test_single_round_trip_then_cache(self):
+        fake = make_fake()
+        reader = UserStatsReader(fake, ttl=60)
+        before = fake.round_trips
+
+        async def run():
+            return await reader.get(5), await reader.get(5)
+
+        first, second = asyncio.run(run())
+        assert first == second
+        assert first['strength'] == 4 and first['total_xp'] == 250
+        assert first['current_streak'] == 1
+        assert fake.round_trips - before == 1
+
+    def test_concurrent_commands_share_one_query(self):
+        """Test a burst of /stats from one user while the first read is in flight"""
+        fake = make_fake(latency=0.05)
+        reader = UserStatsReader(fake, ttl=60)
+        before = fake.round_trips
+
+        async def burst():
+            return await asyncio.gather(*(reader.get(5) for _ in range(10)))
+
+        results = asyncio.run(burst())
+        assert all(result == results[0] for result in results)
+        assert fake.round_trips - before == 1
+
+    def test_unregistered_user_is_not_cached(self):
+        fake = make_fake()
+        reader = UserStatsReader(fake, ttl=60)
+        assert asyncio.run(reader.get(6)) is None
+        fake.table('users').insert({'tg_id': 6}).execute()
+        assert asyncio.run(reader.get(6)) is not None
+
+    def test_format_stats(self):
+        stats = asyncio.run(UserStatsReader(make_fake()).get(5))
+        text = format_stats(stats)
+        assert 'Ира' in text and 'Сила: 4' in text
+        assert '🎯 Цель: Марафон' in text
+        assert '🔥 Серия: 1 дн.' in text
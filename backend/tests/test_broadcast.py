@@ -0,0 +1,174 @@
+"""
+Broadcast engine tests
+Run against in-memory recipients and checkpoints, no database or Bot API needed
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from broadcast import BroadcastAborted, BroadcastEngine, MemoryCheckpointStore  # noqa: E402
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Flood control exceeded")
+        self.retry_after = retry_after
+
+
+class Blocked(Exception):
+    pass
+
+
+class BadMarkup(Exception):
+    pass
+
+
+def memory_pages(tg_ids):
+    async def fetch_page(after_tg_id, limit):
+        remaining = [tg_id for tg_id in tg_ids if after_tg_id is None or tg_id > after_tg_id]
+        return [{'tg_id': tg_id} for tg_id in remaining[:limit]]
+    return fetch_page
+
+
+def make_engine(send, tg_ids, checkpoints=None, **kwargs):
+    return BroadcastEngine(
+        send=send,
+        fetch_page=memory_pages(tg_ids),
+        checkpoints=checkpoints or MemoryCheckpointStore(),
+        is_permanent=lambda error: isinstance(error, Blocked),
+        is_fatal=lambda error: isinstance(error, BadMarkup),
+        rate=1000,
+        per_chat_interval=0,
+        page_size=3,
+        **kwargs
+    )
+
+
+class TestBroadcastEngine:
+    """Delivery, rate limiting and resume tests"""
+
+    def test_delivers_every_page(self):
+        """Test every recipient gets one message across keyset pages"""
+        sent = []
+
+        async def send(chat_id):
+            sent.append(chat_id)
+
+        report = asyncio.run(make_engine(send, list(range(1, 8))).run('daily'))
+        assert sorted(sent) == list(range(1, 8))
+        assert report.sent == 7
+        assert report.pages == 3
+        assert report.status == 'completed'
+
+    def test_retry_after_is_honoured(self):
+        """Test a 429 is retried after the requested pause"""
+        attempts = []
+
+        async def send(chat_id):
+            attempts.append(chat_id)
+            if attempts.count(chat_id) == 1 and chat_id == 2:
+                raise RetryAfter(0.01)
+
+        report = asyncio.run(make_engine(send, [1, 2, 3]).run('daily'))
+        assert report.sent == 3
+        assert report.rate_limited == 1
+        assert attempts.count(2) == 2
+
+    def test_blocked_chats_are_not_retried(self):
+        """Test permanent errors count as blocked without retries"""
+        attempts = []
+
+        async def send(chat_id):
+            attempts.append(chat_id)
+            if chat_id == 2:
+                raise Blocked()
+
+        report = asyncio.run(make_engine(send, [1, 2, 3]).run('daily'))
+        assert report.sent == 2
+        assert report.blocked == 1
+        assert attempts.count(2) == 1
+
+    def test_resumes_from_checkpoint(self):
+        """Test a rerun continues after the last checkpointed tg_id"""
+        checkpoints = MemoryCheckpointStore()
+        checkpoints.runs['daily'] = {'sent': 3, 'pages': 1, 'last_tg_id': 3, 'status': 'running'}
+        sent = []
+
+        async def send(chat_id):
+            sent.append(chat_id)
+
+        report = asyncio.run(make_engine(send, [1, 2, 3, 4, 5], checkpoints).run('daily'))
+        assert sorted(sent) == [4, 5]
+        assert report.sent == 5
+
+        sent.clear()
+        asyncio.run(make_engine(send, [1, 2, 3, 4, 5], checkpoints).run('daily'))
+        assert sent == []
+
+    def test_fatal_error_aborts_and_resumes(self):
+        """Test a fatal error stops the run at the last full page and a rerun picks it up"""
+        checkpoints = MemoryCheckpointStore()
+        sent = []
+        broken = [True]
+
+        async def send(chat_id):
+            if chat_id == 5 and broken[0]:
+                raise BadMarkup("Can't parse entities")
+            sent.append(chat_id)
+
+        with pytest.raises(BroadcastAborted):
+            asyncio.run(make_engine(send, list(range(1, 8)), checkpoints).run('daily'))
+        assert checkpoints.runs['daily']['status'] == 'aborted'
+        assert checkpoints.runs['daily']['last_tg_id'] == 3
+        assert 7 not in sent
+
+        broken[0] = False
+        report = asyncio.run(make_engine(send, list(range(1, 8)), checkpoints).run('daily'))
+        assert report.status == 'completed'
+        assert set(sent) == set(range(1, 8))
+
+
+class TestDailyReminders:
+    """The bot's error classification and startup resume"""
+
+    @pytest.fixture
+    def bot(self, monkeypatch):
+        pytest.importorskip('telegram')
+        pytest.importorskip('supabase')
+        monkeypatch.setenv('SUPABASE_URL', os.environ.get('SUPABASE_URL', 'http://localhost:54321'))
+        monkeypatch.setenv('SUPABASE_KEY', os.environ.get('SUPABASE_KEY', 'test-key'))
+        import bot
+        return bot
+
+    def test_only_gone_recipients_are_permanent(self, bot):
+        from telegram.error import BadRequest, Forbidden
+        assert bot.is_gone_recipient(Forbidden("Forbidden: bot was blocked by the user"))
+        assert bot.is_gone_recipient(BadRequest("Chat not found"))
+        assert not bot.is_gone_recipient(BadRequest("Can't parse entities: can't find end of the entity"))
+        assert bot.is_broken_message(BadRequest("Can't parse entities: can't find end of the entity"))
+        assert not bot.is_broken_message(BadRequest("Chat not found"))
+
+    def test_unfinished_run_is_resumed_on_startup(self, bot, monkeypatch):
+        checkpoints = MemoryCheckpointStore()
+        monkeypatch.setattr(bot, 'reminder_checkpoints', checkpoints)
+        runs = []
+
+        async def send_daily_reminders(context):
+            runs.append(context)
+
+        monkeypatch.setattr(bot, 'send_daily_reminders', send_daily_reminders)
+        asyncio.run(bot.resume_daily_reminders('context'))
+        assert runs == []
+
+        checkpoints.runs[bot.daily_reminders_id()] = {'status': 'running', 'last_tg_id': 3}
+        asyncio.run(bot.resume_daily_reminders('context'))
+        assert runs == ['context']
+
+        checkpoints.runs[bot.daily_reminders_id()]['status'] = 'completed'
+        asyncio.run(bot.resume_daily_reminders('context'))
+        assert runs == ['context']
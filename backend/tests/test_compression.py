@@ -0,0 +1,125 @@
+"""
+Response compression middleware tests
+Drives the ASGI middleware directly with tiny in-process apps
+"""
+import asyncio
+import gzip
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from compression import CompressionMiddleware, choose_encoding  # noqa: E402
+
+
+def json_app(payload: bytes, chunks: int = 1, content_type: bytes = b'application/json'):
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', content_type), (b'content-length', str(len(payload)).encode())
+        ]})
+        size = -(-len(payload) // chunks)
+        for index in range(chunks):
+            await send({
+                'type': 'http.response.body',
+                'body': payload[index * size:(index + 1) * size],
+                'more_body': index < chunks - 1
+            })
+    return app
+
+
+def call(app, accept_encoding: str = 'gzip'):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'headers': [(b'accept-encoding', accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app, minimum_size=500)(scope, None, send))
+    headers = dict(messages[0]['headers'])
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return headers, body
+
+
+PAYLOAD = json.dumps([{'id': str(index), 'title': 'Квест', 'xp_reward': 20} for index in range(100)]).encode()
+
+
+class TestCompression:
+    """Encoding negotiation and body handling tests"""
+
+    def test_choose_encoding(self):
+        assert choose_encoding('gzip, deflate, br', brotli_available=True) == 'br'
+        assert choose_encoding('gzip, deflate, br', brotli_available=False) == 'gzip'
+        assert choose_encoding('br;q=0, gzip', brotli_available=True) == 'gzip'
+        assert choose_encoding('identity') is None
+        assert choose_encoding('') is None
+
+    def test_large_json_is_gzipped(self):
+        headers, body = call(json_app(PAYLOAD))
+        assert headers[b'content-encoding'] == b'gzip'
+        assert int(headers[b'content-length']) == len(body) < len(PAYLOAD)
+        assert gzip.decompress(body) == PAYLOAD
+
+    def test_streamed_body_is_compressed_per_chunk(self):
+        headers, body = call(json_app(PAYLOAD, chunks=4))
+        assert headers[b'content-encoding'] == b'gzip'
+        assert b'content-length' not in headers
+        assert gzip.decompress(body) == PAYLOAD
+
+    def test_small_or_binary_bodies_pass_through(self):
+        """Test bodies under the threshold and non-text types are left alone"""
+        headers, body = call(json_app(b'{"success":true}'))
+        assert b'content-encoding' not in headers and body == b'{"success":true}'
+        headers, body = call(json_app(PAYLOAD, content_type=b'image/webp'))
+        assert b'content-encoding' not in headers and body == PAYLOAD
+        headers, body = call(json_app(PAYLOAD), accept_encoding='identity')
+        assert b'content-encoding' not in headers and body == PAYLOAD
+
+    def test_small_chunked_body_is_buffered_not_compressed(self):
+        """Test a small body split into chunks (as BaseHTTPMiddleware sends it) keeps its Content-Length"""
+        payload = b'{"success":true}'
+        headers, body = call(json_app(payload, chunks=4))
+        assert b'content-encoding' not in headers
+        assert int(headers[b'content-length']) == len(payload) and body == payload
+
+    def test_vary_on_every_compressible_response(self):
+        """Test Vary: Accept-Encoding is sent whether or not the body was compressed"""
+        assert call(json_app(PAYLOAD))[0][b'vary'] == b'Accept-Encoding'
+        assert call(json_app(b'{"success":true}'))[0][b'vary'] == b'Accept-Encoding'
+        assert call(json_app(PAYLOAD), accept_encoding='identity')[0][b'vary'] == b'Accept-Encoding'
+        assert call(json_app(PAYLOAD), accept_encoding='')[0][b'vary'] == b'Accept-Encoding'
+        assert b'vary' not in call(json_app(PAYLOAD, content_type=b'image/webp'))[0]
+
+    def test_vary_is_merged_and_not_modified_varies(self):
+        """Test an existing Vary is extended once and 304s vary like their 200s"""
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': [(b'vary', b'Origin')]})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        headers, body = call(app)
+        assert headers[b'vary'] == b'Origin, Accept-Encoding'
+        assert b'content-encoding' not in headers and body == b''
+
+
+class TestServerApp:
+    """Compression of real routes, behind the app's own HTTP middleware"""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        testclient = pytest.importorskip('starlette.testclient')
+        pytest.importorskip('supabase')
+        monkeypatch.setenv('SUPABASE_URL', os.environ.get('SUPABASE_URL', 'http://localhost:54321'))
+        monkeypatch.setenv('SUPABASE_KEY', os.environ.get('SUPABASE_KEY', 'test-key'))
+        import server
+        # Not entered as a context manager: the lifespan (bot, job workers) is not needed
+        return testclient.TestClient(server.app)
+
+    def test_small_json_is_sent_uncompressed(self, client):
+        response = client.get('/api/', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert 'content-encoding' not in response.headers
+        assert int(response.headers['content-length']) == len(response.content)
+        assert response.headers['vary'] == 'Accept-Encoding'
@@ -0,0 +1,47 @@
+"""
+ETag helper tests
+Pure in-process checks of tag derivation and If-None-Match matching
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from etag import etag_matches, make_etag  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+from quest_catalog import QuestCatalog  # noqa: E402
+
+
+class TestETag:
+    """Tag derivation and weak comparison tests"""
+
+    def test_tag_changes_with_revision(self):
+        tag = make_etag(1, 'progress', 5)
+        assert tag.startswith('W/"') and tag.endswith('"')
+        assert make_etag(1, 'progress', 5) == tag
+        assert make_etag(1, 'progress', 6) != tag
+        assert make_etag(1, 'quests', 5) != tag
+
+    def test_if_none_match(self):
+        """Test weak comparison, lists of tags and the wildcard"""
+        tag = make_etag(1, 'user', 3)
+        strong = tag[2:]
+        assert etag_matches(tag, tag)
+        assert etag_matches(strong, tag)
+        assert etag_matches(f'"other", {tag}', tag)
+        assert etag_matches('*', tag)
+        assert not etag_matches(None, tag)
+        assert not etag_matches(make_etag(1, 'user', 4), tag)
+
+    def test_catalog_digest_follows_content(self):
+        """Test catalogs with the same rows agree on the digest and a reloaded change alters it"""
+        fake = FakeSupabase()
+        first, second = QuestCatalog(fake, 'bonus', ttl=0), QuestCatalog(fake, 'bonus', ttl=0)
+        second.invalidate()
+        digest = asyncio.run(first.digest())
+        assert asyncio.run(second.digest()) == digest
+
+        fake.tables['quests'][0]['xp_reward'] += 5
+        assert asyncio.run(first.digest()) != digest
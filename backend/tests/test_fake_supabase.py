@@ -0,0 +1,134 @@
+"""
+Offline benchmark harness tests
+Checks the in-memory Supabase stand-in and the baseline comparison
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from db import run_query  # noqa: E402
+from tracing import trace_queries  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+from leveling import level_for_total_xp  # noqa: E402
+from bench_api import BASELINE_PATH, build_parser, compare, config_of, percentile  # noqa: E402
+
+BONUS_TITLE = '⭐ Выполни все daily квесты'
+
+
+def make_user(fake, tg_id=1):
+    user = fake.table('users').insert({'tg_id': tg_id, 'active_branches': ['power']}).execute().data[0]
+    fake.table('progress').insert({'user_id': user['id']}).execute()
+    return user
+
+
+class TestFakeSupabase:
+    """Query builder and RPC port tests"""
+
+    def test_builder_filters_order_and_projection(self):
+        """Test select/eq/order/limit behave like PostgREST"""
+        fake = FakeSupabase()
+        result = fake.table('quests').select('id, sort_order').eq('branch', 'power').order('sort_order', desc=True).limit(2).execute()
+        assert len(result.data) == 2
+        assert set(result.data[0]) == {'id', 'sort_order'}
+        assert result.data[0]['sort_order'] > result.data[1]['sort_order']
+
+    def test_complete_quest_rpc(self):
+        """Test the complete_quest port awards XP once and reports duplicates"""
+        fake = FakeSupabase()
+        make_user(fake, tg_id=7)
+        quest = fake.table('quests').select('*').eq('branch', 'power').limit(1).execute().data[0]
+        params = {'p_tg_id': 7, 'p_quest_id': quest['id'], 'p_completion_date': '2026-01-01', 'p_bonus_title': BONUS_TITLE}
+
+        first = fake.rpc('complete_quest', params).execute().data
+        second = fake.rpc('complete_quest', params).execute().data
+
+        assert first['status'] == 'completed'
+        assert first['xp_gained'] == quest['xp_reward']
+        assert second['status'] == 'already_completed'
+        assert fake.rpc('complete_quest', dict(params, p_tg_id=8)).execute().data['status'] == 'user_not_found'
+
+    def test_complete_quest_reports_previous_level(self):
+        """Test complete_quest returns the level before the XP so skipped milestones can be detected"""
+        fake = FakeSupabase()
+        user = make_user(fake, tg_id=7)
+        quest = fake.table('quests').select('*').eq('branch', 'power').limit(1).execute().data[0]
+        level_five_xp = next(xp for xp in range(100000) if level_for_total_xp(xp).level == 5)
+        fake._first('progress', user_id=user['id']).update({'total_xp': level_five_xp - 1, 'current_level': 4})
+
+        outcome = fake.rpc('complete_quest', {
+            'p_tg_id': 7, 'p_quest_id': quest['id'], 'p_completion_date': '2026-01-01', 'p_bonus_title': BONUS_TITLE
+        }).execute().data
+        assert outcome['leveled_up']
+        assert outcome['previous_level'] == 4
+        assert outcome['new_level'] >= 5
+
+    def test_completions_roll_up_per_day_with_streak(self):
+        """Test complete_quest maintains the daily rollup and the streak in the same call"""
+        fake = FakeSupabase()
+        user = make_user(fake, tg_id=7)
+        quests = fake.table('quests').select('*').eq('branch', 'power').limit(2).execute().data
+        for day, quest in (('2026-01-01', quests[0]), ('2026-01-01', quests[1]), ('2026-01-02', quests[0])):
+            fake.rpc('complete_quest', {
+                'p_tg_id': 7, 'p_quest_id': quest['id'], 'p_completion_date': day, 'p_bonus_title': BONUS_TITLE
+            }).execute()
+
+        rollups = fake.table('user_daily_stats').select('*').eq('user_id', user['id']).order('stat_date').execute().data
+        streak = fake.table('user_streaks').select('*').eq('user_id', user['id']).execute().data[0]
+        assert [(row['stat_date'], row['quest_count']) for row in rollups] == [('2026-01-01', 2), ('2026-01-02', 1)]
+        assert rollups[0]['xp'] == quests[0]['xp_reward'] + quests[1]['xp_reward']
+        assert (streak['current_streak'], streak['best_streak'], streak['last_completion_date']) == (2, 2, '2026-01-02')
+
+    def test_multi_level_jump_credits_every_level(self):
+        """Test stats grow by the branch matrix once per level gained"""
+        fake = FakeSupabase()
+        user = make_user(fake)
+        level_up = fake.rpc('add_xp_and_check_level', {'p_user_id': user['id'], 'p_xp_amount': 320}).execute().data[0]
+        fake.rpc('update_stats_on_levelup', {
+            'p_user_id': user['id'], 'p_branches': ['power', 'longevity'], 'p_levels': level_up['levels_gained']
+        }).execute()
+
+        stored = fake.table('users').select('*').eq('id', user['id']).execute().data[0]
+        assert level_up['levels_gained'] == 3
+        assert stored['strength'] == 1 + 3 * 3
+        assert stored['health'] == 1 + 3 * 3
+        assert stored['intellect'] == 1 + 3
+
+    def test_round_trips_are_traced(self):
+        """Test fake builders are counted and labelled by query tracing"""
+        fake = FakeSupabase()
+
+        async def handler():
+            await run_query(fake.table('users').select('*').eq('tg_id', 1))
+            await run_query(fake.rpc('touch_last_active', {'p_tg_ids': [1], 'p_seen_at': '2026-01-01'}))
+
+        with trace_queries() as trace:
+            asyncio.run(handler())
+        assert trace.calls() == ['select:users', 'rpc:touch_last_active']
+        assert fake.round_trips == 2
+
+
+class TestBaselineComparison:
+    """Percentile and regression detection tests"""
+
+    def test_percentile_nearest_rank(self):
+        samples = list(range(1, 101))
+        assert percentile(samples, 0.50) == 50
+        assert percentile(samples, 0.99) == 99
+        assert percentile([5], 0.95) == 5
+
+    def test_regressions_are_reported(self):
+        baseline = {'get_quests': {'p95_ms': 10.0, 'queries_per_request': 1.0, 'errors': 0}}
+        fine = {'get_quests': {'p95_ms': 11.0, 'queries_per_request': 1.0, 'errors': 0}}
+        slower = {'get_quests': {'p95_ms': 20.0, 'queries_per_request': 2.0, 'errors': 0}}
+        assert compare(fine, baseline, 0.25) == []
+        assert len(compare(slower, baseline, 0.25)) == 2
+
+    def test_committed_baseline_matches_defaults(self):
+        """Test --check works on a clean checkout: the baseline exists and uses the default settings"""
+        stored = json.loads(BASELINE_PATH.read_text())
+        assert stored['config'] == config_of(build_parser().parse_args([]))
+        assert set(stored['scenarios']) == {'register_user', 'complete_onboarding', 'get_quests', 'complete_quest'}
@@ -0,0 +1,72 @@
+"""
+Duplicate request suppression tests
+Pure in-process checks of single-flight coalescing and the idempotency store
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from idempotency import IdempotencyKeyReused, IdempotencyStore, SingleFlight  # noqa: E402
+
+
+class TestSingleFlight:
+    """Coalescing tests"""
+
+    def test_concurrent_calls_share_one_execution(self):
+        """Test identical in-flight calls run the work once and share the result"""
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'xp_gained': 20}
+
+        async def main():
+            return await asyncio.gather(*(flight.do((1, 'quest'), work) for _ in range(5)))
+
+        results = asyncio.run(main())
+        assert len(calls) == 1
+        assert all(result == {'xp_gained': 20} for result in results)
+        assert flight.coalesced == 4
+        assert flight.inflight == 0
+
+    def test_errors_are_shared_and_not_cached(self):
+        """Test waiters get the leader's error and the next call runs again"""
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("already completed")
+
+        async def main():
+            return await asyncio.gather(*(flight.do('key', work) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(main())
+        assert all(isinstance(result, ValueError) for result in results)
+        assert len(calls) == 1
+        asyncio.run(main())
+        assert len(calls) == 2
+
+
+class TestIdempotencyStore:
+    """Replay and key reuse tests"""
+
+    def test_replays_recorded_outcome(self):
+        store = IdempotencyStore(maxsize=10, ttl=60)
+        assert store.get(1, 'k1', ('complete', 'q1')) is None
+        store.save(1, 'k1', ('complete', 'q1'), 200, {'success': True})
+        assert store.get(1, 'k1', ('complete', 'q1'))['body'] == {'success': True}
+        assert store.get(2, 'k1', ('complete', 'q1')) is None
+
+    def test_key_reuse_for_another_request_is_rejected(self):
+        store = IdempotencyStore(maxsize=10, ttl=60)
+        store.save(1, 'k1', ('complete', 'q1'), 200, {'success': True})
+        with pytest.raises(IdempotencyKeyReused):
+            store.get(1, 'k1', ('complete', 'q2'))
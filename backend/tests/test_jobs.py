@@ -0,0 +1,184 @@
+"""
+Outbound job queue tests
+Run against the in-memory job store, no database or network needed
+"""
+import asyncio
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from jobs import JobQueue, MemoryJobStore, utcnow  # noqa: E402
+
+
+def make_queue(**kwargs):
+    store = MemoryJobStore()
+    return JobQueue(store, base_backoff=0, max_backoff=0, **kwargs), store
+
+
+def make_due(store):
+    """Pretend the backoff delay has elapsed"""
+    for job in store.jobs.values():
+        job['run_at'] = utcnow() - timedelta(seconds=1)
+
+
+class TestJobQueue:
+    """Job lifecycle tests"""
+
+    def test_job_completes(self):
+        """Test a successful handler marks the job completed"""
+        queue, store = make_queue()
+        received = []
+
+        async def handler(payload):
+            received.append(payload)
+
+        async def scenario():
+            queue.register('ping', handler)
+            job_id = await queue.enqueue('ping', {'n': 1})
+            assert await queue.run_once() == 1
+            return job_id
+
+        job_id = asyncio.run(scenario())
+        assert received == [{'n': 1}]
+        assert store.jobs[job_id]['status'] == 'completed'
+        assert store.jobs[job_id]['attempts'] == 1
+
+    def test_failed_job_is_retried_then_dead_lettered(self):
+        """Test failures are retried up to max_attempts and then dead-lettered"""
+        queue, store = make_queue()
+        dead_letters = []
+
+        async def handler(payload):
+            raise RuntimeError("n8n is down")
+
+        async def on_dead(payload, error):
+            dead_letters.append((payload, error))
+
+        async def scenario():
+            queue.register('avatar_generation', handler, on_dead=on_dead)
+            job_id = await queue.enqueue('avatar_generation', {'user_id': 'u1'}, max_attempts=3)
+            for _ in range(3):
+                make_due(store)
+                await queue.run_once()
+            return job_id
+
+        job_id = asyncio.run(scenario())
+        job = store.jobs[job_id]
+        assert job['status'] == 'dead'
+        assert job['attempts'] == 3
+        assert "n8n is down" in job['last_error']
+        assert dead_letters == [({'user_id': 'u1'}, job['last_error'])]
+
+    def test_retry_waits_for_backoff(self):
+        """Test a failed job is not claimed again before its retry time"""
+        store = MemoryJobStore()
+        queue = JobQueue(store, base_backoff=60, max_backoff=60)
+
+        async def handler(payload):
+            raise RuntimeError("timeout")
+
+        async def scenario():
+            queue.register('ping', handler)
+            await queue.enqueue('ping', {})
+            assert await queue.run_once() == 1
+            assert await queue.run_once() == 0
+
+        asyncio.run(scenario())
+
+    def test_dedupe_key(self):
+        """Test jobs with the same dedupe key are stored once"""
+        queue, store = make_queue()
+
+        async def scenario():
+            await queue.enqueue('goal_notification', {'goal_id': 'g1'}, dedupe_key='goal_notification:g1')
+            await queue.enqueue('goal_notification', {'goal_id': 'g1'}, dedupe_key='goal_notification:g1')
+
+        asyncio.run(scenario())
+        assert len(store.jobs) == 1
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test a running job abandoned by a dead worker is claimed again"""
+        store = MemoryJobStore()
+        queue = JobQueue(store, lease_seconds=30)
+
+        async def scenario():
+            job_id = await queue.enqueue('ping', {})
+            claimed = await store.claim(10, 30)
+            assert [job['id'] for job in claimed] == [job_id]
+            assert await store.claim(10, 30) == []
+            store.jobs[job_id]['locked_at'] = utcnow() - timedelta(seconds=31)
+            reclaimed = await store.claim(10, 30)
+            assert reclaimed[0]['attempts'] == 2
+
+        asyncio.run(scenario())
+
+    def test_backoff_is_exponential_and_capped(self):
+        """Test backoff grows exponentially and never exceeds the cap"""
+        queue = JobQueue(MemoryJobStore(), base_backoff=5, max_backoff=60)
+        assert 2.5 <= queue.backoff(1) <= 5
+        assert 10 <= queue.backoff(3) <= 20
+        assert queue.backoff(10) <= 60
+
+    def test_stop_after_enqueue(self):
+        """Test stop() returns even when an enqueue just woke the workers"""
+        queue, store = make_queue(workers=4, poll_interval=0.05)
+        attempts = []
+
+        async def handler(payload):
+            attempts.append(payload)
+            raise RuntimeError("send failed")
+
+        async def scenario():
+            queue.register('ping', handler)
+            queue.start()
+            await asyncio.sleep(0)
+            await queue.enqueue('ping', {'n': 1})
+            await asyncio.wait_for(queue.stop(), timeout=2)
+            ran = len(attempts)
+            make_due(store)
+            await asyncio.sleep(0.2)
+            return ran
+
+        ran_at_stop = asyncio.run(scenario())
+        assert len(attempts) == ran_at_stop <= 1
+        assert queue._tasks == []
+
+
+class TestAvatarGenerationJob:
+    """The avatar_generation handler against the in-memory Supabase stand-in"""
+
+    @pytest.fixture
+    def server(self, monkeypatch):
+        pytest.importorskip('fastapi')
+        pytest.importorskip('supabase')
+        monkeypatch.setenv('SUPABASE_URL', os.environ.get('SUPABASE_URL', 'http://localhost:54321'))
+        monkeypatch.setenv('SUPABASE_KEY', os.environ.get('SUPABASE_KEY', 'test-key'))
+        monkeypatch.setenv('N8N_WEBHOOK_URL', 'https://n8n.example.com/webhook/avatar')
+        import server
+        from fake_supabase import FakeSupabase
+        monkeypatch.setattr(server, 'supabase', FakeSupabase())
+        return server
+
+    def test_callback_before_post_response_stays_completed(self, server, monkeypatch):
+        """Test an n8n callback that lands before the POST returns is not overwritten with processing"""
+        fake = server.supabase
+        user = fake.insert_row('users', {'tg_id': 42})
+        generation = fake.insert_row('avatar_generations', {'user_id': user['id'], 'level': 5, 'generation_status': 'pending'})
+
+        class CallbackFirstN8n:
+            async def post(self, url, json):
+                fake.rpc_ingest_avatar(user['id'], 'https://project.supabase.co/a.png', 5, json['generation_id'])
+                return type('Response', (), {'status_code': 200, 'raise_for_status': lambda self: None})()
+
+        monkeypatch.setattr(type(server.outbound_http), 'n8n', property(lambda self: CallbackFirstN8n()))
+        asyncio.run(server.run_avatar_generation_job({
+            'generation_id': generation['id'], 'user_id': user['id'], 'tg_id': 42
+        }))
+
+        assert fake._first('avatar_generations', id=generation['id'])['generation_status'] == 'completed'
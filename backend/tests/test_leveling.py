@@ -0,0 +1,65 @@
+"""
+Level curve tests
+Property checks that the cumulative table matches the old WHILE-loop leveling
+"""
+import random
+import sys
+from decimal import Decimal, ROUND_FLOOR
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from leveling import (  # noqa: E402
+    CUMULATIVE_XP, MAX_LEVEL, XP_REQUIRED, goal_progress, level_for_total_xp, project_level_up
+)
+
+
+def legacy_add_xp(state, xp_amount):
+    """The loop add_xp_and_check_level used, with NUMERIC-exact powers"""
+    current_xp, level, next_level_xp = state
+    current_xp += xp_amount
+    leveled_up = False
+    while current_xp >= next_level_xp:
+        current_xp -= next_level_xp
+        level += 1
+        next_level_xp = int((Decimal(100) * Decimal('1.05') ** (level - 1)).to_integral_value(ROUND_FLOOR))
+        leveled_up = True
+    return (current_xp, level, next_level_xp), leveled_up
+
+
+class TestLevelCurve:
+    """Closed-form lookup versus the incremental loop"""
+
+    def test_matches_legacy_loop_for_random_xp_streams(self):
+        """Test any sequence of XP grants lands on the same level, XP and next threshold"""
+        rng = random.Random(20260101)
+        for _ in range(200):
+            state = (0, 1, 100)
+            total_xp = 0
+            for _ in range(rng.randint(1, 60)):
+                amount = rng.choice([rng.randint(1, 60), rng.randint(100, 5000)])
+                before = level_for_total_xp(total_xp)
+                state, leveled_up = legacy_add_xp(state, amount)
+                projected = project_level_up(total_xp, amount)
+                total_xp += amount
+                assert tuple(level_for_total_xp(total_xp)) == (state[1], state[0], state[2])
+                assert projected.leveled_up == leveled_up
+                assert projected.levels_gained == state[1] - before.level
+
+    def test_level_boundaries(self):
+        """Test the level changes exactly at each cumulative threshold"""
+        for level in range(2, 120):
+            assert level_for_total_xp(CUMULATIVE_XP[level]).level == level
+            assert level_for_total_xp(CUMULATIVE_XP[level] - 1).level == level - 1
+            assert level_for_total_xp(CUMULATIVE_XP[level]).current_xp == 0
+
+    def test_table_is_monotonic_and_fits_integer_total_xp(self):
+        """Test thresholds grow and the table covers every INTEGER total_xp"""
+        assert XP_REQUIRED[1] == 100
+        assert all(XP_REQUIRED[level] <= XP_REQUIRED[level + 1] for level in range(1, MAX_LEVEL))
+        assert all(CUMULATIVE_XP[level] < CUMULATIVE_XP[level + 1] for level in range(1, MAX_LEVEL))
+        assert CUMULATIVE_XP[MAX_LEVEL] >= 2 ** 31 - 1
+
+    def test_goal_progress(self):
+        assert goal_progress(5, 10) == 50
+        assert goal_progress(3, None) == 30
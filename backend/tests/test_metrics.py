@@ -0,0 +1,57 @@
+"""
+Metrics exposition tests
+Pure in-process checks of the Prometheus text output and query labelling
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from metrics import Counter, Gauge, Histogram  # noqa: E402
+from db import describe_query  # noqa: E402
+
+
+class FakeBuilder:
+    def __init__(self, path, http_method, headers=None):
+        self.path = path
+        self.http_method = http_method
+        self.headers = headers or {}
+
+
+class TestMetrics:
+    """Counter, gauge and histogram rendering tests"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test observations land in every bucket at or above their value"""
+        histogram = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, route='/a')
+        histogram.observe(0.5, route='/a')
+        histogram.observe(5, route='/a')
+        lines = histogram.render()
+
+        assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{route="/a",le="1"} 2' in lines
+        assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+        assert 'latency_seconds_count{route="/a"} 3' in lines
+        assert '# TYPE latency_seconds histogram' in lines
+
+    def test_counter_and_gauge_labels(self):
+        """Test label values are escaped and gauges go up and down"""
+        counter = Counter('requests_total', 'Requests', ('route',))
+        counter.inc(route='/say "hi"')
+        gauge = Gauge('in_flight', 'In flight', ('route',))
+        gauge.inc(route='/a')
+        gauge.inc(route='/a')
+        gauge.dec(route='/a')
+
+        assert 'requests_total{route="/say \\"hi\\""} 1' in counter.render()
+        assert 'in_flight{route="/a"} 1' in gauge.render()
+
+    def test_describe_query(self):
+        """Test PostgREST builders are labelled with their operation and target"""
+        assert describe_query(FakeBuilder('/users', 'GET')) == ('select', 'users')
+        assert describe_query(FakeBuilder('/rpc/complete_quest', 'POST')) == ('rpc', 'complete_quest')
+        assert describe_query(FakeBuilder('/user_quests', 'POST')) == ('insert', 'user_quests')
+        upsert = FakeBuilder('/user_quests', 'POST', {'prefer': 'resolution=merge-duplicates'})
+        assert describe_query(upsert) == ('upsert', 'user_quests')
+        assert describe_query(FakeBuilder('/goals', 'PATCH')) == ('update', 'goals')
@@ -0,0 +1,125 @@
+"""
+Goal notification dispatcher tests
+Uses a recording stand-in for the Supabase client, no database or network needed
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from notifications import GoalNotificationDispatcher  # noqa: E402
+
+
+class RecordingQuery:
+    def __init__(self, log, table):
+        self.log = log
+        self.call = {'table': table}
+
+    def update(self, values):
+        self.call['update'] = values
+        return self
+
+    def in_(self, column, values):
+        self.call['in'] = (column, list(values))
+        return self
+
+    def execute(self):
+        self.log.append(self.call)
+        return self
+
+
+class RecordingSupabase:
+    def __init__(self):
+        self.log = []
+
+    def table(self, name):
+        return RecordingQuery(self.log, name)
+
+
+class TestGoalNotificationDispatcher:
+    """Batching and failure handling tests"""
+
+    def test_batch_is_marked_notified_in_one_write(self):
+        """Test delivered goals get notified_at with a single UPDATE"""
+        supabase = RecordingSupabase()
+        sent = []
+
+        async def send(event):
+            sent.append(event['goal_id'])
+
+        dispatcher = GoalNotificationDispatcher(supabase, send)
+        dispatcher.emit(1, [{'id': 'g1', 'goal_text': 'Bike'}, {'id': 'g2', 'goal_text': None}], 5)
+        dispatcher.emit(2, [{'id': 'g3', 'goal_text': 'Trip'}], 7)
+        asyncio.run(dispatcher.flush())
+
+        assert sorted(sent) == ['g1', 'g2', 'g3']
+        assert len(supabase.log) == 1
+        assert supabase.log[0]['table'] == 'goals'
+        assert supabase.log[0]['in'] == ('id', ['g1', 'g2', 'g3'])
+
+    def test_duplicate_events_are_collapsed(self):
+        """Test a goal emitted twice before a flush is sent once"""
+        supabase = RecordingSupabase()
+        sent = []
+
+        async def send(event):
+            sent.append(event['goal_id'])
+
+        dispatcher = GoalNotificationDispatcher(supabase, send)
+        dispatcher.emit(1, [{'id': 'g1'}], 5)
+        dispatcher.emit(1, [{'id': 'g1'}], 6)
+        asyncio.run(dispatcher.flush())
+
+        assert sent == ['g1']
+
+    def test_failed_send_goes_to_retry_and_is_claimed(self):
+        """Test failed sends are handed to on_failure and claimed instead of marked notified"""
+        supabase = RecordingSupabase()
+        retried = []
+
+        async def send(event):
+            if event['goal_id'] == 'g2':
+                raise RuntimeError("429 Too Many Requests")
+
+        async def on_failure(event):
+            retried.append(event['goal_id'])
+
+        dispatcher = GoalNotificationDispatcher(supabase, send, on_failure=on_failure)
+        dispatcher.emit(1, [{'id': 'g1'}, {'id': 'g2'}], 5)
+        delivered = asyncio.run(dispatcher.flush())
+
+        assert delivered == 1
+        assert retried == ['g2']
+        writes = {tuple(call['update']): call['in'] for call in supabase.log}
+        assert writes == {('notified_at',): ('id', ['g1']), ('notify_claimed_at',): ('id', ['g2'])}
+
+    def test_written_users_are_reported(self):
+        """Test on_written gets each user whose goals were stamped, once per flush"""
+        supabase = RecordingSupabase()
+        written = []
+
+        async def send(event):
+            pass
+
+        dispatcher = GoalNotificationDispatcher(supabase, send, on_written=written.append)
+        dispatcher.emit(1, [{'id': 'g1'}, {'id': 'g2'}], 5)
+        dispatcher.emit(2, [{'id': 'g3'}], 5)
+        asyncio.run(dispatcher.flush())
+
+        assert sorted(written) == [1, 2]
+
+    def test_failed_handoff_is_not_claimed(self):
+        """Test a goal whose retry could not be queued stays open for the next completion"""
+        supabase = RecordingSupabase()
+
+        async def send(event):
+            raise RuntimeError("timeout")
+
+        async def on_failure(event):
+            raise RuntimeError("database down")
+
+        dispatcher = GoalNotificationDispatcher(supabase, send, on_failure=on_failure)
+        dispatcher.emit(1, [{'id': 'g1'}], 5)
+        assert asyncio.run(dispatcher.flush()) == 0
+        assert supabase.log == []
@@ -0,0 +1,78 @@
+"""
+Keyset pagination helper tests
+Pure in-process checks of cursors, page splitting and sparse fieldsets
+"""
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pagination import (  # noqa: E402
+    InvalidCursor, InvalidFields, decode_cursor, encode_cursor, keyset_page, select_fields, split_page
+)
+
+
+class RecordingQuery:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return record
+
+
+class TestPagination:
+    """Cursor, page and fieldset tests"""
+
+    def test_cursor_round_trip(self):
+        row = {'id': 'b5f0c1d2-0000-4000-8000-000000000001', 'created_at': '2026-03-01T10:00:00.123456+00:00'}
+        cursor = encode_cursor(row)
+        assert '=' not in cursor
+        assert decode_cursor(cursor) == (row['created_at'], row['id'])
+
+    def test_invalid_cursor(self):
+        with pytest.raises(InvalidCursor):
+            decode_cursor('not-a-cursor')
+
+    def test_tampered_cursor_rejected(self):
+        """Test cursor values that would inject PostgREST filter terms are refused"""
+        valid_id = 'b5f0c1d2-0000-4000-8000-000000000001'
+        for created_at, row_id in [
+            ('2026-01-01T00:00:00+00:00', '1),user_id.neq.0'),
+            ('2026-01-01",is_completed.eq.true', valid_id),
+            ('yesterday', valid_id),
+            (12345, valid_id),
+        ]:
+            with pytest.raises(InvalidCursor):
+                decode_cursor(encode_cursor({'created_at': created_at, 'id': row_id}))
+
+    def test_split_page(self):
+        ids = [str(uuid.UUID(int=i)) for i in range(4)]
+        rows = [{'id': ids[i], 'created_at': f'2026-01-0{9 - i}'} for i in range(4)]
+        page, cursor = split_page(rows, 3)
+        assert [row['id'] for row in page] == ids[:3]
+        assert decode_cursor(cursor) == ('2026-01-07', ids[2])
+        assert split_page(rows[:2], 3) == (rows[:2], None)
+
+    def test_keyset_page_filters_after_cursor(self):
+        """Test the next page asks for rows strictly older than the cursor row"""
+        query = RecordingQuery()
+        row_id = 'b5f0c1d2-0000-4000-8000-000000000001'
+        cursor = encode_cursor({'id': row_id, 'created_at': '2026-01-01T00:00:00+00:00'})
+        keyset_page(query, cursor, 20)
+        names = [name for name, _, _ in query.calls]
+        assert names == ['or_', 'order', 'order', 'limit']
+        assert f'id.lt."{row_id}"' in query.calls[0][1][0]
+        assert query.calls[-1][1] == (21,)
+
+    def test_select_fields(self):
+        allowed = ['id', 'goal_text', 'goal_level', 'created_at']
+        assert select_fields(None, allowed) == '*'
+        assert select_fields('goal_text,goal_level', allowed) == 'id, created_at, goal_text, goal_level'
+        with pytest.raises(InvalidFields):
+            select_fields('goal_text,user_id', allowed)
@@ -0,0 +1,50 @@
+"""
+user_quests retention tests
+Runs the maintenance job against the in-memory Supabase port
+"""
+import asyncio
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from retention import UserQuestsRetention  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+
+
+class FailingRpc:
+    def execute(self):
+        raise RuntimeError("function maintain_user_quests does not exist")
+
+
+class FailingSupabase:
+    def rpc(self, name, params=None):
+        return FailingRpc()
+
+
+class TestUserQuestsRetention:
+    """Archival of expired completions into the daily rollups"""
+
+    def test_expired_completions_are_folded_into_rollups(self):
+        fake = FakeSupabase()
+        user = fake.table('users').insert({'tg_id': 1}).execute().data[0]
+        quest = fake.table('quests').select('*').limit(1).execute().data[0]
+        old_day = (date.today() - timedelta(days=200)).isoformat()
+        today = date.today().isoformat()
+        for day in (old_day, today):
+            fake.table('user_quests').insert({'user_id': user['id'], 'quest_id': quest['id'], 'completion_date': day}).execute()
+
+        result = asyncio.run(UserQuestsRetention(fake, keep_months=3).run_once())
+
+        remaining = fake.table('user_quests').select('completion_date').execute().data
+        rollup = fake.table('user_daily_stats').select('*').eq('stat_date', old_day).execute().data
+        assert [row['completion_date'] for row in remaining] == [today]
+        assert result['archived'] == [f"user_quests_{old_day[:7].replace('-', '_')}"]
+        assert rollup[0]['quest_count'] == 1 and rollup[0]['xp'] == quest['xp_reward']
+
+    def test_failure_is_logged_not_raised(self):
+        retention = UserQuestsRetention(FailingSupabase())
+        assert asyncio.run(retention.run_once()) is None
+        assert retention.last_result is None
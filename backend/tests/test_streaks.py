@@ -0,0 +1,64 @@
+"""
+Streak engine tests
+Incremental streak updates checked against replaying the active days
+"""
+import random
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from streaks import Streak, advance, current_streak, daily_history, streak_from_days  # noqa: E402
+
+START = date(2026, 1, 1)
+
+
+def longest_run(days):
+    """Brute-force longest run of consecutive days"""
+    best = 0
+    for day in days:
+        length = 0
+        while day + timedelta(days=length) in days:
+            length += 1
+        best = max(best, length)
+    return best
+
+
+class TestStreaks:
+    """Incremental streak and history tests"""
+
+    def test_consecutive_days_extend_and_gaps_restart(self):
+        streak = Streak()
+        for offset in (0, 1, 1, 2, 5, 6):
+            streak = advance(streak, START + timedelta(days=offset))
+        assert streak == Streak(2, 3, START + timedelta(days=6))
+
+    def test_late_write_for_an_earlier_day_is_ignored(self):
+        streak = streak_from_days([START, START + timedelta(days=1)])
+        assert advance(streak, START) == streak
+
+    def test_current_streak_breaks_after_a_missed_day(self):
+        streak = streak_from_days([START, START + timedelta(days=1)])
+        assert current_streak(streak, START + timedelta(days=1)) == 2
+        assert current_streak(streak, START + timedelta(days=2)) == 2
+        assert current_streak(streak, START + timedelta(days=3)) == 0
+        assert current_streak(Streak(), START) == 0
+
+    def test_matches_replay_for_random_calendars(self):
+        """Test best streak equals the longest run of any random set of active days"""
+        rng = random.Random(20260301)
+        for _ in range(200):
+            days = {START + timedelta(days=rng.randint(0, 60)) for _ in range(rng.randint(1, 40))}
+            streak = Streak()
+            for day in sorted(days):
+                streak = advance(streak, day)
+            assert streak.best == longest_run(days)
+            assert streak.last_date == max(days)
+
+    def test_daily_history_zero_fills(self):
+        rows = [{'stat_date': '2026-01-02', 'quest_count': 3, 'xp': 60}]
+        history = daily_history(rows, START, START + timedelta(days=2))
+        assert [day['date'] for day in history] == ['2026-01-01', '2026-01-02', '2026-01-03']
+        assert [day['quest_count'] for day in history] == [0, 3, 0]
+        assert history[1]['xp'] == 60
@@ -0,0 +1,117 @@
+"""
+Bot webhook intake tests
+Drives TelegramWebhook with a stub PTB application
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram_webhook import TelegramWebhook  # noqa: E402
+
+
+class StubBot:
+    def __init__(self):
+        self.set_calls = []
+
+    async def set_webhook(self, **kwargs):
+        self.set_calls.append(kwargs)
+
+
+class StubApplication:
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_queue = asyncio.Queue()
+        self.events = []
+
+    async def initialize(self):
+        self.events.append('initialize')
+
+    async def start(self):
+        self.events.append('start')
+
+    async def stop(self):
+        self.events.append('stop')
+
+    async def shutdown(self):
+        self.events.append('shutdown')
+
+
+def make_webhook(bot=None, **kwargs):
+    app = StubApplication(bot or StubBot())
+    options = dict(url='https://example.com/api/telegram/webhook', secret='s3cret', enabled=True,
+                   decode=lambda data, bot: data if data.get('update_id') else None)
+    options.update(kwargs)
+    return TelegramWebhook(lambda: app, ['message'], **options), app
+
+
+class TestVerify:
+    """Only the configured secret token is accepted"""
+
+    def test_secret_token(self):
+        webhook, _ = make_webhook()
+        assert webhook.verify('s3cret')
+        assert not webhook.verify('wrong')
+        assert not webhook.verify(None)
+
+    def test_no_secret_rejects_everything(self):
+        webhook, _ = make_webhook(secret=None)
+        assert not webhook.verify('')
+        assert not webhook.verify(None)
+
+
+class TestLifecycle:
+    """Every startup registers the webhook, shutdown leaves it in place"""
+
+    def test_disabled_is_noop(self):
+        webhook, app = make_webhook(enabled=False)
+        asyncio.run(webhook.start())
+        assert webhook.application is None and app.events == []
+        assert webhook.pending == 0
+
+    def test_sets_webhook(self):
+        bot = StubBot()
+        webhook, app = make_webhook(bot)
+
+        async def run():
+            await webhook.start()
+            await webhook.stop()
+
+        asyncio.run(run())
+        assert app.events == ['initialize', 'start', 'stop', 'shutdown']
+        assert len(bot.set_calls) == 1
+        assert bot.set_calls[0]['secret_token'] == 's3cret'
+        assert bot.set_calls[0]['allowed_updates'] == ['message']
+
+    def test_rotated_secret_is_registered(self):
+        """Telegram never reports the secret, so an unchanged URL must not skip setWebhook"""
+        bot = StubBot()
+        webhook, _ = make_webhook(bot, secret='rotated')
+        asyncio.run(webhook.start())
+        assert [call['secret_token'] for call in bot.set_calls] == ['rotated']
+
+    def test_missing_config_fails_fast(self):
+        webhook, _ = make_webhook(url=None)
+        with pytest.raises(RuntimeError):
+            asyncio.run(webhook.start())
+
+
+class TestFeed:
+    """Updates are queued for the handlers, not processed inline"""
+
+    def test_feed_enqueues(self):
+        webhook, app = make_webhook()
+
+        async def run():
+            await webhook.start()
+            await webhook.feed({'update_id': 1})
+            await webhook.feed({'update_id': 2})
+            await webhook.feed({})  # undecodable update is dropped
+            return webhook.pending, await app.update_queue.get()
+
+        pending, first = asyncio.run(run())
+        assert pending == 2
+        assert first == {'update_id': 1}
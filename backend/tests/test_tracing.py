@@ -0,0 +1,81 @@
+"""
+Query tracing tests
+Runs fake PostgREST builders through run_query, no database needed
+"""
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import run_query, run_queries, shutdown_executor  # noqa: E402
+from tracing import current_trace, report, trace_queries  # noqa: E402
+
+
+class FakeBuilder:
+    def __init__(self, path, http_method='GET'):
+        self.path = path
+        self.http_method = http_method
+        self.headers = {}
+
+    def execute(self):
+        return {'path': self.path}
+
+
+class TestQueryTracing:
+    """Recording, isolation and budget tests"""
+
+    def test_queries_are_recorded_in_order(self):
+        """Test every run_query call inside a trace is counted with its target"""
+        async def handler():
+            await run_query(FakeBuilder('/users'))
+            await run_queries(FakeBuilder('/user_quests'), FakeBuilder('/goals'))
+            await run_query(FakeBuilder('/rpc/complete_quest', 'POST'))
+
+        with trace_queries() as trace:
+            asyncio.run(handler())
+
+        assert trace.count == 4
+        assert trace.calls()[0] == 'select:users'
+        assert trace.calls()[-1] == 'rpc:complete_quest'
+        assert sorted(trace.calls()[1:3]) == ['select:goals', 'select:user_quests']
+        assert 'desc="4 queries"' in trace.server_timing()
+
+    def test_queries_outside_a_trace_are_ignored(self):
+        """Test run_query works without an open trace and traces do not leak"""
+        asyncio.run(run_query(FakeBuilder('/users')))
+        with trace_queries():
+            pass
+        assert current_trace() is None
+
+    def test_queries_run_after_executor_shutdown(self):
+        """Test a second app lifespan in the same process can query after the first shut the pool down"""
+        asyncio.run(run_query(FakeBuilder('/users')))
+        shutdown_executor()
+        assert asyncio.run(run_query(FakeBuilder('/users'))) == {'path': '/users'}
+        shutdown_executor()
+
+    def test_budget_warning(self, caplog):
+        """Test a request over the round-trip budget logs a warning"""
+        async def handler():
+            for _ in range(3):
+                await run_query(FakeBuilder('/users'))
+
+        with trace_queries() as trace:
+            asyncio.run(handler())
+
+        with caplog.at_level(logging.DEBUG, logger='lifequest.queries'):
+            report(trace, 'POST', '/api/users/{tg_id}/quests/complete', 200, budget=2)
+        assert any(record.levelno == logging.WARNING for record in caplog.records)
+        assert '"query_count": 3' in caplog.text
+
+    def test_within_budget_is_logged_at_info(self, caplog):
+        """Test every request's query line reaches the default INFO log level"""
+        with trace_queries() as trace:
+            asyncio.run(run_query(FakeBuilder('/users')))
+
+        with caplog.at_level(logging.INFO, logger='lifequest.queries'):
+            report(trace, 'GET', '/api/users/{tg_id}', 200, budget=2)
+        assert [record.levelno for record in caplog.records] == [logging.INFO]
+        assert '"query_count": 1' in caplog.text
@@ -0,0 +1,94 @@
+"""Per-request tracing of Supabase round trips
+
+``trace_queries()`` opens a ``QueryTrace`` bound to the current context;
+``run_query`` records every PostgREST call made while it is open with its
+operation, table/RPC and duration. The HTTP middleware wraps each request in
+one, so N+1 patterns show up as a query count in the ``Server-Timing``
+header, a structured log line and a warning once a request goes over
+``QUERY_BUDGET_PER_REQUEST`` round trips. Tests can open a trace directly and
+assert on ``trace.count``.
+"""
+import os
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+
+QUERY_BUDGET_PER_REQUEST = int(os.environ.get('QUERY_BUDGET_PER_REQUEST', '8'))
+
+logger = logging.getLogger('lifequest.queries')
+
+
+@dataclass
+class QueryRecord:
+    operation: str
+    target: str
+    duration: float
+
+
+@dataclass
+class QueryTrace:
+    queries: List[QueryRecord] = field(default_factory=list)
+
+    def record(self, operation: str, target: str, duration: float) -> None:
+        self.queries.append(QueryRecord(operation, target, duration))
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(query.duration for query in self.queries)
+
+    def calls(self) -> List[str]:
+        """``operation:target`` per query in call order, e.g. ``select:users``"""
+        return [f"{query.operation}:{query.target}" for query in self.queries]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.total_seconds * 1000:.1f};desc="{self.count} queries"'
+
+    def log_line(self, method: str, route: str, status_code: int) -> str:
+        return json.dumps({
+            'event': 'request_queries',
+            'method': method,
+            'route': route,
+            'status': status_code,
+            'query_count': self.count,
+            'db_ms': round(self.total_seconds * 1000, 1),
+            'queries': self.calls()
+        }, ensure_ascii=False)
+
+
+_current_trace: ContextVar[Optional[QueryTrace]] = ContextVar('query_trace', default=None)
+
+
+def current_trace() -> Optional[QueryTrace]:
+    return _current_trace.get()
+
+
+def record_query(operation: str, target: str, duration: float) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(operation, target, duration)
+
+
+@contextmanager
+def trace_queries() -> Iterator[QueryTrace]:
+    trace = QueryTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def report(trace: QueryTrace, method: str, route: str, status_code: int, budget: int = QUERY_BUDGET_PER_REQUEST) -> None:
+    """Log the request's query summary, as a warning when it is over budget"""
+    line = trace.log_line(method, route, status_code)
+    if budget and trace.count > budget:
+        logger.warning(f"Query budget exceeded ({trace.count} > {budget}): {line}")
+    else:
+        logger.info(line)
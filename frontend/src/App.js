@@ -54,24 +54,43 @@ function App() {
   const [tgUser, setTgUser] = useState(null);
   const [user, setUser] = useState(null);
   const [progress, setProgress] = useState(null);
+  // Bootstrap payload (quests, goals, daily XP) handed to the home screen
+  const [home, setHome] = useState(null);
   const [showOnboarding, setShowOnboarding] = useState(false);
   const [isGeneratingAvatar, setIsGeneratingAvatar] = useState(false);
   const [initError, setInitError] = useState('');
   const backendUrl = process.env.REACT_APP_BACKEND_URL;
   const forceOnboarding = typeof window !== 'undefined' && window.location.search.includes('onboarding=1');
 
+  // User, progress and the home screen data in one request
+  const loadBootstrap = React.useCallback(async (tgId) => {
+    const data = await api.getBootstrap(tgId);
+    setUser(data.user);
+    setProgress(data.progress || defaultProgress);
+    setHome(data);
+    return data;
+  }, []);
+
   const initializeUser = React.useCallback(async (telegramUser) => {
     try {
-      // Register or get existing user
-      const userData = await api.registerUser({
-        tg_id: telegramUser.id,
-        username: telegramUser.username,
-        first_name: telegramUser.first_name,
-        last_name: telegramUser.last_name,
-        language_code: telegramUser.language_code || 'en',
-      });
-
-      setUser(userData);
+      let data;
+      try {
+        data = await loadBootstrap(telegramUser.id);
+      } catch (error) {
+        if (error.response?.status !== 404) {
+          throw error;
+        }
+        // First open: register, then load the new user's home screen
+        await api.registerUser({
+          tg_id: telegramUser.id,
+          username: telegramUser.username,
+          first_name: telegramUser.first_name,
+          last_name: telegramUser.last_name,
+          language_code: telegramUser.language_code || 'en',
+        });
+        data = await loadBootstrap(telegramUser.id);
+      }
+      const userData = data.user;
 
       // Check if onboarding is needed
       if (!userData.age || !userData.gender) {
@@ -80,11 +99,7 @@ function App() {
       } else if (!userData.avatar_url) {
         setShowOnboarding(false);
         setIsGeneratingAvatar(true);
-        const progressData = await api.getProgress(telegramUser.id);
-        setProgress(progressData || defaultProgress);
       } else {
-        const progressData = await api.getProgress(telegramUser.id);
-        setProgress(progressData || defaultProgress);
         setIsGeneratingAvatar(false);
       }
 
@@ -94,11 +109,12 @@ function App() {
       setInitError('Не удалось подключиться к backend');
       setUser(null);
       setProgress(null);
+      setHome(null);
       setShowOnboarding(false);
     } finally {
       setLoading(false);
     }
-  }, []);
+  }, [loadBootstrap]);
 
   useEffect(() => {
     if (!backendUrl) {
@@ -156,11 +172,11 @@ function App() {
         if (!isActive) {
           return;
         }
-        setUser(userData);
         if (userData.avatar_url) {
-          const progressData = await api.getProgress(tgUser.id);
-          setProgress(progressData || defaultProgress);
+          await loadBootstrap(tgUser.id);
           setIsGeneratingAvatar(false);
+        } else {
+          setUser(userData);
         }
       } catch (error) {
         console.error('Error polling avatar status:', error);
@@ -170,7 +186,7 @@ function App() {
       isActive = false;
       clearInterval(interval);
     };
-  }, [tgUser, user, showOnboarding, isGeneratingAvatar]);
+  }, [tgUser, user, showOnboarding, isGeneratingAvatar, loadBootstrap]);
 
   const handleOnboardingComplete = async (onboardingData) => {
     try {
@@ -179,12 +195,8 @@ function App() {
       // Complete onboarding
       await api.completeOnboarding(tgUser.id, onboardingData);
       
-      // Reload user and progress
-      const userData = await api.getUser(tgUser.id);
-      const progressData = await api.getProgress(tgUser.id);
-      
-      setUser(userData);
-      setProgress(progressData || defaultProgress);
+      // Reload user, progress and the home screen
+      const { user: userData } = await loadBootstrap(tgUser.id);
       setShowOnboarding(false);
       if (!userData.avatar_url) {
         setIsGeneratingAvatar(true);
@@ -203,11 +215,7 @@ function App() {
 
   const handleRefresh = async () => {
     try {
-      const userData = await api.getUser(tgUser.id);
-      const progressData = await api.getProgress(tgUser.id);
-      
-      setUser(userData);
-      setProgress(progressData || defaultProgress);
+      await loadBootstrap(tgUser.id);
     } catch (error) {
       console.error('Error refreshing data:', error);
     }
@@ -333,7 +341,7 @@ function App() {
   return (
     <div className="App">
       <ErrorBoundary>
-        <HomeScreen user={user} progress={progress} onRefresh={handleRefresh} onProgressUpdate={setProgress} />
+        <HomeScreen user={user} progress={progress} home={home} onRefresh={handleRefresh} onProgressUpdate={setProgress} />
       </ErrorBoundary>
     </div>
   );
@@ -1,10 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { Zap, Star, Crown, CheckCircle2, Circle, Trophy, Gift, Sparkles, Target } from 'lucide-react';
 import { HugeiconsIcon } from '@hugeicons/react';
 import { Dumbbell01Icon, HealthIcon, BrainIcon, ZapIcon } from '@hugeicons/core-free-icons';
 import { haptic } from '../lib/telegram';
-import { api } from '../lib/api';
+import { api, newIdempotencyKey } from '../lib/api';
+import { avatarSources, blurhashToDataUrl } from '../lib/avatar';
 import BottomNav from './BottomNav';
 import MenuModal from './MenuModal';
 import QuestConfirmModal from './QuestConfirmModal';
@@ -23,7 +24,7 @@ const BRANCH_BADGES = {
   longevity: { label: 'ДОЛГОЛЕТИЕ', className: 'border-emerald-400/60 text-emerald-300' },
 };
 
-export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate }) {
+export default function HomeScreen({ user, progress, home, onRefresh, onProgressUpdate }) {
   const [quests, setQuests] = useState([]);
   const [showProModal, setShowProModal] = useState(false);
   const [activeTab, setActiveTab] = useState('home');
@@ -33,6 +34,9 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
   const [levelUpData, setLevelUpData] = useState(null);
   const [processingQuestId, setProcessingQuestId] = useState(null);
   const [goals, setGoals] = useState([]);
+  const [completedGoalsCursor, setCompletedGoalsCursor] = useState(null);
+  const [archivedGoalsCursor, setArchivedGoalsCursor] = useState(null);
+  const [loadingMoreGoals, setLoadingMoreGoals] = useState(false);
   const [goalText, setGoalText] = useState('');
   const [goalLevel, setGoalLevel] = useState(10);
   const [savingGoal, setSavingGoal] = useState(false);
@@ -45,6 +49,8 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
   const [toast, setToast] = useState(null);
   const [achievedGoals, setAchievedGoals] = useState([]);
   const [heroImageReady, setHeroImageReady] = useState(false);
+  // quest id -> Idempotency-Key of its completion, kept until the server has answered
+  const completionKeys = useRef({});
   const safeProgress = progress || {
     current_level: 1,
     current_xp: 0,
@@ -53,13 +59,11 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
   };
 
   useEffect(() => {
-    if (user) {
-      loadQuests();
-      loadGoals();
-      loadDailyXp();
+    if (home) {
+      applyHome(home);
     }
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [user]);
+  }, [home]);
 
   useEffect(() => {
     if (!toast) {
@@ -69,18 +73,6 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
     return () => clearTimeout(timeout);
   }, [toast]);
 
-  const loadQuests = async () => {
-    try {
-      if (!user?.tg_id) {
-        return;
-      }
-      const data = await api.getQuests(user.tg_id);
-      setQuests(data);
-    } catch (error) {
-      console.error('Error loading quests:', error);
-    }
-  };
-
   const getNextLevelXp = (level) => Math.floor(100 * Math.pow(1.05, level - 1));
   const getTotalXpToLevel = (level) => {
     let total = 0;
@@ -171,8 +163,13 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
     }
     setConfirmQuest(null);
 
+    // A tap after a timeout resends the same key, so a completion that did land is not repeated
+    const idempotencyKey = completionKeys.current[questId] || newIdempotencyKey();
+    completionKeys.current[questId] = idempotencyKey;
+
     try {
-      const result = await api.completeQuest(user.tg_id, questId);
+      const result = await api.completeQuest(user.tg_id, questId, idempotencyKey);
+      delete completionKeys.current[questId];
 
       if (result.leveled_up) {
         haptic.success();
@@ -196,6 +193,10 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
 
       onRefresh();
     } catch (error) {
+      // 4xx answers are final for this key; timeouts and 5xx keep it for the next tap
+      if (error.response && error.response.status < 500) {
+        delete completionKeys.current[questId];
+      }
       setQuests(previousQuests);
       if (onProgressUpdate) {
         onProgressUpdate(previousProgress);
@@ -237,7 +238,7 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
       setGoalLevel(10);
       setEditingGoalId(null);
       setGoalErrors('');
-      await loadGoals();
+      await onRefresh();
       haptic.success();
       setToast({ type: 'success', message: 'Цель сохранена' });
     } catch (error) {
@@ -269,11 +270,13 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
       return;
     }
     try {
+      const now = new Date().toISOString();
       await api.updateGoal(user.tg_id, goalId, {
         is_completed: true,
-        completed_at: new Date().toISOString(),
+        completed_at: now,
+        archived_at: now,
       });
-      await loadGoals();
+      await onRefresh();
       setToast({ type: 'success', message: 'Цель перенесена в архив' });
     } catch (error) {
       console.error('Error archiving goal:', error);
@@ -287,7 +290,7 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
     }
     try {
       await api.completeGoal(user.tg_id, goalId);
-      await loadGoals();
+      await onRefresh();
       setToast({ type: 'success', message: 'Цель выполнена' });
     } catch (error) {
       console.error('Error completing goal:', error);
@@ -304,36 +307,52 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
     setAchievedGoals((current) => current.filter((goal) => goal.id !== goalId));
   };
 
-  const loadGoals = async () => {
-    try {
-      if (!user?.tg_id) {
-        return;
-      }
-      const data = await api.getGoals(user.tg_id);
-      setGoals(data);
-      const currentLevel = safeProgress.current_level || 1;
-      const pending = (data || []).filter(
-        (goal) => !goal.is_completed && (goal.goal_level || 1) <= currentLevel
-      );
-      pushAchievedGoals(pending);
-    } catch (error) {
-      console.error('Error loading goals:', error);
-    }
+  const applyGoals = (data, currentProgress) => {
+    setGoals(data);
+    const currentLevel = (currentProgress || safeProgress).current_level || 1;
+    const pending = (data || []).filter(
+      (goal) => !goal.is_completed && (goal.goal_level || 1) <= currentLevel
+    );
+    pushAchievedGoals(pending);
+  };
+
+  const applyDailyXp = (data) => {
+    setDailyXp(data?.daily_xp || 0);
+    setDailyQuestCount(data?.daily_quest_count || 0);
+    setBonusDailyXp(data?.bonus_xp || 0);
   };
 
-  const loadDailyXp = async () => {
+  // Archived goals are listed under "Выполнено" too; their pages follow the completed ones
+  const loadMoreCompletedGoals = async () => {
+    if (!user?.tg_id || (!completedGoalsCursor && !archivedGoalsCursor)) {
+      return;
+    }
+    setLoadingMoreGoals(true);
     try {
-      if (!user?.tg_id) {
-        return;
+      const status = completedGoalsCursor ? 'completed' : 'archived';
+      const cursor = completedGoalsCursor || archivedGoalsCursor;
+      const page = await api.getGoals(user.tg_id, { status, cursor });
+      setGoals((current) => [...current, ...page.items]);
+      if (status === 'completed') {
+        setCompletedGoalsCursor(page.nextCursor);
+      } else {
+        setArchivedGoalsCursor(page.nextCursor);
       }
-      const data = await api.getDailyXp(user.tg_id);
-      setDailyXp(data?.daily_xp || 0);
-      setDailyQuestCount(data?.daily_quest_count || 0);
-      setBonusDailyXp(data?.bonus_xp || 0);
     } catch (error) {
-      console.error('Error loading daily xp:', error);
+      console.error('Error loading more goals:', error);
+    } finally {
+      setLoadingMoreGoals(false);
     }
   };
+
+  // App loads the bootstrap payload (on open and on every refresh); goal changes refresh it too
+  const applyHome = (data) => {
+    setQuests(data.quests || []);
+    applyGoals(data.goals || [], data.progress);
+    setCompletedGoalsCursor(data.completed_goals_cursor || null);
+    setArchivedGoalsCursor(data.archived_goals_cursor || null);
+    applyDailyXp(data.daily_xp);
+  };
   
   const handleMenuAction = (action) => {
     haptic.medium();
@@ -346,12 +365,17 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
 
   const avatarUrl = typeof user?.avatar_url === 'string' ? user.avatar_url : '';
   const hasAvatar = avatarUrl && !avatarUrl.includes('placehold');
+  const heroSources = hasAvatar ? avatarSources(user) : [];
+  const avatarBlurhash = hasAvatar ? user?.avatar_blurhash : null;
+  const heroPlaceholder = useMemo(() => blurhashToDataUrl(avatarBlurhash), [avatarBlurhash]);
   const heroImage = hasAvatar
     ? avatarUrl
     : 'https://lh3.googleusercontent.com/aida-public/AB6AXuCIEAiT5xqJUM44W0D26T0YBOsEINF2oJTOe3WbCXezg0dOzJslrk-xlUauPYKGt-1XBgndbWAPYrl2Yl5KO-4r5r9UX91qHLGm0QVLdkG91QmLOhXnq1rlfj2aP-k8_hJB2Y6ZurQiTFKOC3SSrOEeRV10eKD6Im3nlGD09nhXoXCeCkOUrh0BECbaY5cgLrsSc85v3i-K5sAP5dD_giFc-YK6pmjwi3lTG2rP72FHAYXfjUOgHDKJKWQDuSs95MKutvoO8ia4X8M';
 
   useEffect(() => {
     setHeroImageReady(false);
+    // With variants the <picture> loads the best one itself; preloading the original would fetch it twice
+    if (heroSources.length > 0) return undefined;
     const image = new Image();
     image.src = heroImage;
     image.onload = () => setHeroImageReady(true);
@@ -360,7 +384,7 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
       image.onload = null;
       image.onerror = null;
     };
-  }, [heroImage]);
+  }, [heroImage, heroSources.length]);
 
   if (!user) {
     return (
@@ -393,16 +417,24 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
       {/* Home Tab - Avatar as Background */}
       {activeTab === 'home' && (
         <div className="flex-1 flex flex-col relative overflow-hidden">
-          <div className="absolute inset-0 z-0">
-            <img
-              src={heroImage}
-              alt="Hero Background"
-              className="w-full h-full object-cover object-center"
-              loading="eager"
-              decoding="async"
-              onLoad={() => setHeroImageReady(true)}
-              style={{ opacity: heroImageReady ? 1 : 0, transition: 'opacity 200ms ease-out' }}
-            />
+          <div
+            className="absolute inset-0 z-0 bg-cover bg-center"
+            style={heroPlaceholder ? { backgroundImage: `url(${heroPlaceholder})` } : undefined}
+          >
+            <picture>
+              {heroSources.map((source) => (
+                <source key={source.type} type={source.type} srcSet={source.srcSet} sizes="100vw" />
+              ))}
+              <img
+                src={heroImage}
+                alt="Hero Background"
+                className="w-full h-full object-cover object-center"
+                loading="eager"
+                decoding="async"
+                onLoad={() => setHeroImageReady(true)}
+                style={{ opacity: heroImageReady ? 1 : 0, transition: 'opacity 200ms ease-out' }}
+              />
+            </picture>
             <div className="absolute inset-0 bg-gradient-to-b from-black/70 via-black/10 to-black/80 pointer-events-none" />
           </div>
 
@@ -812,6 +844,15 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
                     </div>
                   ))}
                 </div>
+                {(completedGoalsCursor || archivedGoalsCursor) && (
+                  <button
+                    onClick={loadMoreCompletedGoals}
+                    disabled={loadingMoreGoals}
+                    className="text-xs text-slate-400"
+                  >
+                    {loadingMoreGoals ? 'Загрузка...' : 'Показать ещё'}
+                  </button>
+                )}
               </div>
             )}
 
@@ -894,7 +935,12 @@ export default function HomeScreen({ user, progress, onRefresh, onProgressUpdate
                 <div className="w-32 h-32 rounded-full bg-gradient-to-br from-[#FF6B35] to-[#4ECDC4] p-1 mx-auto mb-4">
                   <div className="w-full h-full rounded-full bg-slate-900 flex items-center justify-center overflow-hidden">
                     {hasAvatar ? (
-                      <img src={avatarUrl} alt="Avatar" className="w-full h-full object-cover object-top" loading="lazy" decoding="async" />
+                      <picture>
+                        {heroSources.map((source) => (
+                          <source key={source.type} type={source.type} srcSet={source.srcSet} sizes="128px" />
+                        ))}
+                        <img src={avatarUrl} alt="Avatar" className="w-full h-full object-cover object-top" loading="lazy" decoding="async" />
+                      </picture>
                     ) : (
                       <span className="text-5xl">🦸</span>
                     )}
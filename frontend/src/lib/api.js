@@ -14,6 +14,31 @@ const getClient = () => axios.create({
   },
 });
 
+// One key per user action: the caller creates it and passes the same key to
+// every attempt of that action (double taps, retries after a timeout)
+export const newIdempotencyKey = () => (
+  window.crypto && window.crypto.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+);
+
+const IDEMPOTENT_RETRIES = 2;
+
+// Retries requests that got no response (timeout, dropped connection) with the same key
+const postIdempotent = async (path, body, idempotencyKey) => {
+  for (let attempt = 0; ; attempt += 1) {
+    try {
+      return await getClient().post(path, body, {
+        headers: { 'Idempotency-Key': idempotencyKey },
+      });
+    } catch (error) {
+      if (error.response || attempt >= IDEMPOTENT_RETRIES) {
+        throw error;
+      }
+    }
+  }
+};
+
 export const api = {
   // User endpoints
   registerUser: async (userData) => {
@@ -31,14 +56,24 @@ export const api = {
     return response.data;
   },
 
+  // Home screen: user, progress, quests, goals and daily XP in one request
+  getBootstrap: async (tgId) => {
+    const response = await getClient().get(`/users/${tgId}/bootstrap`);
+    return response.data;
+  },
+
   // Progress endpoints
   getProgress: async (tgId) => {
     const response = await getClient().get(`/users/${tgId}/progress`);
     return response.data;
   },
-  getGoals: async (tgId) => {
-    const response = await getClient().get(`/users/${tgId}/goals`);
-    return response.data;
+  // params: { status: 'active' | 'completed' | 'archived', limit, cursor, fields }
+  getGoals: async (tgId, params = {}) => {
+    const response = await getClient().get(`/users/${tgId}/goals`, { params });
+    return {
+      items: response.data,
+      nextCursor: response.headers['x-next-cursor'] || null,
+    };
   },
   createGoal: async (tgId, data) => {
     const response = await getClient().post(`/users/${tgId}/goals`, data);
@@ -56,6 +91,11 @@ export const api = {
     const response = await getClient().get(`/users/${tgId}/daily-xp`);
     return response.data;
   },
+  // Per-day quests/XP for charts plus current and best streak
+  getStatsHistory: async (tgId, days = 30) => {
+    const response = await getClient().get(`/users/${tgId}/stats/history`, { params: { days } });
+    return response.data;
+  },
 
   // Quest endpoints
   getQuests: async (tgId) => {
@@ -63,10 +103,17 @@ export const api = {
     return response.data;
   },
 
-  completeQuest: async (tgId, questId) => {
-    const response = await getClient().post(`/users/${tgId}/quests/complete`, {
+  completeQuest: async (tgId, questId, idempotencyKey) => {
+    const response = await postIdempotent(`/users/${tgId}/quests/complete`, {
       quest_id: questId,
-    });
+    }, idempotencyKey);
+    return response.data;
+  },
+
+  completeQuestsBatch: async (tgId, questIds, idempotencyKey) => {
+    const response = await postIdempotent(`/users/${tgId}/quests/complete-batch`, {
+      quest_ids: questIds,
+    }, idempotencyKey);
     return response.data;
   },
 
@@ -0,0 +1,96 @@
+// Resized avatar variants (AVIF/WebP at several widths) and their blurhash
+// placeholder, as rendered by the backend's avatar_variants job
+
+const BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~';
+
+// srcSet per format for <picture>; empty until the variants have been rendered
+export const avatarSources = (user) => {
+  const variants = Array.isArray(user?.avatar_variants) ? user.avatar_variants : [];
+  return ['avif', 'webp']
+    .map((format) => ({
+      type: `image/${format}`,
+      srcSet: variants
+        .filter((variant) => variant.format === format)
+        .sort((a, b) => a.width - b.width)
+        .map((variant) => `${variant.url} ${variant.width}w`)
+        .join(', '),
+    }))
+    .filter((source) => source.srcSet);
+};
+
+const decode83 = (text) => {
+  let value = 0;
+  for (const char of text) {
+    value = value * 83 + BASE83.indexOf(char);
+  }
+  return value;
+};
+
+const srgbToLinear = (value) => {
+  const v = value / 255;
+  return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+};
+
+const linearToSrgb = (value) => {
+  const v = Math.max(0, Math.min(1, value));
+  return v <= 0.0031308
+    ? Math.round(v * 12.92 * 255)
+    : Math.round((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255);
+};
+
+const signPow = (value, exponent) => Math.sign(value) * Math.pow(Math.abs(value), exponent);
+
+// Tiny data URL of a blurhash, stretched by CSS as a placeholder; '' if it cannot be drawn
+export const blurhashToDataUrl = (hash, width = 18, height = 32) => {
+  if (!hash || hash.length < 6 || typeof document === 'undefined') return '';
+  const sizeFlag = decode83(hash[0]);
+  const numX = (sizeFlag % 9) + 1;
+  const numY = Math.floor(sizeFlag / 9) + 1;
+  if (hash.length !== 4 + 2 * numX * numY) return '';
+
+  const maxValue = (decode83(hash[1]) + 1) / 166;
+  const colors = [];
+  for (let i = 0; i < numX * numY; i += 1) {
+    if (i === 0) {
+      const dc = decode83(hash.substring(2, 6));
+      colors.push([srgbToLinear(dc >> 16), srgbToLinear((dc >> 8) & 255), srgbToLinear(dc & 255)]);
+    } else {
+      const ac = decode83(hash.substring(4 + i * 2, 6 + i * 2));
+      colors.push([
+        signPow((Math.floor(ac / 361) - 9) / 9, 2) * maxValue,
+        signPow(((Math.floor(ac / 19) % 19) - 9) / 9, 2) * maxValue,
+        signPow(((ac % 19) - 9) / 9, 2) * maxValue,
+      ]);
+    }
+  }
+
+  const canvas = document.createElement('canvas');
+  canvas.width = width;
+  canvas.height = height;
+  const context = canvas.getContext('2d');
+  if (!context) return '';
+  const image = context.createImageData(width, height);
+  for (let y = 0; y < height; y += 1) {
+    for (let x = 0; x < width; x += 1) {
+      let r = 0;
+      let g = 0;
+      let b = 0;
+      for (let j = 0; j < numY; j += 1) {
+        for (let i = 0; i < numX; i += 1) {
+          const basis = Math.cos((Math.PI * x * i) / width) * Math.cos((Math.PI * y * j) / height);
+          const color = colors[i + j * numX];
+          r += color[0] * basis;
+          g += color[1] * basis;
+          b += color[2] * basis;
+        }
+      }
+      const offset = 4 * (x + y * width);
+      image.data[offset] = linearToSrgb(r);
+      image.data[offset + 1] = linearToSrgb(g);
+      image.data[offset + 2] = linearToSrgb(b);
+      image.data[offset + 3] = 255;
+    }
+  }
+  context.putImageData(image, 0, 0);
+  return canvas.toDataURL();
+};